@@ -1,22 +1,59 @@
 """Accountant Agent for managing transactions and tax calculations."""
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Dict, Any, Optional
-from supabase import create_client, Client
+from typing import Dict, Any, List, Optional
+from supabase import create_client, Client, ClientOptions
 
 from app.core.config import settings
+from app.services import deduction_ledger, deduction_recompute, deduction_rules
+from app.services.dashboard_cache import dashboard_cache
+from app.services.tax_rule_cache import tax_rule_cache
+from app.utils.tracing import traced_http_client
 
 
 if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
     raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY in environment variables")
 
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+supabase: Client = create_client(
+    settings.SUPABASE_URL,
+    settings.SUPABASE_KEY,
+    options=ClientOptions(httpx_client=traced_http_client()),
+)
 
 
-def get_tax_rule_by_category(category_name: str, tax_year: int = None) -> Optional[Dict[str, Any]]:
-    """Fetch tax rule from database by category name and tax year."""
+def get_active_tax_rules() -> Optional[List[Dict[str, Any]]]:
+    """Return every active tax rule from the tax rule cache.
+
+    Returns None if the rules could not be loaded, so callers fall back to
+    per-category queries.
+    """
+    return tax_rule_cache.get_rules()
+
+
+def get_tax_rule_by_category(category_name: str, tax_year: int = None,
+                             rules: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+    """Fetch tax rule by category name and tax year.
+
+    Served from the tax rule cache, or from rules (from
+    get_active_tax_rules) if given. The database is only queried while
+    the cache has never been loaded.
+    """
     if tax_year is None:
         tax_year = settings.DEFAULT_TAX_YEAR
     
+    if rules is None and tax_rule_cache.ensure_loaded():
+        return tax_rule_cache.get_by_category(category_name, tax_year)
+    
+    if rules is not None:
+        matches = [rule for rule in rules if rule.get("category_name") == category_name]
+        for rule in matches:
+            if rule.get("tax_year") == tax_year:
+                return rule
+        if matches:
+            print(f"Warning: Using tax rule without year filter for {category_name}")
+            return matches[0]
+        return None
+    
     try:
         response = supabase.table("tax_rules").select("*").eq(
             "category_name", category_name
@@ -40,46 +77,61 @@ def get_tax_rule_by_category(category_name: str, tax_year: int = None) -> Option
         return None
 
 
-def calculate_deductible_amount(total_amount: float, category_name: str) -> Dict[str, Any]:
+def calculate_deductible_amount(total_amount: float, category_name: str,
+                                rules: Optional[List[Dict[str, Any]]] = None,
+                                transaction_date: Optional[str] = None,
+                                income: Optional[float] = None,
+                                user_id: Optional[str] = None) -> Dict[str, Any]:
     """Calculate deductible amount based on tax rules.
     
+    Applies the compiled deduction rule for the category (see
+    deduction_rules.evaluate): category, group and income-relative caps,
+    the Education/Sports multiplier and the Easy E-Receipt period.
+    
+    Args:
+        total_amount: Amount paid
+        category_name: Tax category from Tax Expert
+        rules: Prefetched active tax rules (see get_active_tax_rules)
+        transaction_date: Receipt date (YYYY-MM-DD), checked against
+            time-limited categories
+        income: Annual income, for income-relative caps
+        user_id: Cap against what this user has already claimed in the
+            receipt's tax year (from the deduction ledger) instead of
+            the full limits
+    
     Returns:
-        Dict with 'amount', 'is_capped', 'max_limit' keys
+        Dict with 'amount', 'is_capped', 'max_limit', 'eligible',
+        'capped_by' and 'reason' keys
     """
-    tax_rule = get_tax_rule_by_category(category_name)
+    tax_rule = get_tax_rule_by_category(category_name, rules=rules)
     
     if not tax_rule:
         return {
             "amount": 0.0,
             "is_capped": False,
-            "max_limit": 0.0
+            "max_limit": 0.0,
+            "eligible": False,
+            "capped_by": None,
+            "reason": f"No tax rule for category '{category_name}'"
         }
     
-    max_limit = tax_rule.get("max_limit", 0.0)
-
-    # Donations with max_limit=0 means income-based limit (use actual amount)
-    if max_limit == 0:
-        category = tax_rule.get("category_name", "")
-        if "Education" in category or "Sports" in category:
-            # Education/Sports donations get 2x deduction
-            deductible = total_amount * 2
-        else:
-            # General donations or other income-based: use actual amount
-            deductible = total_amount
-        return {
-            "amount": deductible,
-            "is_capped": False,
-            "max_limit": max_limit
-        }
-
-    deductible = min(total_amount, max_limit)
-    is_capped = total_amount > max_limit
+    rule = deduction_rules.compiled_rule(tax_rule)
+    claimed = group_claimed = 0.0
+    table = deduction_rules.get_rule_table() if user_id else None
+    if table:
+        tax_year = deduction_recompute.tax_year_of(transaction_date)
+        if deduction_ledger.ensure_year(user_id, tax_year):
+            claimed = deduction_ledger.claimed(user_id, tax_year, rule.category)
+            group_claimed = deduction_ledger.group_claimed(user_id, tax_year, rule, table)
     
-    return {
-        "amount": deductible,
-        "is_capped": is_capped,
-        "max_limit": max_limit
-    }
+    return deduction_rules.evaluate(
+        rule,
+        total_amount,
+        transaction_date=transaction_date,
+        income=income,
+        claimed=claimed,
+        group_claimed=group_claimed
+    )
 
 
 def insert_transaction(
@@ -92,7 +144,8 @@ def insert_transaction(
     receipt_image_url: Optional[str] = None,
     status: str = "needs_review",
     is_deductible: bool = True,
-    ai_reasoning: Optional[str] = None
+    ai_reasoning: Optional[str] = None,
+    tax_rules: Optional[List[Dict[str, Any]]] = None
 ) -> Dict[str, Any]:
     """Insert a new transaction into the database.
     
@@ -107,6 +160,7 @@ def insert_transaction(
         status: Transaction status (default: needs_review)
         is_deductible: Whether the Tax Expert determined this is deductible
         ai_reasoning: Tax Expert's reasoning for the classification
+        tax_rules: Prefetched active tax rules (see get_active_tax_rules)
     
     Returns:
         Dict containing success status and transaction data or error message
@@ -131,13 +185,14 @@ def insert_transaction(
             }
 
             # Try to attach a rule_id if the category exists
-            tax_rule = get_tax_rule_by_category(category_name)
+            tax_rule = get_tax_rule_by_category(category_name, rules=tax_rules)
             if tax_rule:
                 transaction_data["rule_id"] = tax_rule["id"]
 
             response = supabase.table("transactions").insert(transaction_data).execute()
 
             if response.data:
+                dashboard_cache.bump(user_id)
                 return {
                     "success": True,
                     "transaction": response.data[0],
@@ -150,7 +205,7 @@ def insert_transaction(
                 "error": "Failed to insert transaction - no data returned"
             }
 
-        tax_rule = get_tax_rule_by_category(category_name)
+        tax_rule = get_tax_rule_by_category(category_name, rules=tax_rules)
         
         if not tax_rule:
             # Tax rule not found in DB - save transaction but flag for review
@@ -171,6 +226,7 @@ def insert_transaction(
             response = supabase.table("transactions").insert(transaction_data).execute()
 
             if response.data:
+                dashboard_cache.bump(user_id)
                 return {
                     "success": True,
                     "transaction": response.data[0],
@@ -186,32 +242,53 @@ def insert_transaction(
         rule_id = tax_rule["id"]
         print(f"Tax rule found: id={rule_id}, category={category_name}")
         
-        calc_result = calculate_deductible_amount(total_amount, category_name)
-        deductible_amount = calc_result["amount"]
-        is_capped = calc_result["is_capped"]
-        max_limit = calc_result["max_limit"]
+        # Income-relative caps use the profile's annual income, as recompute does (cached by the ledger)
+        income = deduction_ledger.income(user_id)
         
-        print(f"Calculated deductible: {deductible_amount} THB (capped: {is_capped})")
+        # Cap against what the user has left this year; one save per user at a time
+        with deduction_ledger.user_lock(user_id):
+            calc_result = calculate_deductible_amount(
+                total_amount, category_name, rules=tax_rules, transaction_date=transaction_date,
+                income=income, user_id=user_id
+            )
+            deductible_amount = calc_result["amount"]
+            is_capped = calc_result["is_capped"]
+            max_limit = calc_result["max_limit"]
         
-        transaction_data = {
-            "user_id": user_id,
-            "rule_id": rule_id,
-            "receipt_image_url": receipt_image_url,
-            "merchant_name": merchant_name,
-            "merchant_tax_id": merchant_tax_id,
-            "transaction_date": transaction_date,
-            "total_amount": total_amount,
-            "deductible_amount": deductible_amount,
-            "status": status,
-            "ai_reasoning": ai_reasoning
-        }
+            # Outside the category's period (e.g. Easy E-Receipt): keep the category, deduct nothing
+            if not calc_result["eligible"]:
+                print(f"Rule check: {calc_result['reason']}, saving with deductible_amount=0")
+                status = "not_deductible"
+                ai_reasoning = f"{ai_reasoning} {calc_result['reason']}." if ai_reasoning else f"{calc_result['reason']}."
         
-        print(f"Inserting transaction: {transaction_data}")
+            print(f"Calculated deductible: {deductible_amount} THB (capped: {is_capped})")
         
-        response = supabase.table("transactions").insert(transaction_data).execute()
+            transaction_data = {
+                "user_id": user_id,
+                "rule_id": rule_id,
+                "receipt_image_url": receipt_image_url,
+                "merchant_name": merchant_name,
+                "merchant_tax_id": merchant_tax_id,
+                "transaction_date": transaction_date,
+                "total_amount": total_amount,
+                "deductible_amount": deductible_amount,
+                "status": status,
+                "ai_reasoning": ai_reasoning
+            }
+        
+            print(f"Inserting transaction: {transaction_data}")
+        
+            response = supabase.table("transactions").insert(transaction_data).execute()
+            if response.data:
+                deduction_ledger.record(response.data[0])
         
         if response.data:
-            if is_capped:
+            dashboard_cache.bump(user_id)
+            if not calc_result["eligible"]:
+                message = f"Transaction saved as not deductible. {calc_result['reason']}"
+            elif is_capped and calc_result["reason"]:
+                message = f"Transaction saved. Amount: {total_amount:,.2f} THB, Deductible: {deductible_amount:,.2f} THB ({calc_result['reason']})"
+            elif is_capped:
                 message = f"Transaction saved. Amount: {total_amount:,.2f} THB, Deductible: {deductible_amount:,.2f} THB (capped at {max_limit:,.2f} THB limit)"
             else:
                 message = f"Transaction saved. Deductible amount: {deductible_amount:,.2f} THB"
@@ -256,28 +333,51 @@ def update_transaction(
     """
     try:
         recalculated = False
-        if "total_amount" in updates:
-            current = supabase.table("transactions").select("rule_id").eq("id", transaction_id).execute()
-            
-            if current.data:
-                rule = supabase.table("tax_rules").select("category_name").eq("id", current.data[0]["rule_id"]).execute()
+        current = None
+        if any(field in updates for field in ("total_amount", "transaction_date", "status")):
+            current = supabase.table("transactions").select(
+                "user_id, rule_id, transaction_date, total_amount"
+            ).eq("id", transaction_id).execute()
+        
+        # Same lock as insert_transaction and recompute, so the user's year is not capped twice at once
+        lock = deduction_ledger.user_lock(current.data[0]["user_id"]) if current and current.data else nullcontext()
+        with lock:
+            if current and current.data:
+                rule = tax_rule_cache.get_by_id(current.data[0]["rule_id"])
                 
-                if rule.data:
-                    category_name = rule.data[0]["category_name"]
+                if rule:
+                    category_name = rule["category_name"]
                     calc_result = calculate_deductible_amount(
-                        updates["total_amount"],
-                        category_name
+                        updates.get("total_amount", current.data[0].get("total_amount", 0)),
+                        category_name,
+                        transaction_date=updates.get("transaction_date", current.data[0].get("transaction_date"))
                     )
                     updates["deductible_amount"] = calc_result["amount"]
                     recalculated = True
-        
-        response = supabase.table("transactions").update(updates).eq("id", transaction_id).execute()
+            
+            response = supabase.table("transactions").update(updates).eq("id", transaction_id).execute()
+            if response.data:
+                deduction_ledger.record(response.data[0])
         
         if response.data:
             updated_transaction = response.data[0]
             message = "Transaction updated successfully"
             
-            if recalculated:
+            # Caps are cumulative, so the rest of the user's year may change too
+            # (recompute takes the user's lock itself)
+            if current and current.data:
+                for tax_year in {deduction_recompute.tax_year_of(current.data[0].get("transaction_date")),
+                                 deduction_recompute.tax_year_of(updated_transaction.get("transaction_date"))}:
+                    recomputed = deduction_recompute.recompute(tax_year, user_id=current.data[0]["user_id"])
+                    changed = recomputed.get("changed", {})
+                    if str(transaction_id) in changed:
+                        updated_transaction["deductible_amount"] = changed[str(transaction_id)]
+            
+            dashboard_cache.bump(updated_transaction.get("user_id"))
+            
+            if recalculated and not calc_result["eligible"]:
+                message += f" ({calc_result['reason']})"
+            elif recalculated:
                 total = updated_transaction.get("total_amount", 0)
                 deductible = updated_transaction.get("deductible_amount", 0)
                 if total > deductible:
@@ -337,7 +437,8 @@ def save_receipt_from_inspector(
     receipt_data: Dict[str, Any],
     category_name: str = "Health Insurance",
     receipt_image_url: str = None,
-    tax_result: Optional[Dict[str, Any]] = None
+    tax_result: Optional[Dict[str, Any]] = None,
+    tax_rules: Optional[List[Dict[str, Any]]] = None
 ) -> Dict[str, Any]:
     """Save transaction from Inspector Agent output.
     
@@ -347,6 +448,7 @@ def save_receipt_from_inspector(
         category_name: Tax category from Tax Expert
         receipt_image_url: URL to the receipt image in Supabase Storage
         tax_result: Structured output from Tax Expert (is_deductible, category, reasoning)
+        tax_rules: Prefetched active tax rules (see get_active_tax_rules)
     
     Returns:
         Dict containing success status and transaction data
@@ -354,7 +456,7 @@ def save_receipt_from_inspector(
     try:
         transaction_date = receipt_data.get("date", "")
         total_amount = receipt_data.get("amount", 0)
-        merchant_tax_id = receipt_data.get("tax_id", "")
+        merchant_tax_id = receipt_data.get("tax_id") or ""
         merchant_name = receipt_data.get("merchant_name", "Unknown Merchant")
         
         # Validate required fields
@@ -397,7 +499,8 @@ def save_receipt_from_inspector(
             receipt_image_url=receipt_image_url,
             status="verified",
             is_deductible=is_deductible,
-            ai_reasoning=ai_reasoning
+            ai_reasoning=ai_reasoning,
+            tax_rules=tax_rules
         )
         
         return result
@@ -6,10 +6,32 @@ from google import genai
 from google.genai import types
 
 from app.core.config import settings
+from app.utils.singleflight import single_flight
+from app.utils.tracing import span
 
 
 genai_client = genai.Client(api_key=settings.GEMINI_API_KEY)
 
+# Leading bytes of the image formats Gemini Vision accepts
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def detect_image_type(image_data: bytes):
+    """Return the MIME type of image bytes from their signature, or None."""
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if image_data.startswith(signature):
+            return mime_type
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return "image/webp"
+    if image_data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return None
+
 
 def load_image(image_path):
     """Load image file and return as bytes."""
@@ -21,8 +43,12 @@ def load_image(image_path):
         return None
 
 
+@single_flight("extract_receipt_from_bytes", key=lambda image_data: image_data)
 def extract_receipt_from_bytes(image_data: bytes):
-    """Extract receipt data from image bytes (supports base64)."""
+    """Extract receipt data from image bytes (supports base64).
+
+    Concurrent calls with the same image share one Gemini request.
+    """
     prompt = """Analyze this receipt or e-Tax invoice image and extract the following information.
 Return ONLY a valid JSON object with these exact fields:
 
@@ -45,16 +71,21 @@ Rules:
 JSON:"""
     
     try:
-        response = genai_client.models.generate_content(
-            model=settings.GEMINI_MODEL,
-            contents=[
-                types.Part.from_bytes(
-                    data=image_data,
-                    mime_type="image/jpeg"
-                ),
-                prompt
-            ]
-        )
+        with span("gemini.generate", kind="client", model=settings.GEMINI_MODEL,
+                  label="inspector", image_bytes=len(image_data)) as s:
+            response = genai_client.models.generate_content(
+                model=settings.GEMINI_MODEL,
+                contents=[
+                    types.Part.from_bytes(
+                        data=image_data,
+                        mime_type=detect_image_type(image_data) or "image/jpeg"
+                    ),
+                    prompt
+                ]
+            )
+            usage = getattr(response, "usage_metadata", None)
+            s.set(prompt_tokens=getattr(usage, "prompt_token_count", None),
+                  output_tokens=getattr(usage, "candidates_token_count", None))
         
         response_text = response.text.strip()
         
@@ -2,21 +2,33 @@
 import json
 import time
 from datetime import datetime
-from typing import Dict, Any
-
-import chromadb
-from google import genai
+from typing import Dict, Any, List, Optional, Tuple
 
 from app.core.config import settings
+from app.services import retrieval
+from app.services.answer_cache import answer_cache
+from app.services.context_builder import assemble_context
+from app.services.llm import PREFIX_SEPARATOR, generate_text
+from app.services.index_snapshots import snapshot_manager
+from app.services.tax_categories import detect_category
+from app.utils.singleflight import single_flight
+from app.utils.tokens import count_tokens
 
 MAX_RETRIES = 3
 RETRY_BASE_DELAY = 3  # seconds
 
+# Category group -> domain-specific RAG query
+DOMAIN_QUERIES = {
+    "Donation": "เงินบริจาค donation หักลดหย่อน การศึกษา กีฬา e-Donation",
+    "Insurance": "เบี้ยประกันสุขภาพ เบี้ยประกันชีวิต หักลดหย่อน health life insurance",
+    "Fund": "กองทุน SSF RMF Thai ESG หักลดหย่อน",
+    "Social Security": "ประกันสังคม เงินสมทบ หักลดหย่อน social security",
+    "Home Loan": "ดอกเบี้ยเงินกู้ยืมเพื่อซื้อที่อยู่อาศัย หักลดหย่อน home loan interest",
+    "Easy E-Receipt": "Easy E-Receipt ใบกำกับภาษีอิเล็กทรอนิกส์ e-Tax Invoice ซื้อสินค้า",
+}
 
-genai_client = genai.Client(api_key=settings.GEMINI_API_KEY)
-
-chroma_client = chromadb.PersistentClient(path=str(settings.EMBEDDINGS_DIR))
-collection = chroma_client.get_or_create_collection(name=settings.CHROMA_COLLECTION_NAME)
+# Merchant-independent overview query; the tax year is appended
+OVERVIEW_QUERY = "ค่าลดหย่อนภาษี tax deduction categories"
 
 DEFAULT_RESULT: Dict[str, Any] = {
     "is_deductible": False,
@@ -25,46 +37,37 @@ DEFAULT_RESULT: Dict[str, Any] = {
 }
 
 
-def retrieve_context(query: str, n_results: int = None) -> list:
-    """Retrieve relevant context from vector database."""
-    if n_results is None:
-        n_results = settings.RAG_N_RESULTS
-
-    try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
+def retrieve_context(query: str, n_results: int = None, where: Optional[Dict[str, Any]] = None) -> list:
+    """Retrieve relevant chunks from the knowledge base.
 
-        if results.get("documents"):
-            chunks = []
-            for doc_list in results["documents"]:
-                chunks.extend(doc_list)
-            return chunks
+    Args:
+        query: Search text.
+        n_results: Number of chunks to return (default: settings.RAG_N_RESULTS).
+        where: Optional metadata filter, see retrieval.build_where.
 
-        return []
+    Returns:
+        Hits from retrieval.search, most relevant first.
+    """
+    try:
+        return retrieval.search(query, n_results=n_results, where=where)
 
     except Exception as e:
         print(f"Error retrieving context: {e}")
         return []
 
 
-def build_tax_expert_prompt(receipt_data: Dict[str, Any], context: str) -> str:
-    """Build a prompt that forces Gemini to return ONLY a JSON object.
+def build_tax_knowledge_prompt(tax_year: int = None) -> str:
+    """Build the static part of the classifier prompt for a tax year.
 
-    The prompt instructs the model to classify the receipt against
-    Thai tax deduction rules using both RAG context and base knowledge.
+    It holds the instructions, base knowledge and response schema, and is
+    identical for every receipt of the year. It goes first in the prompt
+    so Gemini's implicit prefix caching can reuse it across receipts.
     """
-    ce_year = settings.DEFAULT_TAX_YEAR
+    ce_year = tax_year or settings.DEFAULT_TAX_YEAR
     be_year = ce_year + 543
 
     prompt = f"""You are a Thai tax deduction classifier.
-Analyze the receipt data below and determine its deductibility.
-
-Receipt Data:
-- Date: {receipt_data.get("date", "N/A")}
-- Amount: {receipt_data.get("amount", "N/A")}
-- Merchant: {receipt_data.get("merchant_name", "N/A")}
+Analyze the receipt data given at the end and determine its deductibility.
 
 IMPORTANT:
 - The receipt was uploaded as a scanned document. Assume it is a valid e-Tax Invoice or e-Receipt.
@@ -91,19 +94,17 @@ TIME-LIMITED deductions:
 13. Easy E-Receipt 2.0: Purchases with e-Tax Invoice/e-Receipt.
     Period: Jan 16 - Feb 28 of the tax year. Max 50,000 THB.
 
---- Retrieved Tax Rules Context (from knowledge base) ---
-{context}
-
 Respond with ONLY a valid JSON object using this exact schema (no markdown, no code fences, no extra text):
 {{"is_deductible": true or false, "category": "one of the categories below or None", "reasoning": "brief explanation"}}
 
 Valid categories: "Easy E-Receipt", "Thai ESG", "Life Insurance", "Health Insurance", "Pension Insurance", "Social Security", "Provident Fund", "SSF", "RMF", "Home Loan Interest", "Donation (General)", "Donation (Education/Sports)", "None"
 
 Rules:
-- Classify based on merchant name, amount, and date against the categories above.
-- For Easy E-Receipt, verify the receipt date falls within Jan 16 - Feb 28 of the current tax year.
-- For insurance (health, life, pension), the receipt is deductible if the date is within the tax year. These are NOT time-limited.
+- Classify based on merchant name and receipt type against the categories above.
+- Only decide the category. Do not check the Easy E-Receipt period or any limit: they are applied to the amount and date after classification.
+- For insurance (health, life, pension), these are NOT time-limited.
 - For donations, identify from merchant name (e.g. foundations, temples, charities). These are NOT time-limited.
+- Also use the retrieved tax rules context given with the receipt.
 - Set is_deductible to true if the receipt plausibly qualifies under any category.
 - Set category to "None" only if the receipt clearly does not match any deduction category.
 - Keep reasoning under 2 sentences."""
@@ -111,6 +112,31 @@ Rules:
     return prompt
 
 
+def build_receipt_prompt(receipt_data: Dict[str, Any], context: str) -> str:
+    """Build the per-request part of the classifier prompt."""
+    return f"""--- Retrieved Tax Rules Context (from knowledge base) ---
+{context}
+
+Receipt Data:
+- Date: {receipt_data.get("date", "N/A")}
+- Amount: {receipt_data.get("amount", "N/A")}
+- Merchant: {receipt_data.get("merchant_name", "N/A")}
+
+Respond with ONLY the JSON object."""
+
+
+def build_tax_expert_prompt(receipt_data: Dict[str, Any], context: str) -> str:
+    """Build a prompt that forces Gemini to return ONLY a JSON object.
+
+    The prompt instructs the model to classify the receipt against
+    Thai tax deduction rules using both RAG context and base knowledge.
+    The static knowledge prefix comes first, followed by the receipt and
+    its retrieved context.
+    """
+    tax_year = retrieval.tax_year_from_date(receipt_data.get("date", ""))
+    return build_tax_knowledge_prompt(tax_year) + PREFIX_SEPARATOR + build_receipt_prompt(receipt_data, context)
+
+
 def _parse_json_response(raw_text: str) -> Dict[str, Any]:
     """Parse a JSON object from Gemini's raw text response."""
     text = raw_text.strip()
@@ -131,7 +157,76 @@ def _parse_json_response(raw_text: str) -> Dict[str, Any]:
     }
 
 
-def ask_tax_expert(receipt_data: Dict[str, Any]) -> Dict[str, Any]:
+def _normalize_text(text: Any) -> str:
+    """Lowercase and collapse whitespace, for single-flight keys."""
+    return " ".join(str(text or "").lower().split())
+
+
+def _receipt_key(receipt_data: Dict[str, Any], prefetched: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Single-flight key of the receipt fields the classifier reads."""
+    amount = receipt_data.get("amount")
+    try:
+        amount = round(float(amount), 2)
+    except (TypeError, ValueError):
+        amount = _normalize_text(amount)
+
+    return {
+        "merchant_name": _normalize_text(receipt_data.get("merchant_name")),
+        "amount": amount,
+        "date": str(receipt_data.get("date") or "")[:10],
+    }
+
+
+def build_expert_queries(merchant: str, tax_year: int, candidate: Optional[str]) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+    """Build the classifier's RAG queries and their metadata filters.
+
+    The first query is merchant-specific; the overview and domain queries
+    only depend on the tax year and candidate category, so they can be
+    prefetched before OCR finishes (see prefetch_tax_context).
+
+    Returns:
+        List of (query, where) pairs.
+    """
+    year_filter = retrieval.build_where(tax_year=tax_year)
+    category_filter = retrieval.build_where(tax_year=tax_year, category=candidate or "Easy E-Receipt")
+
+    return [
+        (f"หักลดหย่อน {merchant}", category_filter),
+        (f"{OVERVIEW_QUERY} {tax_year}", year_filter),
+        (DOMAIN_QUERIES.get(candidate, DOMAIN_QUERIES["Easy E-Receipt"]), category_filter),
+    ]
+
+
+def prefetch_tax_context(tax_year: int = None) -> Dict[str, Any]:
+    """Run the merchant-independent classifier queries ahead of OCR.
+
+    This is speculative: receipts are assumed to be from the current tax
+    year and not from a detected category (the most common case).
+    ask_tax_expert only reuses a prefetched result whose query and filter
+    match its own, and runs any other query itself.
+
+    Returns:
+        Dict with 'tax_year', 'results' (list of {'query', 'where', 'hits'})
+        and 'elapsed_ms'.
+    """
+    start = time.perf_counter()
+    if tax_year is None:
+        tax_year = settings.DEFAULT_TAX_YEAR
+
+    with retrieval.pin_snapshot():
+        results = [
+            {"query": query, "where": where, "hits": retrieve_context(query, n_results=3, where=where)}
+            for query, where in build_expert_queries("", tax_year, None)[1:]
+        ]
+    return {
+        "tax_year": tax_year,
+        "results": results,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+@single_flight("ask_tax_expert", key=_receipt_key)
+def ask_tax_expert(receipt_data: Dict[str, Any], prefetched: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """Analyze receipt data for tax deductibility using RAG.
 
     Uses multiple RAG queries to retrieve both merchant-specific and
@@ -139,6 +234,7 @@ def ask_tax_expert(receipt_data: Dict[str, Any]) -> Dict[str, Any]:
 
     Args:
         receipt_data: Dict with receipt fields (date, amount, merchant_name).
+        prefetched: Result of prefetch_tax_context, if it ran during OCR.
 
     Returns:
         Dict with keys: is_deductible (bool), category (str), reasoning (str).
@@ -147,55 +243,48 @@ def ask_tax_expert(receipt_data: Dict[str, Any]) -> Dict[str, Any]:
     amount = receipt_data.get("amount", "")
     date = receipt_data.get("date", "")
 
+    # Narrow retrieval to the receipt's tax year and candidate category
+    tax_year = retrieval.tax_year_from_date(date)
+    candidate = detect_category(merchant, default=None)
+
     # Build multiple queries to cover different angles of the knowledge base
-    queries = [
-        f"หักลดหย่อน {merchant}",
-        f"ค่าลดหย่อนภาษี tax deduction categories {date}",
-    ]
+    with retrieval.pin_snapshot():
+        queries = build_expert_queries(merchant, tax_year, candidate)
+
+        print(f"Tax Expert RAG queries: {[q for q, _ in queries]} (tax_year={tax_year}, category={candidate})")
+
+        prefetched_hits = {
+            (result["query"], json.dumps(result["where"], sort_keys=True)): result["hits"]
+            for result in (prefetched or {}).get("results", [])
+        }
+        result_lists = []
+        for q, where in queries:
+            key = (q, json.dumps(where, sort_keys=True))
+            result_lists.append(
+                prefetched_hits[key] if key in prefetched_hits else retrieve_context(q, n_results=3, where=where)
+            )
+    if prefetched is not None:
+        reused = sum((q, json.dumps(where, sort_keys=True)) in prefetched_hits for q, where in queries)
+        print(f"Reused {reused}/{len(queries)} prefetched RAG queries")
 
-    # Add domain-specific query based on merchant name keywords
-    merchant_lower = merchant.lower()
-    if any(kw in merchant_lower for kw in ["มูลนิธิ", "บริจาค", "donation", "สภากาชาด", "foundation", "วัด", "temple", "charity"]):
-        queries.append("เงินบริจาค donation หักลดหย่อน การศึกษา กีฬา e-Donation")
-    elif any(kw in merchant_lower for kw in ["ประกัน", "insurance", "สุขภาพ", "ชีวิต", "premium"]):
-        queries.append("เบี้ยประกันสุขภาพ เบี้ยประกันชีวิต หักลดหย่อน health life insurance")
-    elif any(kw in merchant_lower for kw in ["กองทุน", "fund", "ssf", "rmf", "esg"]):
-        queries.append("กองทุน SSF RMF Thai ESG หักลดหย่อน")
-    elif any(kw in merchant_lower for kw in ["ประกันสังคม", "สปส", "sso", "social security"]):
-        queries.append("ประกันสังคม เงินสมทบ หักลดหย่อน social security")
-    else:
-        queries.append("Easy E-Receipt ใบกำกับภาษีอิเล็กทรอนิกส์ e-Tax Invoice ซื้อสินค้า")
-
-    print(f"Tax Expert RAG queries: {queries}")
-
-    # Retrieve context from all queries and deduplicate
-    all_chunks = []
-    seen = set()
-    for q in queries:
-        chunks = retrieve_context(q, n_results=3)
-        for chunk in chunks:
-            chunk_key = chunk[:100]
-            if chunk_key not in seen:
-                seen.add(chunk_key)
-                all_chunks.append(chunk)
-
-    if not all_chunks:
+    # Merge the hits of all queries by rank, then pack them into the token budget
+    hits = retrieval.reciprocal_rank_fusion(result_lists)
+
+    if not hits:
         return {
             **DEFAULT_RESULT,
             "reasoning": "No relevant tax rules found in the knowledge base.",
         }
 
-    print(f"Found {len(all_chunks)} unique context chunks")
+    packed = assemble_context([hit["text"] for hit in hits])
+    print(f"Packed {len(packed['chunks'])}/{len(hits)} context chunks ({packed['tokens']} tokens, "
+          f"{packed['duplicates']} duplicates, {packed['over_budget']} over budget)")
 
-    context = "\n\n".join(all_chunks)
-    prompt = build_tax_expert_prompt(receipt_data, context)
+    prompt = build_tax_expert_prompt(receipt_data, packed["context"])
 
     for attempt in range(MAX_RETRIES):
         try:
-            response = genai_client.models.generate_content(
-                model=f"models/{settings.GEMINI_MODEL}",
-                contents=prompt,
-            )
+            response = generate_text(prompt, label="ask_tax_expert")
 
             return _parse_json_response(response.text)
 
@@ -219,26 +308,64 @@ def ask_tax_expert(receipt_data: Dict[str, Any]) -> Dict[str, Any]:
             }
 
 
-def ask_tax_question(question: str) -> str:
-    """Answer a free-text tax question using RAG (conversational mode).
+NO_CONTEXT_ANSWER = "No relevant information found in the knowledge base."
+
+
+def _hit_sources(hits: list) -> list:
+    """Return the unique (source, page) references of retrieved hits, in order."""
+    sources = []
+    for hit in hits:
+        metadata = hit.get("metadata") or {}
+        source = {"source": metadata.get("source"), "page": metadata.get("page")}
+        if source not in sources:
+            sources.append(source)
+    return sources
+
 
-    This is used by the chat endpoint for general tax Q&A.
+def question_tax_year(question: str) -> int:
+    """Return the tax year a question is about (default: the current tax year)."""
+    return retrieval.tax_year_from_text(question) or settings.DEFAULT_TAX_YEAR
+
+
+def prepare_tax_question(question: str, history: str = "") -> Optional[Dict[str, Any]]:
+    """Retrieve context for a free-text question and build its prompt.
+
+    Args:
+        question: The user's question.
+        history: Earlier conversation from a chat session, already trimmed
+            to its token budget (see chat_sessions.build_history).
+
+    Returns:
+        Dict with 'prompt', 'prompt_tokens', 'sources' (documents and pages
+        the packed context came from) and 'retrieval_ms', or None if the
+        knowledge base has nothing relevant.
     """
     print(f"Tax Expert question: {question}")
+    start = time.perf_counter()
+
+    # Prefer rules for the year the question asks about, else the current year
+    tax_year = question_tax_year(question)
+    where = retrieval.build_where(tax_year=tax_year, category=detect_category(question, default=None))
+
+    hits = retrieve_context(question, where=where)
 
-    context_chunks = retrieve_context(question)
+    if not hits:
+        return None
 
-    if not context_chunks:
-        return "No relevant information found in the knowledge base."
+    packed = assemble_context([hit["text"] for hit in hits])
+    print(f"Packed {len(packed['chunks'])}/{len(hits)} context chunks ({packed['tokens']} tokens)")
+    context = packed["context"]
 
-    print(f"Found {len(context_chunks)} relevant documents")
-    context = "\n\n".join(context_chunks)
+    packed_texts = set(packed["chunks"])
+    packed_hits = [hit for hit in hits if hit["text"].strip() in packed_texts] or hits[:1]
+
+    conversation = f"\n{history}\n" if history else ""
 
     prompt = f"""You are a Thai Tax Expert. Answer the question based on the context.
 
 Context:
 {context}
-
+{conversation}
 Question: {question}
 
 Instructions:
@@ -248,15 +375,99 @@ Instructions:
 
 Answer:"""
 
+    return {
+        "prompt": prompt,
+        "prompt_tokens": count_tokens(prompt),
+        "sources": _hit_sources(packed_hits),
+        "retrieval_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+def lookup_cached_answer(question: str) -> Dict[str, Any]:
+    """Look a question up in the semantic answer cache.
+
+    Returns:
+        Dict with 'entry' (the cached answer, or None on a miss) and the
+        'scope' to pass to store_cached_answer once the answer is generated.
+    """
+    tax_year = question_tax_year(question)
+    version = snapshot_manager.current_version()
+    if version is None:
+        # No knowledge base to scope the cache to; answer without it
+        return {"entry": None, "scope": {"tax_year": tax_year, "version": None, "embedding": None}}
+    entry, embedding = answer_cache.lookup(question, tax_year, version)
+    return {
+        "entry": entry,
+        "scope": {"tax_year": tax_year, "version": version, "embedding": embedding},
+    }
+
+
+def store_cached_answer(question: str, scope: Dict[str, Any], answer: str, sources: list = None) -> None:
+    """Cache a generated answer under the scope returned by lookup_cached_answer."""
+    answer_cache.store(question, scope["embedding"], scope["tax_year"], scope["version"], answer, sources)
+
+
+@single_flight("ask_tax_question", key=lambda question, history="": [_normalize_text(question), history])
+def answer_tax_question(question: str, history: str = "") -> Dict[str, Any]:
+    """Answer a free-text tax question using RAG (conversational mode).
+
+    Answers are served from the semantic answer cache when a similar
+    question about the same tax year was already answered from the current
+    knowledge base. Follow-up questions in a chat session (non-empty
+    history) depend on the conversation, so they bypass the cache.
+
+    Args:
+        question: The user's question.
+        history: Earlier conversation from a chat session, if any.
+
+    Returns:
+        Dict with 'answer', 'sources', 'cached' and 'prompt_tokens' (0 when
+        no prompt was sent).
+    """
+    start = time.perf_counter()
+    cached = {"entry": None, "scope": None}
+
+    if not history:
+        try:
+            cached = lookup_cached_answer(question)
+        except Exception as e:
+            print(f"Answer cache lookup failed: {e}")
+
+    if cached["entry"] is not None:
+        answer_cache.record_latency(True, (time.perf_counter() - start) * 1000)
+        entry = cached["entry"]
+        return {"answer": entry["answer"], "sources": entry["sources"], "cached": True, "prompt_tokens": 0}
+
+    prepared = prepare_tax_question(question, history)
+
+    if prepared is None:
+        return {"answer": NO_CONTEXT_ANSWER, "sources": [], "cached": False, "prompt_tokens": 0}
+
     try:
-        response = genai_client.models.generate_content(
-            model=f"models/{settings.GEMINI_MODEL}",
-            contents=prompt,
-        )
-        return response.text
+        response = generate_text(prepared["prompt"], label="ask_tax_question")
     except Exception as e:
         print(f"Error generating response: {e}")
-        return "An error occurred while generating the response."
+        return {
+            "answer": "An error occurred while generating the response.",
+            "sources": [],
+            "cached": False,
+            "prompt_tokens": prepared["prompt_tokens"],
+        }
+
+    if cached["scope"] is not None:
+        store_cached_answer(question, cached["scope"], response.text, prepared["sources"])
+    answer_cache.record_latency(False, (time.perf_counter() - start) * 1000)
+    return {
+        "answer": response.text,
+        "sources": prepared["sources"],
+        "cached": False,
+        "prompt_tokens": prepared["prompt_tokens"],
+    }
+
+
+def ask_tax_question(question: str) -> str:
+    """Answer a stand-alone free-text tax question and return the answer text."""
+    return answer_tax_question(question)["answer"]
 
 
 def main():
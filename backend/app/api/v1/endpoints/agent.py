@@ -1,11 +1,25 @@
 """Agent Chat API endpoints."""
-from fastapi import APIRouter, HTTPException, Header
+import json
+import time
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from typing import Optional
 from pydantic import BaseModel
 from datetime import datetime
 
 from app.database.database import supabase, get_auth_client
-from app.agents.tax_expert import ask_tax_question
+from app.agents.tax_expert import (
+    answer_tax_question,
+    prepare_tax_question,
+    lookup_cached_answer,
+    store_cached_answer,
+    NO_CONTEXT_ANSWER,
+)
+from app.services import chat_sessions
+from app.services.answer_cache import answer_cache
+from app.services.llm import generate_text_stream
 
 
 router = APIRouter()
@@ -32,22 +46,38 @@ def extract_user_id_from_token(authorization: Optional[str]) -> str:
 
 class ChatRequest(BaseModel):
     message: str
+    session_id: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
     response: str
     timestamp: str
+    session_id: Optional[str] = None
+
+
+def open_chat_session(session_id: Optional[str], user_id: str) -> dict:
+    """Return the user's chat session, starting a new one if no id is given."""
+    if session_id is None:
+        session_id = chat_sessions.create_session(user_id)
+
+    session = chat_sessions.get_session(session_id, user_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Chat session not found or expired")
+    return session
 
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat_with_agent(
     request: ChatRequest,
+    background_tasks: BackgroundTasks,
     authorization: Optional[str] = Header(None)
 ):
     """
     Chat with AI tax expert agent.
     
     The agent uses RAG to answer questions about Thai tax deductions.
+    - Send the returned session_id with the next message to continue the conversation
+    - Omit session_id to start a new session
     """
     user_id = extract_user_id_from_token(authorization)
     
@@ -55,13 +85,25 @@ async def chat_with_agent(
         if not request.message or not request.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
         
-        response_text = ask_tax_question(request.message)
+        session = await run_in_threadpool(open_chat_session, request.session_id, user_id)
+        history = await run_in_threadpool(chat_sessions.build_history, session)
+        
+        result = await answer_tax_question.aio(request.message, history["text"])
+        
+        turn = await run_in_threadpool(
+            chat_sessions.add_turn, session["id"], request.message, result["answer"],
+            result["prompt_tokens"], history["tokens"]
+        )
+        print(f"Chat session {session['id']} turn {turn}: {result['prompt_tokens']} prompt tokens "
+              f"({history['tokens']} history, {history['verbatim_turns']} verbatim turns)")
+        background_tasks.add_task(chat_sessions.refresh_summary, session["id"])
         
         timestamp = datetime.utcnow().isoformat()
         
         return ChatResponse(
-            response=response_text,
-            timestamp=timestamp
+            response=result["answer"],
+            timestamp=timestamp,
+            session_id=session["id"]
         )
     
     except HTTPException:
@@ -72,3 +114,135 @@ async def chat_with_agent(
             status_code=500,
             detail="Failed to process chat message"
         )
+
+
+def format_sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_with_agent_stream(
+    request: ChatRequest,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Chat with AI tax expert agent, streaming the answer as Server-Sent Events.
+
+    Retrieval runs before the stream starts. A cached answer to a similar
+    question is sent as a single token event. Sessions work as in /chat. Events:
+    - token: {"text": "..."} for each generated chunk
+    - done: {"sources": [...], "cached": bool, "session_id": "...", "timing": {...}, "timestamp": "..."}
+    - error: {"detail": "..."} if generation fails mid-stream
+
+    timing reports retrieval_ms, ttfb_ms (request start to first token),
+    generation_ms (first token to last) and total_ms separately.
+    """
+    start = time.perf_counter()
+    user_id = extract_user_id_from_token(authorization)
+
+    if not request.message or not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+
+    session = await run_in_threadpool(open_chat_session, request.session_id, user_id)
+    history = await run_in_threadpool(chat_sessions.build_history, session)
+
+    # Follow-up questions depend on the conversation, so only fresh ones use the cache
+    cached = {"entry": None, "scope": None}
+    if not history["text"]:
+        try:
+            cached = await run_in_threadpool(lookup_cached_answer, request.message)
+        except Exception as e:
+            print(f"Answer cache lookup failed: {e}")
+
+    prepared = None
+    if cached["entry"] is None:
+        try:
+            prepared = await run_in_threadpool(prepare_tax_question, request.message, history["text"])
+        except Exception as e:
+            print(f"Error in chat stream retrieval: {e}")
+            raise HTTPException(
+                status_code=500,
+                detail="Failed to process chat message"
+            )
+
+    def event_stream():
+        ttfb_ms = None
+        failed = False
+        parts = []
+
+        if cached["entry"] is not None:
+            sources = cached["entry"]["sources"]
+            chunks = iter([cached["entry"]["answer"]])
+        elif prepared is not None:
+            sources = prepared["sources"]
+            chunks = generate_text_stream(prepared["prompt"], label="chat_stream")
+        else:
+            sources = []
+            chunks = iter([NO_CONTEXT_ANSWER])
+
+        try:
+            for text in chunks:
+                if ttfb_ms is None:
+                    ttfb_ms = (time.perf_counter() - start) * 1000
+                parts.append(text)
+                yield format_sse("token", {"text": text})
+        except Exception as e:
+            failed = True
+            print(f"Error streaming chat response: {e}")
+            yield format_sse("error", {"detail": "An error occurred while generating the response."})
+
+        if prepared is not None and not failed and cached["scope"] is not None:
+            store_cached_answer(request.message, cached["scope"], "".join(parts), sources)
+
+        if not failed:
+            chat_sessions.add_turn(
+                session["id"], request.message, "".join(parts),
+                prepared["prompt_tokens"] if prepared else 0, history["tokens"]
+            )
+
+        total_ms = (time.perf_counter() - start) * 1000
+        timing = {
+            "retrieval_ms": prepared["retrieval_ms"] if prepared else None,
+            "ttfb_ms": round(ttfb_ms, 1) if ttfb_ms is not None else None,
+            "generation_ms": round(total_ms - ttfb_ms, 1) if ttfb_ms is not None else None,
+            "total_ms": round(total_ms, 1),
+        }
+        print(f"Chat stream for {user_id}: {timing}")
+        if cached["entry"] is not None or prepared is not None:
+            answer_cache.record_latency(cached["entry"] is not None, total_ms)
+
+        yield format_sse("done", {
+            "sources": sources,
+            "cached": cached["entry"] is not None,
+            "session_id": session["id"],
+            "timing": timing,
+            "timestamp": datetime.utcnow().isoformat(),
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(chat_sessions.refresh_summary, session["id"]),
+    )
+
+
+@router.delete("/chat/sessions/{session_id}")
+async def end_chat_session(
+    session_id: str,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    End a chat session and delete its stored history.
+    """
+    user_id = extract_user_id_from_token(authorization)
+
+    deleted = await run_in_threadpool(chat_sessions.delete_session, session_id, user_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+
+    return {
+        "success": True,
+        "message": "Chat session deleted"
+    }
@@ -1,153 +1,157 @@
 """Dashboard Summary API endpoints."""
-from fastapi import APIRouter, HTTPException
-from typing import Dict, Any
+import json
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import Dict, Any, Optional
 
+from app.core.config import settings
 from app.database.database import supabase
+from app.services import deduction_ledger, deduction_rules, transaction_stats
+from app.services.dashboard_cache import dashboard_cache, etag_matches
+from app.services.tax_rule_cache import tax_rule_cache
 
 router = APIRouter()
 
+RECENT_TRANSACTIONS = 5
+
+
+def _to_json(content: Dict[str, Any]) -> bytes:
+    """Serialize a response body the way JSONResponse does."""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _cached_response(request: Request, entry: Dict[str, Any]) -> Response:
+    """The cached body, or 304 Not Modified if the client already has it."""
+    headers = {"ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        dashboard_cache.record_not_modified()
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+def build_dashboard_summary(user_id: str, tax_year: int) -> bytes:
+    """Query and serialize the dashboard summary of a user for a tax year."""
+    print(f"\n{'='*60}")
+    print(f"Dashboard API called for user_id: {user_id}")
+    print(f"User ID type: {type(user_id)}")
+    print(f"User ID length: {len(user_id)}")
+    print(f"User ID repr: {repr(user_id)}")
+    print(f"{'='*60}\n")
+    
+    # Status counts, and the tax year's verified total and per-category sums,
+    # aggregated by the database (the same year as the remaining limits below)
+    totals = transaction_stats.get_transaction_totals(user_id, tax_year)
+    
+    print(f"SUCCESS: Transactions found in database: {totals['total_transactions']} (totals from {totals['source']})")
+    
+    if not totals["total_transactions"]:
+        print(f"WARNING: No transactions found for user_id: {user_id}")
+        print(f"   This could mean:")
+        print(f"   1. User hasn't uploaded any receipts yet")
+        print(f"   2. User ID mismatch between login and transactions")
+        print(f"   3. Transactions belong to a different user_id")
+    
+    # Only the 5 most recent transactions are listed
+    recent_response = supabase.table("transactions").select(
+        "id, merchant_name, transaction_date, total_amount, deductible_amount, status, create_at, receipt_image_url, rule_id, ai_reasoning"
+    ).eq("user_id", user_id).order("create_at", desc=True).limit(RECENT_TRANSACTIONS).execute()
+    
+    transactions_data = recent_response.data if recent_response.data else []
+    
+    # Map rule ids to categories from the tax rule cache
+    tax_rules = tax_rule_cache.get_rules()
+    if tax_rules is None:
+        print("Warning: Failed to fetch tax rules")
+    tax_rules_map = {rule["id"]: rule for rule in (tax_rules or [])}
+    
+    total_deductible = totals["total_deductible"]
+    
+    # Count by status
+    status_counts = {"verified": 0, "needs_review": 0, "rejected": 0, "not_deductible": 0}
+    for status, count in totals["status_breakdown"].items():
+        if status in status_counts:
+            status_counts[status] = count
+    
+    # Recent transactions with category names
+    recent_transactions = []
+    for tx in transactions_data:
+        rule_id = tx.get("rule_id")
+        status = tx.get("status", "needs_review")
+        category_name = "Unknown"
+        if rule_id and rule_id in tax_rules_map:
+            category_name = tax_rules_map[rule_id]["category_name"]
+        elif status == "not_deductible":
+            category_name = "Not Deductible"
+        
+        recent_transactions.append({
+            "id": str(tx.get("id", "")),
+            "merchant_name": str(tx.get("merchant_name", "Unknown")),
+            "transaction_date": str(tx.get("transaction_date", "")),
+            "total_amount": float(tx.get("total_amount", 0) or 0),
+            "deductible_amount": float(tx.get("deductible_amount", 0) or 0),
+            "status": str(tx.get("status", "needs_review")),
+            "created_at": str(tx.get("create_at", "")),
+            "receipt_image_url": str(tx.get("receipt_image_url", "") if tx.get("receipt_image_url") else ""),
+            "category": category_name,
+            "ai_reasoning": str(tx.get("ai_reasoning", "") if tx.get("ai_reasoning") else "")
+        })
+    
+    print(f"Recent transactions to return: {len(recent_transactions)}")
+    if recent_transactions:
+        print(f"First recent tx: {recent_transactions[0].get('merchant_name')}")
+    
+    # Category breakdown for the current tax year; remaining limits from the deduction ledger
+    table = deduction_rules.get_rule_table()
+    category_breakdown = {}
+    for category_name, category_totals in totals["categories"].items():
+        rule = table.get(category_name, tax_year) if table else None
+        if rule is None:
+            continue
+        
+        # What is left after all claims, including receipts still under review
+        remaining = deduction_ledger.headroom(user_id, tax_year, rule, table)
+        category_breakdown[category_name] = {
+            "total_deductible": float(category_totals["total_deductible"] or 0),
+            "max_limit": rule.max_limit,
+            "remaining": remaining if remaining is not None else 0
+        }
+    
+    return _to_json({
+        "success": True,
+        "data": {
+            "tax_year": tax_year,
+            "total_deductible_amount": total_deductible,
+            "total_transactions": totals["total_transactions"],
+            "status_breakdown": status_counts,
+            "recent_transactions": recent_transactions,
+            "category_breakdown": category_breakdown
+        }
+    })
+
 
 @router.get("/summary/{user_id}", summary="Get dashboard summary for a user")
-async def get_dashboard_summary(user_id: str):
+async def get_dashboard_summary(user_id: str, request: Request, tax_year: Optional[int] = None):
     """
     Get comprehensive dashboard summary for a user
+    - Optional tax_year: year of the deductible amounts and limits (default: current year)
     
     Returns:
-    - Total deductible amount (verified transactions only)
+    - Total deductible amount (verified transactions, tax year)
     - Total transactions count
     - Status breakdown (verified, needs_review, rejected)
     - Recent transactions (last 5)
-    - Category breakdown (deductible by category)
+    - Category breakdown (deductible and remaining limit by category, tax year)
+    - Cached per user until their transactions change; send the ETag back
+      in If-None-Match to get 304 Not Modified
     """
     
+    tax_year = tax_year or settings.DEFAULT_TAX_YEAR
     try:
-        print(f"\n{'='*60}")
-        print(f"Dashboard API called for user_id: {user_id}")
-        print(f"User ID type: {type(user_id)}")
-        print(f"User ID length: {len(user_id)}")
-        print(f"User ID repr: {repr(user_id)}")
-        print(f"{'='*60}\n")
-        
-        # Get all transactions for the user, ordered by creation time
-        all_transactions = supabase.table("transactions").select(
-            "id, merchant_name, transaction_date, total_amount, deductible_amount, status, create_at, receipt_image_url, rule_id, user_id, ai_reasoning"
-        ).eq("user_id", user_id).order("create_at", desc=True).execute()
-        
-        transactions_data = all_transactions.data if all_transactions.data else []
-        
-        print(f"SUCCESS: Transactions found in database: {len(transactions_data)}")
-        
-        if transactions_data:
-            first_tx = transactions_data[0]
-            print(f"First transaction details:")
-            print(f"   - Merchant: {first_tx.get('merchant_name')}")
-            print(f"   - Created: {first_tx.get('create_at')}")
-            print(f"   - User ID: {first_tx.get('user_id')}")
-            print(f"   - IDs match: {first_tx.get('user_id') == user_id}")
-        else:
-            print(f"WARNING: No transactions found for user_id: {user_id}")
-            print(f"   This could mean:")
-            print(f"   1. User hasn't uploaded any receipts yet")
-            print(f"   2. User ID mismatch between login and transactions")
-            print(f"   3. Transactions belong to a different user_id")
-        
-        # Get all tax rules to map categories
-        try:
-            tax_rules_response = supabase.table("tax_rules").select(
-                "id, category_name, max_limit"
-            ).eq("is_active", True).execute()
-            
-            tax_rules_map = {rule["id"]: rule for rule in (tax_rules_response.data or [])}
-            print(f"Tax rules loaded: {len(tax_rules_map)}")
-        except Exception as e:
-            print(f"Warning: Failed to fetch tax rules: {e}")
-            tax_rules_map = {}
-        
-        # Calculate total deductible (verified only)
-        total_deductible = sum(
-            float(t.get("deductible_amount", 0) or 0)
-            for t in transactions_data 
-            if t.get("status") == "verified"
+        entry = await run_in_threadpool(
+            dashboard_cache.get_or_build, user_id, f"summary:{tax_year}",
+            lambda: build_dashboard_summary(user_id, tax_year)
         )
-        
-        # Count by status
-        status_counts = {"verified": 0, "needs_review": 0, "rejected": 0, "not_deductible": 0}
-        for t in transactions_data:
-            status = t.get("status", "needs_review")
-            if status in status_counts:
-                status_counts[status] += 1
-        
-        # Get recent transactions (last 5) with category names
-        recent_transactions = []
-        for tx in transactions_data[:5]:
-            rule_id = tx.get("rule_id")
-            status = tx.get("status", "needs_review")
-            category_name = "Unknown"
-            if rule_id and rule_id in tax_rules_map:
-                category_name = tax_rules_map[rule_id]["category_name"]
-            elif status == "not_deductible":
-                category_name = "Not Deductible"
-            
-            recent_transactions.append({
-                "id": str(tx.get("id", "")),
-                "merchant_name": str(tx.get("merchant_name", "Unknown")),
-                "transaction_date": str(tx.get("transaction_date", "")),
-                "total_amount": float(tx.get("total_amount", 0) or 0),
-                "deductible_amount": float(tx.get("deductible_amount", 0) or 0),
-                "status": str(tx.get("status", "needs_review")),
-                "created_at": str(tx.get("create_at", "")),
-                "receipt_image_url": str(tx.get("receipt_image_url", "") if tx.get("receipt_image_url") else ""),
-                "category": category_name,
-                "ai_reasoning": str(tx.get("ai_reasoning", "") if tx.get("ai_reasoning") else "")
-            })
-        
-        print(f"Recent transactions to return: {len(recent_transactions)}")
-        if recent_transactions:
-            print(f"First recent tx: {recent_transactions[0].get('merchant_name')}")
-        
-        # Category breakdown
-        try:
-            transactions_with_rules = supabase.table("transactions").select(
-                "rule_id, deductible_amount"
-            ).eq("user_id", user_id).eq("status", "verified").execute()
-            
-            transactions_with_rules_data = transactions_with_rules.data if transactions_with_rules.data else []
-        except Exception as e:
-            print(f"Warning: Failed to fetch transactions with rules: {e}")
-            transactions_with_rules_data = []
-        
-        category_breakdown = {}
-        for t in transactions_with_rules_data:
-            rule_id = t.get("rule_id")
-            deductible = float(t.get("deductible_amount", 0) or 0)
-            
-            if rule_id and rule_id in tax_rules_map:
-                category_name = tax_rules_map[rule_id]["category_name"]
-                max_limit = float(tax_rules_map[rule_id]["max_limit"] or 0)
-                
-                if category_name not in category_breakdown:
-                    category_breakdown[category_name] = {
-                        "total_deductible": 0,
-                        "max_limit": max_limit,
-                        "remaining": max_limit
-                    }
-                
-                category_breakdown[category_name]["total_deductible"] += deductible
-                category_breakdown[category_name]["remaining"] = max(
-                    0, 
-                    max_limit - category_breakdown[category_name]["total_deductible"]
-                )
-        
-        return {
-            "success": True,
-            "data": {
-                "total_deductible_amount": total_deductible,
-                "total_transactions": len(transactions_data),
-                "status_breakdown": status_counts,
-                "recent_transactions": recent_transactions,
-                "category_breakdown": category_breakdown
-            }
-        }
+        return _cached_response(request, entry)
         
     except Exception as e:
         print(f"Error in get_dashboard_summary: {str(e)}")
@@ -159,35 +163,37 @@ async def get_dashboard_summary(user_id: str):
         )
 
 
+def build_dashboard_stats(user_id: str, tax_year: int) -> bytes:
+    """Query and serialize the dashboard card statistics of a user for a tax year."""
+    totals = transaction_stats.get_transaction_totals(user_id, tax_year)
+    
+    return _to_json({
+        "success": True,
+        "data": {
+            "tax_year": tax_year,
+            "total_deductible": totals["total_deductible"],
+            "total_documents": totals["total_transactions"],
+            "verified_count": totals["status_breakdown"]["verified"]
+        }
+    })
+
+
 @router.get("/stats/{user_id}", summary="Get quick stats for dashboard cards")
-async def get_dashboard_stats(user_id: str):
+async def get_dashboard_stats(user_id: str, request: Request, tax_year: Optional[int] = None):
     """
     Get quick statistics for dashboard summary cards
     Optimized for fast loading
+    - Optional tax_year: year of the deductible total, as in the summary (default: current year)
+    - Cached per user like the summary, with the same ETag handling
     """
     
+    tax_year = tax_year or settings.DEFAULT_TAX_YEAR
     try:
-        # Get verified transactions only
-        verified_response = supabase.table("transactions").select(
-            "deductible_amount"
-        ).eq("user_id", user_id).eq("status", "verified").execute()
-        
-        # Get all transactions count
-        all_response = supabase.table("transactions").select(
-            "id"
-        ).eq("user_id", user_id).execute()
-        
-        total_deductible = sum(t.get("deductible_amount", 0) for t in verified_response.data or [])
-        total_count = len(all_response.data or [])
-        
-        return {
-            "success": True,
-            "data": {
-                "total_deductible": total_deductible,
-                "total_documents": total_count,
-                "verified_count": len(verified_response.data or [])
-            }
-        }
+        entry = await run_in_threadpool(
+            dashboard_cache.get_or_build, user_id, f"stats:{tax_year}",
+            lambda: build_dashboard_stats(user_id, tax_year)
+        )
+        return _cached_response(request, entry)
         
     except Exception as e:
         raise HTTPException(
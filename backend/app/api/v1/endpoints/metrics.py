@@ -0,0 +1,158 @@
+"""Runtime metrics API endpoints."""
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+
+from app.services import deduction_ledger
+from app.services.answer_cache import answer_cache
+from app.services.chat_sessions import get_session_stats
+from app.services.dashboard_cache import dashboard_cache
+from app.services.llm import get_usage_stats
+from app.services.query_batcher import query_batcher
+from app.services.tax_rule_cache import tax_rule_cache
+from app.utils.singleflight import get_single_flight_stats
+from app.utils.tracing import get_recent_traces, get_trace, get_trace_summary
+
+router = APIRouter()
+
+
+@router.get("/llm", summary="Gemini prompt token usage")
+async def get_llm_metrics():
+    """
+    Prompt tokens sent to Gemini since startup (per worker)
+    - cached_tokens: served from Gemini implicit prefix cache
+    - uncached_tokens: sent and billed at the full input rate
+    """
+    return {
+        "success": True,
+        "data": get_usage_stats()
+    }
+
+
+@router.get("/answer-cache", summary="Semantic answer cache statistics")
+async def get_answer_cache_metrics():
+    """
+    Semantic answer cache statistics since startup (per worker)
+    - hit_rate: share of questions answered from the cache
+    - p50_ms: median time to answer, cached vs uncached
+    """
+    return {
+        "success": True,
+        "data": answer_cache.stats()
+    }
+
+
+@router.get("/single-flight", summary="Coalesced LLM request counters")
+async def get_single_flight_metrics():
+    """
+    Per-function single-flight counters since startup (per worker)
+    - executed: calls that reached Gemini
+    - coalesced: identical concurrent calls that shared another call's result
+    """
+    return {
+        "success": True,
+        "data": get_single_flight_stats()
+    }
+
+
+@router.get("/chat-sessions", summary="Chat session prompt sizes by turn")
+async def get_chat_session_metrics():
+    """
+    Active chat sessions and average prompt / history tokens by turn number
+    - Prompt size should level off once history reaches its token budget
+    """
+    return {
+        "success": True,
+        "data": await run_in_threadpool(get_session_stats)
+    }
+
+
+@router.get("/retrieval-batching", summary="Vector search micro-batching")
+async def get_retrieval_batching_metrics():
+    """
+    Vector searches and the batches they were grouped into (per worker)
+    - avg_batch_size: queries embedded and searched per model call
+    """
+    return {
+        "success": True,
+        "data": query_batcher.stats()
+    }
+
+
+@router.get("/tax-rule-cache", summary="Tax rule cache state")
+async def get_tax_rule_cache_metrics():
+    """
+    Tax rule cache state for this worker
+    - version: changes whenever a reload returns different rules
+    - loads: Supabase queries made for tax rules since startup
+    """
+    return {
+        "success": True,
+        "data": tax_rule_cache.stats()
+    }
+
+
+@router.get("/deduction-ledger", summary="Deduction ledger size and counters")
+async def get_deduction_ledger_metrics():
+    """
+    Deduction ledger state for this worker
+    - years: (user, tax year) pairs built from the transactions table
+    - lookups/builds/writes: claimed-total reads, year rebuilds and per-transaction updates
+    """
+    return {
+        "success": True,
+        "data": await run_in_threadpool(deduction_ledger.stats)
+    }
+
+
+@router.get("/dashboard-cache", summary="Dashboard response cache statistics")
+async def get_dashboard_cache_metrics():
+    """
+    Dashboard response cache for this worker
+    - hit_ratio: summary/stats requests answered without querying the database
+    - not_modified: responses answered with 304 because the client's ETag matched
+    - invalidations: writes that dropped a user's cached responses
+    """
+    return {
+        "success": True,
+        "data": dashboard_cache.stats()
+    }
+
+
+@router.get("/traces", summary="Per-stage latency percentiles from tracing spans")
+async def get_trace_metrics():
+    """
+    Span counts and p50/p95/p99 duration per stage over recent spans (per worker)
+    - node.*: LangGraph workflow nodes
+    - gemini.*, chroma.query / numpy.query, supabase.request: external calls
+    """
+    return {
+        "success": True,
+        "data": get_trace_summary()
+    }
+
+
+@router.get("/traces/recent", summary="Most recent traces")
+async def get_recent_trace_metrics(limit: int = Query(20, ge=1, le=200)):
+    """
+    Root span of the most recent traces, newest first
+    - Use a trace_id with /metrics/traces/{trace_id} to see its spans
+    """
+    return {
+        "success": True,
+        "data": get_recent_traces(limit)
+    }
+
+
+@router.get("/traces/{trace_id}", summary="Spans of one trace")
+async def get_trace_spans(trace_id: str):
+    """
+    Every buffered span of one trace in start order, with attributes
+    - Workflow runs return their trace_id in the response
+    """
+    spans = get_trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return {
+        "success": True,
+        "data": spans
+    }
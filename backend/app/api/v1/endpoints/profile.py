@@ -1,9 +1,10 @@
 """User Profile API endpoints."""
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Header
 from typing import Optional
 from pydantic import BaseModel
 
 from app.database.database import supabase, get_auth_client
+from app.services import deduction_ledger, deduction_recompute
 
 router = APIRouter()
 
@@ -96,11 +97,13 @@ async def get_my_profile(authorization: Optional[str] = Header(None)):
 @router.put("/me", summary="Update current user profile")
 async def update_my_profile(
     updates: ProfileUpdate,
+    background_tasks: BackgroundTasks,
     authorization: Optional[str] = Header(None)
 ):
     """
     Update current authenticated user's profile
     Requires: Authorization header with Bearer token
+    - Changing annual_income recomputes the current tax year's income-relative caps in the background
     """
     user_id = extract_user_id_from_token(authorization)
     
@@ -120,6 +123,14 @@ async def update_my_profile(
         if not response or not response.user:
             raise HTTPException(status_code=400, detail="Failed to update profile")
         
+        if "annual_income" in update_data:
+            deduction_ledger.set_income(user_id, update_data["annual_income"])
+            background_tasks.add_task(
+                deduction_recompute.recompute,
+                user_id=user_id,
+                incomes={user_id: update_data["annual_income"]}
+            )
+        
         return {
             "success": True,
             "message": "Profile updated successfully",
@@ -2,14 +2,19 @@
 import os
 import uuid
 import base64
+import asyncio
+import hashlib
+import threading
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from typing import Optional
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Optional, Dict, Any, AsyncIterator, Tuple
 from pydantic import BaseModel
 
-from app.agents.inspector import extract_receipt_json, extract_receipt_from_bytes
-from app.agents.accountant import save_receipt_from_inspector
-from app.agents.tax_expert import ask_tax_expert
+from app.agents.inspector import detect_image_type
+from app.api.v1.endpoints.agent import format_sse
+from app.services.workflow import run_workflow, build_initial_state, discard_thread, stream_workflow
 
 router = APIRouter()
 
@@ -17,6 +22,10 @@ router = APIRouter()
 UPLOAD_DIR = Path("data/receipts")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+ALLOWED_TYPES = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
+DISCONNECT_POLL_SECONDS = 1.0  # how often a quiet stream checks for a gone client
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
 
 class Base64ImageRequest(BaseModel):
     image_base64: str
@@ -24,6 +33,84 @@ class Base64ImageRequest(BaseModel):
     category_name: str = "Health Insurance"
 
 
+async def run_receipt_workflow(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a receipt through the compiled workflow (inspect -> tax expert -> accountant).
+
+    A receipt with missing fields is returned with status
+    "awaiting_user_input" (see missing_fields_response).
+
+    Raises:
+        HTTPException: If extraction fails or the transaction could not be saved.
+    """
+    result = await run_in_threadpool(run_workflow, state)
+    receipt_data = result.get("receipt_data") or {}
+
+    if "error" in receipt_data:
+        # The run may have stopped for input on the empty fields; nothing can resume it
+        await run_in_threadpool(discard_thread, result["thread_id"])
+        raise extraction_error(receipt_data)
+
+    if result.get("status") == "awaiting_user_input":
+        return result
+
+    save_result = result.get("accountant_result") or {}
+    if not save_result.get("success"):
+        error_detail = save_result.get('error', 'Unknown error')
+        print(f"Failed to save transaction: {error_detail}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Failed to save transaction: {error_detail}"
+        )
+
+    print(f"Tax Expert classification: {result.get('tax_analysis', {}).get('category', 'None')}")
+    return result
+
+
+def decode_base64_image(image_base64: str) -> bytes:
+    """Decode a base64 image, with or without a data URI prefix."""
+    # "data:image/jpeg;base64,..." -> "..."
+    if "base64," in image_base64:
+        image_base64 = image_base64.split("base64,")[1]
+    return base64.b64decode(image_base64)
+
+
+def extraction_error(receipt_data: Dict[str, Any]) -> HTTPException:
+    """Turn an Inspector extraction error into a user-friendly HTTP error."""
+    error_msg = receipt_data.get('error', 'Unknown error')
+
+    if 'API key not valid' in str(error_msg) or 'API_KEY_INVALID' in str(error_msg):
+        return HTTPException(
+            status_code=503,
+            detail="AI service configuration error. Please contact administrator to set up the API key."
+        )
+
+    return HTTPException(
+        status_code=400,
+        detail=f"Failed to extract receipt data: {error_msg}"
+    )
+
+
+def missing_fields_response(result: Dict[str, Any]) -> JSONResponse:
+    """422 response for a receipt that needs user input before it can be saved.
+
+    The client fills in missing_fields and sends them with thread_id to
+    /workflow/resume, which continues without re-running OCR.
+    """
+    missing = result.get("missing_fields", [])
+    return JSONResponse(
+        status_code=422,
+        content={
+            "success": False,
+            "detail": f"Receipt is missing required fields: {', '.join(missing)}",
+            "data": {
+                "thread_id": result["thread_id"],
+                "missing_fields": missing,
+                "extracted_data": result.get("receipt_data") or {},
+            }
+        }
+    )
+
+
 @router.post("/upload", summary="Upload and process receipt image")
 async def upload_receipt(
     file: UploadFile = File(...),
@@ -36,17 +123,17 @@ async def upload_receipt(
     Steps:
     1. Save uploaded image to disk
     2. Extract receipt data using Inspector Agent (Gemini Vision)
-    3. Save transaction to database using Accountant Agent
+    3. Classify the receipt using Tax Expert Agent (RAG)
+    4. Save transaction to database using Accountant Agent
     
     Returns: Extracted data and transaction details
     """
     
     # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
-    if file.content_type not in allowed_types:
+    if file.content_type not in ALLOWED_TYPES:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid file type. Allowed: {', '.join(allowed_types)}"
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_TYPES)}"
         )
     
     try:
@@ -65,49 +152,18 @@ async def upload_receipt(
         # Generate URL for serving the image
         receipt_url = f"/receipts/{unique_filename}"
         
-        # Extract data using Inspector Agent
-        receipt_data = extract_receipt_json(str(file_path))
-        
-        if "error" in receipt_data:
-            error_msg = receipt_data.get('error', 'Unknown error')
-            
-            # Provide user-friendly error messages
-            if 'API key not valid' in str(error_msg) or 'API_KEY_INVALID' in str(error_msg):
-                raise HTTPException(
-                    status_code=503,
-                    detail="AI service configuration error. Please contact administrator to set up the API key."
-                )
-            
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to extract receipt data: {error_msg}"
-            )
-        
-        # Use Tax Expert (RAG) to classify the receipt
-        tax_result = ask_tax_expert(receipt_data)
-        final_category = tax_result.get("category", "None")
-
-        print(f"Tax Expert classification: {final_category}")
-        print(f"Extracted receipt data: {receipt_data}")
-
-        # Save to database using Accountant Agent
-        save_result = save_receipt_from_inspector(
+        # Inspector -> Tax Expert (RAG) -> Accountant
+        result = await run_receipt_workflow(build_initial_state(
+            image_bytes=content,
             user_id=user_id,
-            receipt_data=receipt_data,
-            category_name=final_category,
             receipt_image_url=receipt_url,
-            tax_result=tax_result
-        )
-        
-        print(f"Save result: {save_result}")
+        ))
+        if result["status"] == "awaiting_user_input":
+            return missing_fields_response(result)
+        receipt_data = result["receipt_data"]
+        save_result = result["accountant_result"]
         
-        if not save_result.get("success"):
-            error_detail = save_result.get('error', 'Unknown error')
-            print(f"Failed to save transaction: {error_detail}")
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to save transaction: {error_detail}"
-            )
+        print(f"Extracted receipt data: {receipt_data}")
         
         return {
             "success": True,
@@ -141,58 +197,22 @@ async def upload_receipt_base64(request: Base64ImageRequest):
     Steps:
     1. Decode base64 to bytes
     2. Extract receipt data using Inspector Agent (Gemini Vision)
-    3. Save transaction to database using Accountant Agent
+    3. Classify the receipt using Tax Expert Agent (RAG)
+    4. Save transaction to database using Accountant Agent
     """
     
     try:
-        # Remove data URI prefix if present
-        # "data:image/jpeg;base64,..." -> "..."
-        if "base64," in request.image_base64:
-            base64_str = request.image_base64.split("base64,")[1]
-        else:
-            base64_str = request.image_base64
-        
-        # Decode base64 to bytes
-        image_bytes = base64.b64decode(base64_str)
-        
-        # Extract data using Inspector Agent with bytes
-        receipt_data = extract_receipt_from_bytes(image_bytes)
+        image_bytes = decode_base64_image(request.image_base64)
         
-        if "error" in receipt_data:
-            error_msg = receipt_data.get('error', 'Unknown error')
-            
-            # Provide user-friendly error messages
-            if 'API key not valid' in str(error_msg) or 'API_KEY_INVALID' in str(error_msg):
-                raise HTTPException(
-                    status_code=503,
-                    detail="AI service configuration error. Please contact administrator to set up the API key."
-                )
-            
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to extract receipt data: {error_msg}"
-            )
-        
-        # Use Tax Expert (RAG) to classify the receipt
-        tax_result = ask_tax_expert(receipt_data)
-        final_category = tax_result.get("category", "None")
-
-        print(f"Tax Expert classification: {final_category}")
-
-        # Save to database using Accountant Agent
-        save_result = save_receipt_from_inspector(
+        # Inspector -> Tax Expert (RAG) -> Accountant
+        result = await run_receipt_workflow(build_initial_state(
+            image_bytes=image_bytes,
             user_id=request.user_id,
-            receipt_data=receipt_data,
-            category_name=final_category,
-            receipt_image_url=None,
-            tax_result=tax_result
-        )
-        
-        if not save_result.get("success"):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to save transaction: {save_result.get('error')}"
-            )
+        ))
+        if result["status"] == "awaiting_user_input":
+            return missing_fields_response(result)
+        receipt_data = result["receipt_data"]
+        save_result = result["accountant_result"]
         
         return {
             "success": True,
@@ -228,44 +248,16 @@ async def process_receipt_from_path(
         raise HTTPException(status_code=404, detail="Image file not found")
     
     try:
-        # Extract data using Inspector Agent
-        receipt_data = extract_receipt_json(image_path)
-        
-        if "error" in receipt_data:
-            error_msg = receipt_data.get('error', 'Unknown error')
-            
-            # Provide user-friendly error messages
-            if 'API key not valid' in str(error_msg) or 'API_KEY_INVALID' in str(error_msg):
-                raise HTTPException(
-                    status_code=503,
-                    detail="AI service configuration error. Please contact administrator to set up the API key."
-                )
-            
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to extract receipt data: {error_msg}"
-            )
-        
-        # Use Tax Expert (RAG) to classify the receipt
-        tax_result = ask_tax_expert(receipt_data)
-        final_category = tax_result.get("category", "None")
-
-        print(f"Tax Expert classification: {final_category}")
-
-        # Save to database using Accountant Agent
-        save_result = save_receipt_from_inspector(
+        # Inspector -> Tax Expert (RAG) -> Accountant
+        result = await run_receipt_workflow(build_initial_state(
+            image_path=image_path,
             user_id=user_id,
-            receipt_data=receipt_data,
-            category_name=final_category,
             receipt_image_url=image_path,
-            tax_result=tax_result
-        )
-        
-        if not save_result.get("success"):
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to save transaction: {save_result.get('error')}"
-            )
+        ))
+        if result["status"] == "awaiting_user_input":
+            return missing_fields_response(result)
+        receipt_data = result["receipt_data"]
+        save_result = result["accountant_result"]
         
         return {
             "success": True,
@@ -283,3 +275,199 @@ async def process_receipt_from_path(
             status_code=500,
             detail=f"Failed to process receipt: {str(e)}"
         )
+
+
+# ---------------------------------------------------------------------------
+# Streaming variants (Server-Sent Events)
+# ---------------------------------------------------------------------------
+
+def normalized_event(image_bytes: bytes) -> Tuple[str, Dict[str, Any]]:
+    """Check that bytes are an image Gemini accepts and describe them."""
+    mime_type = detect_image_type(image_bytes)
+    if mime_type is None:
+        return "error", {"status_code": 400, "detail": "Unrecognized image format"}
+    return "normalized", {
+        "mime_type": mime_type,
+        "size_bytes": len(image_bytes),
+        "sha256": hashlib.sha256(image_bytes).hexdigest(),
+    }
+
+
+def stage_event(node: str, update: Dict[str, Any], thread_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Map one workflow node update to a progress event (None for internal nodes)."""
+    if node == "inspect":
+        receipt_data = update.get("receipt_data") or {}
+        if "error" in receipt_data:
+            error = extraction_error(receipt_data)
+            return "error", {"status_code": error.status_code, "detail": error.detail}
+        return "extracted", {"fields": receipt_data}
+
+    if node == "tax_expert":
+        tax_analysis = update.get("tax_analysis") or {}
+        return "classified", {
+            "category": tax_analysis.get("category"),
+            "is_deductible": tax_analysis.get("is_deductible"),
+            "tax_analysis": tax_analysis,
+        }
+
+    if node == "accountant":
+        save_result = update.get("accountant_result") or {}
+        if not save_result.get("success"):
+            return "error", {
+                "status_code": 400,
+                "detail": f"Failed to save transaction: {save_result.get('error', 'Unknown error')}",
+            }
+        return "saved", {"transaction": save_result.get("data")}
+
+    if node == "human_input":
+        return "needs_input", {
+            "thread_id": thread_id,
+            "missing_fields": update.get("missing_fields") or [],
+            "extracted_data": update.get("receipt_data") or {},
+        }
+
+    if node == "__end__":
+        return "done", {
+            "thread_id": thread_id,
+            "trace_id": update.get("trace_id"),
+            "timings": update.get("timings") or {},
+            "total_ms": update.get("total_ms"),
+        }
+
+    return None
+
+
+async def workflow_events(request: Request, state: Dict[str, Any]) -> AsyncIterator[str]:
+    """Run a receipt through the workflow, yielding an SSE event per finished stage.
+
+    The workflow runs in a worker thread. If the client disconnects (or a
+    stage fails), no further stages are started; a stage already running
+    (such as a Gemini call) is left to finish.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+    thread_id = uuid.uuid4().hex
+
+    def produce():
+        try:
+            for item in stream_workflow(state, thread_id, cancelled):
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            print(f"Error in receipt workflow stream: {e}")
+            loop.call_soon_threadsafe(queue.put_nowait, ("__error__", {}))
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    producer = asyncio.ensure_future(run_in_threadpool(produce))
+    failed = False
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), DISCONNECT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    print(f"Receipt stream {thread_id}: client disconnected, cancelling")
+                    return
+                continue
+
+            if item is None:
+                return
+            node, update = item
+            if node == "__error__":
+                yield format_sse("error", {"status_code": 500, "detail": "Failed to process receipt"})
+                return
+
+            event = stage_event(node, update, thread_id)
+            if event is not None:
+                yield format_sse(*event)
+                if event[0] == "error":
+                    failed = True
+                    return
+    finally:
+        # Stops the run at its next stage; producer then finishes on its own
+        cancelled.set()
+        if failed:
+            # The run may still have stopped for input; the client was told it failed
+            producer.add_done_callback(lambda _: discard_thread(thread_id))
+
+
+@router.post("/upload/stream", summary="Upload receipt image and stream processing progress")
+async def upload_receipt_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    user_id: str = Form(...),
+    category_name: str = Form("Health Insurance")
+):
+    """
+    Upload a receipt image and stream each processing stage as Server-Sent Events
+    
+    Events, in order:
+    - stored: {"file_path", "receipt_url"} once the image is on disk
+    - normalized: {"mime_type", "size_bytes", "sha256"} once the image format is checked
+    - extracted: {"fields": {...}} from the Inspector Agent
+    - classified: {"category", "is_deductible", "tax_analysis"} from the Tax Expert Agent
+    - saved: {"transaction": {...}} from the Accountant Agent
+    - needs_input: {"thread_id", "missing_fields", "extracted_data"} instead of
+      classified / saved when fields are missing (continue with /workflow/resume)
+    - done: {"thread_id", "trace_id", "timings", "total_ms"}
+    - error: {"status_code", "detail"} ends the stream
+    
+    Closing the connection cancels the stages that have not started yet.
+    """
+    if file.content_type not in ALLOWED_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_TYPES)}"
+        )
+
+    content = await file.read()
+    file_extension = file.filename.split(".")[-1]
+
+    async def event_stream():
+        unique_filename = f"{uuid.uuid4()}.{file_extension}"
+        file_path = UPLOAD_DIR / unique_filename
+        try:
+            await run_in_threadpool(file_path.write_bytes, content)
+        except OSError as e:
+            print(f"Error saving receipt: {e}")
+            yield format_sse("error", {"status_code": 500, "detail": "Failed to store receipt"})
+            return
+
+        receipt_url = f"/receipts/{unique_filename}"
+        yield format_sse("stored", {"file_path": str(file_path), "receipt_url": receipt_url})
+
+        event, data = normalized_event(content)
+        yield format_sse(event, data)
+        if event == "error":
+            return
+
+        state = build_initial_state(image_bytes=content, user_id=user_id, receipt_image_url=receipt_url)
+        async for message in workflow_events(request, state):
+            yield message
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/upload-base64/stream", summary="Upload base64 receipt and stream processing progress")
+async def upload_receipt_base64_stream(request: Request, body: Base64ImageRequest):
+    """
+    Process a base64 receipt image, streaming each stage as Server-Sent Events
+    
+    Same events as /upload/stream, except stored (the image is not written to disk)
+    """
+    try:
+        image_bytes = decode_base64_image(body.image_base64)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid base64 image")
+
+    async def event_stream():
+        event, data = normalized_event(image_bytes)
+        yield format_sse(event, data)
+        if event == "error":
+            return
+
+        state = build_initial_state(image_bytes=image_bytes, user_id=body.user_id)
+        async for message in workflow_events(request, state):
+            yield message
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
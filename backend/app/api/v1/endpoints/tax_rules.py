@@ -1,9 +1,14 @@
 """Tax Rules API endpoints."""
-from fastapi import APIRouter, HTTPException
+import hmac
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Header
+from fastapi.concurrency import run_in_threadpool
 from typing import List, Optional
 from pydantic import BaseModel
 
-from app.database.database import supabase
+from app.core.config import settings
+from app.services import deduction_recompute
+from app.services.tax_rule_cache import tax_rule_cache
 
 router = APIRouter()
 
@@ -17,6 +22,14 @@ class TaxRuleResponse(BaseModel):
     created_at: Optional[str] = None
 
 
+async def load_rules() -> List[dict]:
+    """Return every tax rule (active or not) from the tax rule cache."""
+    rules = await run_in_threadpool(tax_rule_cache.get_rules, False)
+    if rules is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch tax rules")
+    return rules
+
+
 @router.get("/", summary="Get all tax rules")
 async def get_all_tax_rules(
     tax_year: Optional[int] = None,
@@ -27,24 +40,44 @@ async def get_all_tax_rules(
     - Optional filter by tax_year
     - Optional filter by is_active (default: True)
     """
-    try:
-        query = supabase.table("tax_rules").select("*")
-        
-        if tax_year:
-            query = query.eq("tax_year", tax_year)
-        
-        if is_active is not None:
-            query = query.eq("is_active", is_active)
-        
-        response = query.order("category_name").execute()
-        
-        return {
-            "success": True,
-            "data": response.data,
-            "count": len(response.data)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch tax rules: {str(e)}")
+    rules = [
+        rule for rule in await load_rules()
+        if (not tax_year or rule.get("tax_year") == tax_year)
+        and (is_active is None or rule.get("is_active") == is_active)
+    ]
+
+    return {
+        "success": True,
+        "data": rules,
+        "count": len(rules)
+    }
+
+
+@router.post("/cache/invalidate", summary="Reload the tax rule cache")
+async def invalidate_tax_rule_cache(
+    background_tasks: BackgroundTasks,
+    x_admin_key: Optional[str] = Header(None)
+):
+    """
+    Reload tax rules from the database after editing them
+    - **X-Admin-Key**: must match ADMIN_API_KEY (the endpoint is disabled without it)
+    - Applies to this worker; other workers reload within TAX_RULE_CACHE_TTL
+    - If the rules changed, every user's current tax year is recomputed in the background
+    """
+    if not settings.ADMIN_API_KEY or not x_admin_key or not hmac.compare_digest(
+        x_admin_key.encode("utf-8"), settings.ADMIN_API_KEY.encode("utf-8")
+    ):
+        raise HTTPException(status_code=403, detail="Admin key required")
+    
+    version = tax_rule_cache.version
+    stats = await run_in_threadpool(tax_rule_cache.invalidate)
+    if version and stats["version"] != version:
+        background_tasks.add_task(deduction_recompute.recompute)
+    
+    return {
+        "success": True,
+        "data": stats
+    }
 
 
 @router.get("/{rule_id}", summary="Get a specific tax rule by ID")
@@ -52,20 +85,16 @@ async def get_tax_rule_by_id(rule_id: str):
     """
     Retrieve a single tax rule by ID
     """
-    try:
-        response = supabase.table("tax_rules").select("*").eq("id", rule_id).execute()
-        
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail="Tax rule not found")
-        
-        return {
-            "success": True,
-            "data": response.data[0]
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch tax rule: {str(e)}")
+    await load_rules()
+    rule = tax_rule_cache.get_by_id(rule_id)
+
+    if not rule:
+        raise HTTPException(status_code=404, detail="Tax rule not found")
+
+    return {
+        "success": True,
+        "data": rule
+    }
 
 
 @router.get("/category/{category_name}", summary="Get tax rule by category name")
@@ -74,22 +103,16 @@ async def get_tax_rule_by_category(category_name: str, tax_year: Optional[int] =
     Retrieve tax rule by category name and tax year
     Default tax_year: 2026
     """
-    try:
-        query = supabase.table("tax_rules").select("*").eq("category_name", category_name).eq("is_active", True)
-        
-        if tax_year:
-            query = query.eq("tax_year", tax_year)
-        
-        response = query.execute()
-        
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail=f"Tax rule for category '{category_name}' not found")
-        
-        return {
-            "success": True,
-            "data": response.data[0]
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch tax rule: {str(e)}")
+    matches = [
+        rule for rule in await load_rules()
+        if rule.get("category_name") == category_name and rule.get("is_active")
+        and (not tax_year or rule.get("tax_year") == tax_year)
+    ]
+
+    if not matches:
+        raise HTTPException(status_code=404, detail=f"Tax rule for category '{category_name}' not found")
+
+    return {
+        "success": True,
+        "data": matches[0]
+    }
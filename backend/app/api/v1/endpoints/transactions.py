@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, BackgroundTasks, HTTPException, UploadFile, File, Form, Header
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
 from pydantic import BaseModel
 
@@ -8,10 +9,34 @@ from app.agents.accountant import (
     get_user_transactions,
     save_receipt_from_inspector
 )
+from app.core.config import settings
+from app.database.database import get_auth_client
+from app.services import deduction_ledger, deduction_recompute, transaction_stats, transaction_sync
+from app.services.dashboard_cache import dashboard_cache
 
 router = APIRouter()
 
 
+def extract_user_id_from_token(authorization: Optional[str]) -> str:
+    """Extract user ID from JWT token via Supabase Auth."""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing or invalid authorization token")
+    
+    token = authorization.replace("Bearer ", "")
+    
+    try:
+        # Use a fresh client for token validation to avoid polluting the shared client
+        auth_client = get_auth_client()
+        response = auth_client.auth.get_user(token)
+        
+        if not response or not response.user:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        
+        return response.user.id
+    except Exception as e:
+        raise HTTPException(status_code=401, detail=f"Authentication failed: {str(e)}")
+
+
 class TransactionCreate(BaseModel):
     user_id: str
     merchant_name: str
@@ -36,7 +61,8 @@ async def create_transaction(transaction: TransactionCreate):
     """
     Create a new transaction manually
     """
-    result = insert_transaction(
+    result = await run_in_threadpool(
+        insert_transaction,
         user_id=transaction.user_id,
         merchant_name=transaction.merchant_name,
         merchant_tax_id=transaction.merchant_tax_id,
@@ -57,13 +83,14 @@ async def create_transaction(transaction: TransactionCreate):
 async def update_transaction_endpoint(transaction_id: str, updates: TransactionUpdate):
     """
     Update transaction details
+    - Changing the amount, date or status recomputes the rest of the user's tax year
     """
     update_dict = updates.model_dump(exclude_unset=True)
     
     if not update_dict:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    result = update_transaction(transaction_id, update_dict)
+    result = await run_in_threadpool(update_transaction, transaction_id, update_dict)
     
     if not result.get("success"):
         raise HTTPException(status_code=400, detail=result.get("error", "Failed to update transaction"))
@@ -71,13 +98,54 @@ async def update_transaction_endpoint(transaction_id: str, updates: TransactionU
     return result
 
 
+@router.post("/recompute", summary="Recompute your deductible amounts for a tax year")
+async def recompute_deductions(
+    tax_year: Optional[int] = None,
+    dry_run: bool = False,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Recompute every deductible amount of a tax year under cumulative caps
+    - **Authorization**: Bearer token; only the caller's own transactions are recomputed
+    - Default tax_year: current tax year
+    - dry_run: return the changes without saving them
+    """
+    user_id = extract_user_id_from_token(authorization)
+    result = await run_in_threadpool(
+        deduction_recompute.recompute, tax_year, user_id, None, dry_run
+    )
+    
+    if not result.get("success"):
+        raise HTTPException(status_code=500, detail=result.get("error", "Failed to recompute deductions"))
+    
+    return result
+
+
 @router.get("/user/{user_id}", summary="Get all transactions for a user")
-async def get_transactions(user_id: str, status: Optional[str] = None):
+async def get_transactions(
+    user_id: str,
+    status: Optional[str] = None,
+    since: Optional[str] = None,
+    summary_etag: Optional[str] = None
+):
     """
     Retrieve all transactions for a specific user
     Optional: Filter by status (verified, needs_review, rejected)
+    - Without status, the response includes a cursor for delta sync
+    - Optional since: only transactions changed after this cursor, the ids of
+      deleted ones and the summary if it is not summary_etag any more; pass
+      the returned cursor next time (since= with no value for a full sync)
     """
-    result = get_user_transactions(user_id, status)
+    if since is not None:
+        if status:
+            raise HTTPException(status_code=400, detail="status cannot be combined with since")
+        result = await run_in_threadpool(transaction_sync.sync, user_id, since, summary_etag)
+    else:
+        result = get_user_transactions(user_id, status)
+        if result.get("success") and not status:
+            result["cursor"] = transaction_sync.latest_cursor(
+                [transaction.get("updated_at") for transaction in result["transactions"]]
+            )
     
     if not result.get("success"):
         raise HTTPException(status_code=400, detail=result.get("error", "Failed to fetch transactions"))
@@ -109,15 +177,19 @@ async def get_transaction_by_id(transaction_id: str):
 
 
 @router.delete("/{transaction_id}", summary="Delete a transaction")
-async def delete_transaction(transaction_id: str):
+async def delete_transaction(transaction_id: str, background_tasks: BackgroundTasks):
     """
     Delete a transaction by ID
+    - The rest of the user's tax year is recomputed in the background, since
+      the deleted transaction no longer counts towards its limits
     """
     from app.database.database import supabase
     
     try:
         # Check if transaction exists
-        check_response = supabase.table("transactions").select("id").eq("id", transaction_id).execute()
+        check_response = supabase.table("transactions").select(
+            "id, user_id, transaction_date"
+        ).eq("id", transaction_id).execute()
         
         if not check_response.data or len(check_response.data) == 0:
             raise HTTPException(status_code=404, detail="Transaction not found")
@@ -125,6 +197,15 @@ async def delete_transaction(transaction_id: str):
         # Delete transaction
         response = supabase.table("transactions").delete().eq("id", transaction_id).execute()
         
+        deduction_ledger.remove(transaction_id)
+        deleted = check_response.data[0]
+        dashboard_cache.bump(deleted.get("user_id"))
+        background_tasks.add_task(
+            deduction_recompute.recompute,
+            deduction_recompute.tax_year_of(deleted.get("transaction_date")),
+            user_id=deleted.get("user_id")
+        )
+        
         return {
             "success": True,
             "message": "Transaction deleted successfully",
@@ -137,39 +218,28 @@ async def delete_transaction(transaction_id: str):
 
 
 @router.get("/summary/{user_id}", summary="Get transaction summary for a user")
-async def get_transaction_summary(user_id: str):
+async def get_transaction_summary(user_id: str, tax_year: Optional[int] = None):
     """
     Get summary statistics for user's transactions
     Returns: total deductible amount, count by status, count by category
+    - Optional tax_year: year of the deductible total, as on the dashboard (default: current year)
     """
-    from app.database.database import supabase
-    
+    tax_year = tax_year or settings.DEFAULT_TAX_YEAR
     try:
-        # Get all verified transactions
-        verified_response = supabase.table("transactions").select(
-            "deductible_amount, status"
-        ).eq("user_id", user_id).eq("status", "verified").execute()
-        
-        # Get all transactions for counts
-        all_response = supabase.table("transactions").select(
-            "id, status"
-        ).eq("user_id", user_id).execute()
-        
-        # Calculate total deductible
-        total_deductible = sum(t.get("deductible_amount", 0) for t in verified_response.data)
+        totals = await run_in_threadpool(transaction_stats.get_transaction_totals, user_id, tax_year)
         
         # Count by status
-        status_counts = {"verified": 0, "needs_review": 0, "rejected": 0}
-        for t in all_response.data:
-            status = t.get("status", "needs_review")
-            if status in status_counts:
-                status_counts[status] += 1
+        status_counts = {
+            status: totals["status_breakdown"][status]
+            for status in ("verified", "needs_review", "rejected")
+        }
         
         return {
             "success": True,
             "data": {
-                "total_deductible_amount": total_deductible,
-                "total_transactions": len(all_response.data),
+                "tax_year": tax_year,
+                "total_deductible_amount": totals["total_deductible"],
+                "total_transactions": totals["total_transactions"],
                 "status_breakdown": status_counts
             }
         }
@@ -197,7 +267,8 @@ async def save_receipt(
         "merchant_name": merchant_name
     }
     
-    result = save_receipt_from_inspector(
+    result = await run_in_threadpool(
+        save_receipt_from_inspector,
         user_id=user_id,
         receipt_data=receipt_data,
         category_name=category_name
@@ -0,0 +1,158 @@
+"""Tax assistant workflow API endpoints."""
+import base64
+import binascii
+from typing import Optional, List, Dict, Any
+
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.services.workflow import (
+    build_initial_state,
+    checkpoint_size,
+    get_pending_state,
+    resume_workflow,
+    run_workflow,
+    run_workflow_batch,
+    summarize_result,
+)
+
+router = APIRouter()
+
+
+class WorkflowRequest(BaseModel):
+    user_id: str
+    question: str = ""
+    image_base64: Optional[str] = None
+
+
+class WorkflowBatchRequest(BaseModel):
+    requests: List[WorkflowRequest]
+
+
+class WorkflowResumeRequest(BaseModel):
+    thread_id: str
+    user_id: str
+    date: Optional[str] = None
+    amount: Optional[float] = None
+    tax_id: Optional[str] = None
+    merchant_name: Optional[str] = None
+
+
+def build_request_state(request: WorkflowRequest) -> Dict[str, Any]:
+    """Turn an API request into the workflow's initial state."""
+    image_bytes = None
+    if request.image_base64:
+        # "data:image/jpeg;base64,..." -> "..."
+        base64_str = request.image_base64.split("base64,")[-1]
+        try:
+            image_bytes = base64.b64decode(base64_str)
+        except (binascii.Error, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid base64 image")
+    elif not request.question.strip():
+        raise HTTPException(status_code=400, detail="Either question or image_base64 is required")
+
+    return build_initial_state(request.question, image_bytes=image_bytes, user_id=request.user_id)
+
+
+@router.post("/invoke", summary="Run the tax assistant workflow")
+async def invoke_workflow(request: WorkflowRequest):
+    """
+    Run one request through the compiled tax assistant graph
+    - With image_base64: inspect -> tax expert -> accountant (or human input if fields are missing)
+    - With only a question: tax Q&A
+    - status "awaiting_user_input": send the missing fields to /workflow/resume with the thread_id
+    """
+    state = build_request_state(request)
+
+    try:
+        result = await run_in_threadpool(run_workflow, state)
+    except Exception as e:
+        print(f"Workflow error: {e}")
+        raise HTTPException(status_code=500, detail=f"Workflow failed: {str(e)}")
+
+    return {
+        "success": True,
+        "data": summarize_result(result)
+    }
+
+
+@router.post("/batch", summary="Run the tax assistant workflow on several requests")
+async def batch_workflow(request: WorkflowBatchRequest):
+    """
+    Run several requests through the compiled graph concurrently
+    - Runs graph.batch in the threadpool: the SqliteSaver checkpointer has no async API
+    - At most WORKFLOW_BATCH_CONCURRENCY runs at a time
+    - Results are returned in request order; one failed run does not fail the others
+    """
+    if not request.requests:
+        raise HTTPException(status_code=400, detail="No requests given")
+    if len(request.requests) > settings.WORKFLOW_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.WORKFLOW_BATCH_MAX} requests per batch"
+        )
+
+    states = [build_request_state(item) for item in request.requests]
+
+    results = await run_in_threadpool(run_workflow_batch, states, settings.WORKFLOW_BATCH_CONCURRENCY)
+
+    items = []
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Workflow batch item failed: {result}")
+            items.append({"success": False, "error": str(result)})
+        else:
+            items.append({"success": True, "data": summarize_result(result)})
+
+    return {
+        "success": True,
+        "data": items
+    }
+
+
+@router.post("/resume", summary="Continue a receipt after the user filled in missing fields")
+async def resume_receipt_workflow(request: WorkflowResumeRequest):
+    """
+    Continue a run that stopped at human input
+    - Merges the given fields into the saved receipt data and continues at the tax expert
+    - The receipt image is not sent to OCR again
+    - Returns status "awaiting_user_input" again if required fields are still missing
+    """
+    fields = request.model_dump(exclude={"thread_id", "user_id"}, exclude_none=True)
+    if not fields:
+        raise HTTPException(status_code=400, detail="No fields given")
+
+    try:
+        result = await run_in_threadpool(resume_workflow, request.thread_id, request.user_id, fields)
+    except Exception as e:
+        print(f"Workflow resume error: {e}")
+        raise HTTPException(status_code=500, detail=f"Workflow failed: {str(e)}")
+
+    if result is None:
+        raise HTTPException(status_code=404, detail="No pending workflow run for this thread")
+
+    return {
+        "success": True,
+        "data": summarize_result(result)
+    }
+
+
+@router.get("/threads/{thread_id}", summary="Get a run waiting for user input")
+async def get_pending_workflow(thread_id: str, user_id: str):
+    """
+    Saved state of a run waiting for user input
+    - checkpoint_bytes: serialized size of the stored checkpoint
+    """
+    values = await run_in_threadpool(get_pending_state, thread_id, user_id)
+    if values is None:
+        raise HTTPException(status_code=404, detail="No pending workflow run for this thread")
+
+    return {
+        "success": True,
+        "data": {
+            **summarize_result({**values, "thread_id": thread_id}),
+            "checkpoint_bytes": await run_in_threadpool(checkpoint_size, thread_id),
+        }
+    }
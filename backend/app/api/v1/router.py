@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import auth, transactions, tax_rules, profile, receipts, dashboard, agent
+from app.api.v1.endpoints import auth, transactions, tax_rules, profile, receipts, dashboard, agent, metrics, workflow
 
 api_router = APIRouter()
 
@@ -10,3 +10,5 @@ api_router.include_router(tax_rules.router, prefix="/tax-rules", tags=["Tax Rule
 api_router.include_router(receipts.router, prefix="/receipts", tags=["Receipt Processing"])
 api_router.include_router(dashboard.router, prefix="/dashboard", tags=["Dashboard"])
 api_router.include_router(agent.router, prefix="/agent", tags=["AI Agent"])
+api_router.include_router(workflow.router, prefix="/workflow", tags=["Workflow"])
+api_router.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
@@ -25,25 +25,91 @@ class Settings:
     # Database Settings
     SUPABASE_URL: Optional[str] = os.getenv("SUPABASE_URL")
     SUPABASE_KEY: Optional[str] = os.getenv("SUPABASE_KEY")
+    SUPABASE_SERVICE_ROLE_KEY: Optional[str] = os.getenv("SUPABASE_SERVICE_ROLE_KEY")  # server-only database functions
     
     # Path Settings
     BASE_DIR: Path = Path(__file__).resolve().parent.parent.parent
     DATA_DIR: Path = BASE_DIR / "data"
     DOCUMENTS_DIR: Path = DATA_DIR / "documents"
     EMBEDDINGS_DIR: Path = DATA_DIR / "embeddings"
+    VECTOR_INDEX_DIR: Path = DATA_DIR / "vector_index"
+    LEXICAL_INDEX_DIR: Path = DATA_DIR / "lexical_index"
+    INDEX_SNAPSHOTS_DIR: Path = DATA_DIR / "index_snapshots"
     RECEIPTS_DIR: Path = DATA_DIR / "receipts"
     
     # Vector Database Settings
+    VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "chroma")  # "chroma" or "numpy"
     CHROMA_COLLECTION_NAME: str = "document_collection"
+    # "default" (Chroma's ONNX MiniLM) or a sentence-transformers model name
+    EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "default")
+    HYBRID_SEARCH: bool = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+    HYBRID_CANDIDATES: int = 10  # candidates per retriever before fusion
+    RRF_K: int = 60  # reciprocal rank fusion damping constant
+    INDEX_SNAPSHOT_KEEP: int = 3  # published snapshots kept on disk
+    INDEX_RELOAD_INTERVAL: float = 5.0  # seconds between CURRENT pointer checks
+    RETRIEVAL_BATCHING: bool = os.getenv("RETRIEVAL_BATCHING", "true").lower() == "true"
+    RETRIEVAL_BATCH_SIZE: int = 32  # max queries embedded and searched together
+    RETRIEVAL_BATCH_WAIT_MS: float = 5.0  # how long a batch waits for more queries
+    
+    # Tax rules
+    TAX_RULE_CACHE_TTL: int = int(os.getenv("TAX_RULE_CACHE_TTL", "300"))  # seconds before rules are reloaded
+    ADMIN_API_KEY: Optional[str] = os.getenv("ADMIN_API_KEY")  # X-Admin-Key for /tax-rules/cache/invalidate; unset disables it
+    DEDUCTION_LEDGER_DB: str = os.getenv("DEDUCTION_LEDGER_DB", str(DATA_DIR / "deduction_ledger.sqlite3"))  # or ":memory:"
+    DEDUCTION_LEDGER_TTL: int = int(os.getenv("DEDUCTION_LEDGER_TTL", "3600"))  # seconds before a user's year and income are reloaded
+    
+    # Dashboard response cache
+    DASHBOARD_CACHE_SIZE: int = int(os.getenv("DASHBOARD_CACHE_SIZE", "1000"))  # responses kept per worker
+    DASHBOARD_CACHE_TTL: int = int(os.getenv("DASHBOARD_CACHE_TTL", "300"))  # seconds; bounds staleness across workers
+    
+    # Transaction delta sync
+    SYNC_PAGE_SIZE: int = 500  # changed rows returned per sync call
+    SYNC_CURSOR_OVERLAP: int = 5  # seconds re-read before a cursor, for rows committed late
+    SYNC_TOMBSTONE_DAYS: int = int(os.getenv("SYNC_TOMBSTONE_DAYS", "30"))  # older cursors get a full resync
     
     # Agent Settings
-    DEFAULT_TAX_YEAR: int = datetime.now().year
+    @property
+    def DEFAULT_TAX_YEAR(self) -> int:
+        """Current calendar year, read on every use so long-running workers roll over."""
+        return datetime.now().year
+    
+    CHUNKER: str = os.getenv("CHUNKER", "structured")  # "structured" or "legacy"
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
-    RAG_N_RESULTS: int = 5
+    RAG_N_RESULTS: int = 3
+    RAG_CONTEXT_TOKENS: int = 1500  # token budget for retrieved context per prompt
+    RAG_DEDUP_SIMILARITY: float = 0.8  # chunks at least this similar are duplicates
+    
+    # Semantic answer cache for free-text questions
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_SIMILARITY: float = 0.9  # min cosine similarity of question embeddings
+    ANSWER_CACHE_MIN_OVERLAP: float = 0.3  # min character-shingle overlap of the questions
+    ANSWER_CACHE_SIZE: int = 500  # answers kept per tax year
+    ANSWER_CACHE_TTL: int = 86400  # seconds
+    
+    # Chat sessions
+    CHAT_SESSIONS_DB: str = os.getenv("CHAT_SESSIONS_DB", str(DATA_DIR / "chat_sessions.sqlite3"))  # or ":memory:"
+    CHAT_SESSION_TTL: int = int(os.getenv("CHAT_SESSION_TTL", "86400"))  # idle seconds before a session expires
+    CHAT_HISTORY_TOKENS: int = 800  # token budget for summary + recent turns per prompt
+    CHAT_HISTORY_TURNS: int = 4  # most recent turns always kept verbatim (budget permitting)
+    CHAT_SUMMARY_EVERY: int = 4  # refresh the summary once this many turns have aged out
+    CHAT_SUMMARY_TOKENS: int = 300  # max size of the rolling summary
+    
+    # LangGraph workflow
+    WORKFLOW_PREFETCH: bool = os.getenv("WORKFLOW_PREFETCH", "true").lower() == "true"  # RAG/rules alongside OCR
+    WORKFLOW_BATCH_MAX: int = 20  # requests accepted by /workflow/batch
+    WORKFLOW_BATCH_CONCURRENCY: int = 4  # workflow runs executed at once per batch
+    WORKFLOW_CHECKPOINT_DB: str = os.getenv("WORKFLOW_CHECKPOINT_DB", str(DATA_DIR / "workflow_checkpoints.sqlite3"))
+    WORKFLOW_CHECKPOINT_TTL: int = int(os.getenv("WORKFLOW_CHECKPOINT_TTL", "604800"))  # seconds a run waits for input
+    WORKFLOW_MESSAGE_MAX_CHARS: int = 500  # longer workflow messages are truncated in checkpoints
+    
+    # Tracing
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+    TRACE_FILE: Optional[str] = os.getenv("TRACE_FILE")  # append spans here as OTLP JSON lines
+    TRACE_BUFFER_SPANS: int = 10000  # finished spans kept in memory for /metrics/traces
     
     # AI Model Settings
     GEMINI_MODEL: str = "gemini-2.5-flash"
+    GEMINI_BASE_URL: Optional[str] = os.getenv("GEMINI_BASE_URL")  # e.g. a local fake server
     
     def validate(self) -> None:
         """Validate required environment variables."""
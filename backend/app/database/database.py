@@ -1,13 +1,27 @@
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 
 from app.core.config import settings
+from app.utils.tracing import traced_http_client
 
 if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
     raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env file")
 
 # Shared client for DB operations (table queries). Never use this for auth
 # sign_in / sign_out because it pollutes the internal postgrest headers.
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+supabase: Client = create_client(
+    settings.SUPABASE_URL,
+    settings.SUPABASE_KEY,
+    options=ClientOptions(httpx_client=traced_http_client()),
+)
+
+# Client for the database functions granted to service_role only
+# (app/database/sql). Without SUPABASE_SERVICE_ROLE_KEY it is the shared
+# client, and callers fall back to plain table queries.
+service_supabase: Client = create_client(
+    settings.SUPABASE_URL,
+    settings.SUPABASE_SERVICE_ROLE_KEY,
+    options=ClientOptions(httpx_client=traced_http_client()),
+) if settings.SUPABASE_SERVICE_ROLE_KEY else supabase
 
 
 def get_auth_client() -> Client:
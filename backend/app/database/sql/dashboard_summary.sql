@@ -0,0 +1,68 @@
+-- Dashboard aggregates computed in Postgres (used by app/services/transaction_stats.py).
+-- Apply once in the Supabase SQL editor, or with:
+--   psql "$DATABASE_URL" -f backend/app/database/sql/dashboard_summary.sql
+-- Until it is applied (or without SUPABASE_SERVICE_ROLE_KEY) the API falls
+-- back to count=exact head requests.
+
+create index if not exists transactions_user_status_idx
+    on public.transactions (user_id, status);
+
+create index if not exists transactions_user_create_at_idx
+    on public.transactions (user_id, create_at desc);
+
+-- Totals, status counts and per-category verified deductions of one user,
+-- in a single round trip. The verified total and the categories are
+-- limited to p_tax_year if given; counts always cover every year.
+create or replace function public.dashboard_summary(p_user_id uuid, p_tax_year integer default null)
+returns jsonb
+language sql
+stable
+as $$
+    with user_transactions as (
+        select status, rule_id, deductible_amount, transaction_date
+        from public.transactions
+        where user_id = p_user_id
+    ),
+    statuses as (
+        select coalesce(jsonb_object_agg(status, transactions), '{}'::jsonb) as status_breakdown
+        from (
+            select coalesce(status, 'needs_review') as status, count(*) as transactions
+            from user_transactions
+            group by 1
+        ) s
+    ),
+    categories as (
+        select coalesce(jsonb_object_agg(category_name, jsonb_build_object(
+            'total_deductible', total_deductible,
+            'transactions', transactions
+        )), '{}'::jsonb) as categories
+        from (
+            select r.category_name,
+                   sum(coalesce(t.deductible_amount, 0)) as total_deductible,
+                   count(*) as transactions
+            from user_transactions t
+            join public.tax_rules r on r.id = t.rule_id
+            where t.status = 'verified'
+              and (p_tax_year is null or extract(year from t.transaction_date::date) = p_tax_year)
+            group by r.category_name
+        ) c
+    )
+    select jsonb_build_object(
+        'total_deductible', (
+            select coalesce(sum(deductible_amount), 0)
+            from user_transactions
+            where status = 'verified'
+              and (p_tax_year is null or extract(year from transaction_date::date) = p_tax_year)
+        ),
+        'total_transactions', (select count(*) from user_transactions),
+        'status_breakdown', statuses.status_breakdown,
+        'categories', categories.categories
+    )
+    from statuses, categories;
+$$;
+
+-- Server side only: it returns any user's totals for the p_user_id given.
+-- Functions are executable by public by default, and Supabase also grants
+-- new functions to anon and authenticated.
+revoke execute on function public.dashboard_summary(uuid, integer) from public, anon, authenticated;
+grant execute on function public.dashboard_summary(uuid, integer) to service_role;
@@ -0,0 +1,34 @@
+-- Bulk write-back of recomputed deductible amounts (used by app/services/deduction_recompute.py).
+-- Apply once in the Supabase SQL editor, or with:
+--   psql "$DATABASE_URL" -f backend/app/database/sql/deduction_write_back.sql
+-- Until it is applied (or without SUPABASE_SERVICE_ROLE_KEY) the API updates
+-- the changed rows one by one.
+
+-- Sets deductible_amount only, and only on rows whose total_amount is
+-- still the one the recompute read: a row edited in the meantime keeps
+-- the edit (its update triggers another recompute). Returns the number
+-- of rows written.
+create or replace function public.set_deductible_amounts(
+    p_ids uuid[],
+    p_amounts numeric[],
+    p_total_amounts numeric[]
+)
+returns integer
+language sql
+as $$
+    with updated as (
+        update public.transactions t
+        set deductible_amount = v.deductible_amount
+        from unnest(p_ids, p_amounts, p_total_amounts) as v(id, deductible_amount, total_amount)
+        where t.id = v.id
+          and t.total_amount = v.total_amount
+        returning 1
+    )
+    select count(*)::integer from updated;
+$$;
+
+-- Server side only: with the anon key anyone could rewrite deductible
+-- amounts. Functions are executable by public by default, and Supabase
+-- also grants new functions to anon and authenticated.
+revoke execute on function public.set_deductible_amounts(uuid[], numeric[], numeric[]) from public, anon, authenticated;
+grant execute on function public.set_deductible_amounts(uuid[], numeric[], numeric[]) to service_role;
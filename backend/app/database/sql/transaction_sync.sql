@@ -0,0 +1,67 @@
+-- Delta sync of transactions (used by app/services/transaction_sync.py).
+-- Apply once in the Supabase SQL editor, or with:
+--   psql "$DATABASE_URL" -f backend/app/database/sql/transaction_sync.sql
+-- Until it is applied, sync requests get the full transaction list.
+
+alter table public.transactions
+    add column if not exists updated_at timestamptz not null default now();
+
+create index if not exists transactions_user_updated_at_idx
+    on public.transactions (user_id, updated_at, id);
+
+-- clock_timestamp() rather than now(), so rows written by one statement
+-- (e.g. a batched write-back from a recompute) still get distinct timestamps
+create or replace function public.transactions_set_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := clock_timestamp();
+    return new;
+end;
+$$;
+
+drop trigger if exists transactions_set_updated_at on public.transactions;
+create trigger transactions_set_updated_at
+    before insert or update on public.transactions
+    for each row execute function public.transactions_set_updated_at();
+
+-- Deleted transactions, so clients can drop them from their copy.
+-- Rows older than SYNC_TOMBSTONE_DAYS are deleted by the API.
+-- The API reads and prunes this table with the same key as transactions,
+-- so it has row level security off like transactions; turning RLS on
+-- here would need policies for that key, or sync sees no deletions.
+create table if not exists public.transaction_tombstones (
+    transaction_id uuid primary key,
+    user_id uuid,
+    deleted_at timestamptz not null default clock_timestamp()
+);
+
+alter table public.transaction_tombstones disable row level security;
+
+create index if not exists transaction_tombstones_user_deleted_at_idx
+    on public.transaction_tombstones (user_id, deleted_at);
+
+create index if not exists transaction_tombstones_deleted_at_idx
+    on public.transaction_tombstones (deleted_at);
+
+-- security definer: deleting a transaction records its tombstone whatever
+-- the deleting role may do on transaction_tombstones
+create or replace function public.transactions_record_tombstone()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    insert into public.transaction_tombstones (transaction_id, user_id)
+    values (old.id, old.user_id)
+    on conflict (transaction_id) do update set deleted_at = excluded.deleted_at;
+    return old;
+end;
+$$;
+
+drop trigger if exists transactions_record_tombstone on public.transactions;
+create trigger transactions_record_tombstone
+    after delete on public.transactions
+    for each row execute function public.transactions_record_tombstone();
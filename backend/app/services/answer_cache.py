@@ -0,0 +1,161 @@
+"""Semantic cache of answers to free-text tax questions.
+
+Filing season brings the same few questions over and over in slightly
+different words. Answers are stored with the normalized embedding of
+their question in a small in-memory matrix per (tax year, index snapshot)
+partition. A new question is served from the cache when its embedding is
+close enough to a stored one. Publishing a new knowledge base snapshot
+starts a fresh partition, so answers never outlive the rules they were
+based on.
+
+The default embedding model is English-only and places unrelated Thai
+questions closer together than it should. A hit therefore also needs some
+character overlap with the stored question and the same numbers (amounts
+and years change the answer).
+"""
+import re
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.context_builder import shingles, similarity
+from app.services.vector_store import embed_texts
+
+
+NUMBER_PATTERN = re.compile(r"\d[\d,.]*")
+LATENCY_WINDOW = 1000  # recent answers kept per kind for percentiles
+
+
+def _numbers(text: str) -> frozenset:
+    return frozenset(number.replace(",", "").rstrip(".") for number in NUMBER_PATTERN.findall(text))
+
+
+class _Partition:
+    """Cached answers for one tax year and snapshot version."""
+
+    def __init__(self, dim: int):
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.entries: List[Dict[str, Any]] = []
+
+
+class SemanticAnswerCache:
+    """In-memory semantic cache with hit-rate and latency statistics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._partitions: Dict[Tuple[int, str], _Partition] = {}
+        self._hits = 0
+        self._misses = 0
+        self._latencies = {"cached": deque(maxlen=LATENCY_WINDOW), "uncached": deque(maxlen=LATENCY_WINDOW)}
+
+    def lookup(self, question: str, tax_year: int, version: str) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        """Find a cached answer to a similar question.
+
+        Returns:
+            (entry, embedding): the cached entry (dict with 'question',
+            'answer', 'sources', 'created_at') or None, and the question's
+            embedding to pass to store() on a miss. Both are None when the
+            cache is disabled.
+        """
+        if not settings.ANSWER_CACHE_ENABLED:
+            return None, None
+
+        embedding = embed_texts([question])[0]
+        now = time.time()
+
+        with self._lock:
+            partition = self._partitions.get((tax_year, version))
+            if partition is None or not partition.entries:
+                self._misses += 1
+                return None, embedding
+
+            scores = partition.vectors @ embedding
+            question_shingles = shingles(question)
+            question_numbers = _numbers(question)
+
+            for position in np.argsort(-scores):
+                if scores[position] < settings.ANSWER_CACHE_SIMILARITY:
+                    break
+                entry = partition.entries[position]
+                if now - entry["created_at"] > settings.ANSWER_CACHE_TTL:
+                    continue
+                if entry["numbers"] != question_numbers:
+                    continue
+                if similarity(entry["shingles"], question_shingles) < settings.ANSWER_CACHE_MIN_OVERLAP:
+                    continue
+
+                self._hits += 1
+                print(f"Answer cache hit ({scores[position]:.3f}): {question!r} ~ {entry['question']!r}")
+                return entry, embedding
+
+            self._misses += 1
+            return None, embedding
+
+    def store(self, question: str, embedding: Optional[np.ndarray], tax_year: int, version: str,
+              answer: str, sources: Optional[List[Dict[str, Any]]] = None) -> None:
+        """Cache an answer. Partitions for other snapshot versions are dropped."""
+        if embedding is None or not settings.ANSWER_CACHE_ENABLED:
+            return
+
+        entry = {
+            "question": question,
+            "answer": answer,
+            "sources": sources or [],
+            "created_at": time.time(),
+            "numbers": _numbers(question),
+            "shingles": shingles(question),
+        }
+
+        with self._lock:
+            # Answers from an older knowledge base are stale
+            for key in [key for key in self._partitions if key[1] != version]:
+                del self._partitions[key]
+
+            partition = self._partitions.setdefault((tax_year, version), _Partition(len(embedding)))
+            partition.vectors = np.vstack([partition.vectors, embedding.astype(np.float32)])
+            partition.entries.append(entry)
+
+            # Oldest entries go first
+            overflow = len(partition.entries) - settings.ANSWER_CACHE_SIZE
+            if overflow > 0:
+                partition.vectors = partition.vectors[overflow:]
+                partition.entries = partition.entries[overflow:]
+
+    def record_latency(self, cached: bool, elapsed_ms: float) -> None:
+        """Record how long one answer took to serve."""
+        with self._lock:
+            self._latencies["cached" if cached else "uncached"].append(elapsed_ms)
+
+    def clear(self) -> None:
+        """Drop every cached answer (statistics are kept)."""
+        with self._lock:
+            self._partitions.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit rate, size and p50 latency of cached vs uncached answers."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            latencies = {kind: list(values) for kind, values in self._latencies.items()}
+            return {
+                "enabled": settings.ANSWER_CACHE_ENABLED,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "entries": sum(len(p.entries) for p in self._partitions.values()),
+                "partitions": [
+                    {"tax_year": year, "snapshot": version, "entries": len(p.entries)}
+                    for (year, version), p in self._partitions.items()
+                ],
+                "p50_ms": {
+                    kind: round(statistics.median(values), 1) if values else None
+                    for kind, values in latencies.items()
+                },
+            }
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,284 @@
+"""Server-side chat sessions with bounded, token-budgeted history.
+
+Each session keeps its turns in a local SQLite database and expires after
+CHAT_SESSION_TTL seconds without activity. The history sent with a new
+question is bounded no matter how long the conversation gets:
+
+- a rolling summary of older turns, refreshed only once CHAT_SUMMARY_EVERY
+  turns have fallen out of the verbatim window (one extra Gemini call every
+  K turns instead of every turn), and
+- the most recent turns verbatim (at least the last CHAT_HISTORY_TURNS,
+  plus any older turns not yet folded into the summary), packed newest
+  first until CHAT_HISTORY_TOKENS is used up.
+
+The prompt size of every turn is stored with it, so get_session_stats can
+show that prompt size stays flat as conversations grow.
+
+Set CHAT_SESSIONS_DB=:memory: to keep sessions in memory only.
+"""
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from app.core.config import settings
+from app.services.context_builder import truncate_to_tokens
+from app.services.llm import generate_text
+from app.utils.tokens import count_tokens
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_turns INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS chat_turns (
+    session_id TEXT NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+    turn INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    history_tokens INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, turn)
+);
+"""
+
+_lock = threading.Lock()
+_connection: Optional[sqlite3.Connection] = None
+
+
+def _db() -> sqlite3.Connection:
+    """Return the shared connection, creating the database on first use.
+
+    Callers must hold _lock.
+    """
+    global _connection
+    if _connection is None:
+        path = str(settings.CHAT_SESSIONS_DB)
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        _connection = sqlite3.connect(path, check_same_thread=False)
+        _connection.row_factory = sqlite3.Row
+        _connection.execute("PRAGMA foreign_keys = ON")
+        _connection.executescript(SCHEMA)
+    return _connection
+
+
+def _purge_expired(db: sqlite3.Connection) -> None:
+    cutoff = time.time() - settings.CHAT_SESSION_TTL
+    db.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (cutoff,))
+
+
+def create_session(user_id: str) -> str:
+    """Start a new chat session and return its id."""
+    now = time.time()
+    session_id = uuid.uuid4().hex
+    with _lock:
+        db = _db()
+        _purge_expired(db)
+        db.execute(
+            "INSERT INTO chat_sessions (id, user_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (session_id, user_id, now, now),
+        )
+        db.commit()
+    return session_id
+
+
+def get_session(session_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """Return a live session owned by user_id, or None if unknown or expired."""
+    cutoff = time.time() - settings.CHAT_SESSION_TTL
+    with _lock:
+        row = _db().execute(
+            "SELECT * FROM chat_sessions WHERE id = ? AND user_id = ? AND updated_at >= ?",
+            (session_id, user_id, cutoff),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def delete_session(session_id: str, user_id: str) -> bool:
+    """Delete a session and its turns. Returns whether it existed."""
+    with _lock:
+        db = _db()
+        cursor = db.execute(
+            "DELETE FROM chat_sessions WHERE id = ? AND user_id = ?", (session_id, user_id)
+        )
+        db.commit()
+    return cursor.rowcount > 0
+
+
+def _turns(session_id: str, after: int = 0) -> List[Dict[str, Any]]:
+    with _lock:
+        rows = _db().execute(
+            "SELECT turn, question, answer FROM chat_turns WHERE session_id = ? AND turn > ? ORDER BY turn",
+            (session_id, after),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def _format_turn(turn: Dict[str, Any]) -> str:
+    return f"User: {turn['question']}\nAssistant: {turn['answer']}"
+
+
+def build_history(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Assemble a session's history under CHAT_HISTORY_TOKENS.
+
+    Returns:
+        Dict with 'text' (summary and recent turns, empty for a new
+        session), 'tokens', 'verbatim_turns' (turns included verbatim) and
+        'dropped_turns' (unsummarized turns left out for budget).
+    """
+    budget = settings.CHAT_HISTORY_TOKENS
+    summary = truncate_to_tokens(session["summary"], settings.CHAT_SUMMARY_TOKENS) if session["summary"] else ""
+    used = count_tokens(summary)
+
+    recent: List[str] = []
+    dropped = 0
+    # Turns not yet in the summary, newest first
+    for turn in reversed(_turns(session["id"], after=session["summarized_turns"])):
+        text = _format_turn(turn)
+        cost = count_tokens(text)
+        if used + cost > budget:
+            if recent:
+                dropped += 1
+                continue
+            text = truncate_to_tokens(text, budget - used)
+            cost = count_tokens(text)
+        recent.insert(0, text)
+        used += cost
+
+    parts = []
+    if summary:
+        parts.append(f"Summary of earlier conversation:\n{summary}")
+    if recent:
+        parts.append("Recent conversation:\n" + "\n\n".join(recent))
+
+    return {
+        "text": "\n\n".join(parts),
+        "tokens": used,
+        "verbatim_turns": len(recent),
+        "dropped_turns": dropped,
+    }
+
+
+def add_turn(session_id: str, question: str, answer: str,
+             prompt_tokens: int = 0, history_tokens: int = 0) -> int:
+    """Append a question and its answer to a session. Returns the turn number."""
+    now = time.time()
+    with _lock:
+        db = _db()
+        row = db.execute(
+            "SELECT COALESCE(MAX(turn), 0) + 1 FROM chat_turns WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        turn = row[0]
+        db.execute(
+            "INSERT INTO chat_turns (session_id, turn, question, answer, prompt_tokens, history_tokens, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id, turn, question, answer, prompt_tokens, history_tokens, now),
+        )
+        db.execute("UPDATE chat_sessions SET updated_at = ? WHERE id = ?", (now, session_id))
+        db.commit()
+    return turn
+
+
+def refresh_summary(session_id: str) -> bool:
+    """Fold turns that left the verbatim window into the rolling summary.
+
+    Does nothing until CHAT_SUMMARY_EVERY such turns have accumulated. If
+    the summary call fails, the turns stay verbatim and are retried on the
+    next refresh.
+
+    Returns:
+        True if the summary was updated.
+    """
+    with _lock:
+        row = _db().execute(
+            "SELECT s.summary, s.summarized_turns, COALESCE(MAX(t.turn), 0) AS turns "
+            "FROM chat_sessions s LEFT JOIN chat_turns t ON t.session_id = s.id "
+            "WHERE s.id = ? GROUP BY s.id",
+            (session_id,),
+        ).fetchone()
+    if row is None:
+        return False
+
+    # Turns older than the verbatim window that the summary does not cover yet
+    cutoff = row["turns"] - settings.CHAT_HISTORY_TURNS
+    if cutoff - row["summarized_turns"] < settings.CHAT_SUMMARY_EVERY:
+        return False
+
+    turns = [turn for turn in _turns(session_id, after=row["summarized_turns"]) if turn["turn"] <= cutoff]
+    transcript = "\n\n".join(_format_turn(turn) for turn in turns)
+    prompt = f"""Update the running summary of a conversation between a user and a Thai tax assistant.
+
+Current summary:
+{row['summary'] or '(none)'}
+
+New turns:
+{transcript}
+
+Instructions:
+- Keep facts the user stated about themselves (income, family, purchases, amounts, tax year).
+- Keep the questions asked and the key figures in the answers.
+- Write in the language of the conversation, at most {settings.CHAT_SUMMARY_TOKENS} tokens.
+
+Updated summary:"""
+
+    try:
+        response = generate_text(prompt, label="chat_summary")
+    except Exception as e:
+        print(f"Error summarizing chat session {session_id}: {e}")
+        return False
+
+    summary = truncate_to_tokens((response.text or "").strip(), settings.CHAT_SUMMARY_TOKENS)
+    with _lock:
+        db = _db()
+        db.execute(
+            "UPDATE chat_sessions SET summary = ?, summarized_turns = ? WHERE id = ?",
+            (summary, cutoff, session_id),
+        )
+        db.commit()
+
+    print(f"Chat session {session_id}: summarized turns {row['summarized_turns'] + 1}-{cutoff} "
+          f"({count_tokens(summary)} tokens)")
+    return True
+
+
+def get_session_stats(max_turn: int = 20) -> Dict[str, Any]:
+    """Return session counts and average prompt tokens by turn number.
+
+    Args:
+        max_turn: Highest turn number to report separately; later turns are
+            grouped into the last bucket.
+    """
+    cutoff = time.time() - settings.CHAT_SESSION_TTL
+    with _lock:
+        db = _db()
+        sessions = db.execute(
+            "SELECT COUNT(*) FROM chat_sessions WHERE updated_at >= ?", (cutoff,)
+        ).fetchone()[0]
+        rows = db.execute(
+            "SELECT MIN(turn, ?) AS bucket, COUNT(*) AS turns, "
+            "AVG(prompt_tokens) AS prompt_tokens, AVG(history_tokens) AS history_tokens "
+            "FROM chat_turns GROUP BY bucket ORDER BY bucket",
+            (max_turn,),
+        ).fetchall()
+
+    return {
+        "active_sessions": sessions,
+        "history_budget_tokens": settings.CHAT_HISTORY_TOKENS,
+        "by_turn": [
+            {
+                "turn": f"{row['bucket']}+" if row["bucket"] == max_turn else row["bucket"],
+                "turns": row["turns"],
+                "avg_prompt_tokens": round(row["prompt_tokens"], 1),
+                "avg_history_tokens": round(row["history_tokens"], 1),
+            }
+            for row in rows
+        ],
+    }
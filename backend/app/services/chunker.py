@@ -0,0 +1,286 @@
+"""Page-aware, Thai-aware chunking for the tax rule knowledge base.
+
+Chunks are built from paragraph, heading and table blocks instead of raw
+character offsets, so Thai words and table rows are never cut in half.
+Every chunk carries the page, section heading, tax year, document type and
+deduction category group it came from.
+"""
+import re
+from typing import Dict, Any, List, Optional
+
+from app.core.config import settings
+from app.services.tax_categories import dominant_category
+from app.utils.thai_text import join_lines, segment_words
+
+
+# File name prefix -> document type tag
+DOCUMENT_TYPES = [
+    ("Q_A", "qa"),
+    ("Ins", "instruction"),
+    ("Rate", "rate_table"),
+    ("Tax_deduction", "deduction_guide"),
+    ("E-Tax", "e_tax_invoice"),
+]
+
+BE_YEAR_OFFSET = 543
+
+HEADING_PATTERN = re.compile(
+    r"^(\d+(\.\d+)*[.)]\s|ข้อ\s*\d+|หมวด|ส่วนที่|บทที่|คำถาม|ถาม\s*[:：]|Q\d*[.:]|[A-Z][A-Za-z ]{2,40}:$)"
+)
+BULLET_PATTERN = re.compile(r"^([-•●▪*]|\(\d+\)|\d+\))\s*")
+NUMBER_PATTERN = re.compile(r"\d[\d,]*(\.\d+)?")
+COLUMN_GAP_PATTERN = re.compile(r"\S {2,}\S")
+WHITESPACE_PATTERN = re.compile(r"[ \t]+")
+BE_YEAR_PATTERN = re.compile(r"(?<!\d)25[5-9]\d(?!\d)")
+
+
+def detect_document_type(file_name: str) -> str:
+    """Infer the document type tag from the PDF file name."""
+    for prefix, doc_type in DOCUMENT_TYPES:
+        if file_name.startswith(prefix):
+            return doc_type
+    return "document"
+
+
+def detect_tax_year(file_name: str, text: str = "") -> int:
+    """Infer the tax year (CE) a document applies to.
+
+    Takes the most frequent Buddhist Era year in the text, i.e. the period
+    the measures cover, then a standalone BE year in the file name (e.g.
+    ``Tax_deduction_2568.pdf``). A ``ddmmyyyy`` suffix is the publication
+    date, which is often the year before the one covered, so it is never
+    used (``Q_A_Easy_E-Receipt_2.0_25122567.pdf`` covers 2568).
+
+    Returns:
+        Tax year in CE, or 0 if it cannot be determined.
+    """
+    years = BE_YEAR_PATTERN.findall(text)
+    if years:
+        most_common = max(sorted(set(years)), key=years.count)
+        return int(most_common) - BE_YEAR_OFFSET
+
+    match = BE_YEAR_PATTERN.search(file_name.rsplit(".", 1)[0])
+    if match:
+        return int(match.group()) - BE_YEAR_OFFSET
+
+    return 0
+
+
+def _is_heading(line: str) -> bool:
+    """Return True if a line looks like a section heading."""
+    if len(line) > 80:
+        return False
+    return bool(HEADING_PATTERN.match(line))
+
+
+def _is_table_row(line: str) -> bool:
+    """Return True if a line looks like a row of a table.
+
+    Revenue Department PDFs use tabs to justify ordinary text, so only runs
+    of spaces between cells containing numbers count as column gaps.
+    """
+    return len(COLUMN_GAP_PATTERN.findall(line)) >= 2 and bool(NUMBER_PATTERN.search(line))
+
+
+def split_blocks(page_text: str) -> List[Dict[str, str]]:
+    """Split one page of text into heading, paragraph and table blocks.
+
+    Returns:
+        List of dicts with 'kind' ("heading", "paragraph", "table") and 'text'.
+    """
+    blocks = []
+    paragraph: List[str] = []
+    table: List[str] = []
+
+    def flush_paragraph():
+        if paragraph:
+            text = join_lines(paragraph)
+            if text:
+                blocks.append({"kind": "paragraph", "text": text})
+            paragraph.clear()
+
+    def flush_table():
+        if table:
+            blocks.append({"kind": "table", "text": "\n".join(table)})
+            table.clear()
+
+    for raw_line in page_text.splitlines():
+        line = WHITESPACE_PATTERN.sub(" ", raw_line).strip()
+
+        if not line:
+            flush_paragraph()
+            flush_table()
+            continue
+
+        if _is_table_row(raw_line.strip()):
+            flush_paragraph()
+            table.append(re.sub(r" {2,}", " | ", raw_line.strip()))
+            continue
+
+        flush_table()
+
+        if _is_heading(line):
+            flush_paragraph()
+            blocks.append({"kind": "heading", "text": line})
+        elif BULLET_PATTERN.match(line):
+            flush_paragraph()
+            paragraph.append(line)
+        else:
+            paragraph.append(line)
+
+    flush_paragraph()
+    flush_table()
+
+    return blocks
+
+
+def _split_long_text(text: str, first_size: int, chunk_size: int,
+                     chunk_overlap: int, separator: str) -> List[str]:
+    """Split a block on word or row boundaries.
+
+    The first piece is at most first_size characters so it can fill the
+    space left in the current chunk; later pieces are at most chunk_size.
+    """
+    if separator == "\n":
+        units = [row + "\n" for row in text.split("\n")]
+    else:
+        units = segment_words(text)
+
+    pieces = []
+    current: List[str] = []
+    current_len = 0
+    limit = first_size
+
+    for unit in units:
+        if current_len + len(unit) > limit and (current or limit != chunk_size):
+            if not current:
+                # Nothing fits in the space left in the current chunk
+                pieces.append("")
+                limit = chunk_size
+                current.append(unit)
+                current_len += len(unit)
+                continue
+
+            pieces.append("".join(current).strip())
+            limit = chunk_size
+
+            # Carry trailing whole units forward as overlap
+            overlap: List[str] = []
+            overlap_len = 0
+            for previous in reversed(current):
+                if overlap_len + len(previous) > chunk_overlap:
+                    break
+                overlap.insert(0, previous)
+                overlap_len += len(previous)
+            current = overlap
+            current_len = overlap_len
+
+        current.append(unit)
+        current_len += len(unit)
+
+    if current:
+        pieces.append("".join(current).strip())
+
+    return pieces
+
+
+def chunk_document(document: Dict[str, Any], chunk_size: int = None,
+                   chunk_overlap: int = None) -> List[Dict[str, Any]]:
+    """Chunk a loaded PDF document on paragraph, table and page structure.
+
+    Blocks are packed into chunks of up to chunk_size characters, preferring
+    to break at section headings. A paragraph that does not fit is split on
+    a Thai word boundary to fill the rest of the chunk. Overlap is only
+    used when a single paragraph or table has to be split, because block
+    boundaries are already natural break points.
+
+    Args:
+        document: Dict from load_pdf_documents with 'id', 'source' and 'pages'.
+        chunk_size: Maximum characters per chunk (default: settings.CHUNK_SIZE).
+        chunk_overlap: Overlap when splitting one long block (default: settings.CHUNK_OVERLAP).
+
+    Returns:
+        List of dicts with 'id', 'text' and 'metadata' keys.
+    """
+    if chunk_size is None:
+        chunk_size = settings.CHUNK_SIZE
+    if chunk_overlap is None:
+        chunk_overlap = settings.CHUNK_OVERLAP
+
+    source = document["source"]
+    pages = document.get("pages") or [document.get("text", "")]
+    doc_type = detect_document_type(source)
+    tax_year = detect_tax_year(source, document.get("text", ""))
+
+    chunks: List[Dict[str, Any]] = []
+    current: List[str] = []
+    current_len = 0
+    current_page: Optional[int] = None
+    current_section = ""
+    section = ""
+
+    def flush(end_page: int):
+        nonlocal current, current_len, current_page
+        text = "\n".join(current).strip()
+        if text:
+            chunks.append({
+                "id": f"{document['id']}_p{current_page}_c{len(chunks)}",
+                "text": text,
+                "metadata": {
+                    "source": source,
+                    "page": current_page,
+                    "page_end": end_page,
+                    "section": current_section,
+                    "tax_year": tax_year,
+                    "doc_type": doc_type,
+                    "category": dominant_category(f"{current_section}\n{text}"),
+                },
+            })
+        current = []
+        current_len = 0
+        current_page = None
+
+    last_page = 1
+    for page_number, page_text in enumerate(pages, start=1):
+        for block in split_blocks(page_text or ""):
+            text = block["text"]
+
+            if block["kind"] == "heading":
+                # Start a new chunk at a section boundary once the current one
+                # is reasonably full, so the heading stays with its body
+                if current_len >= chunk_size // 2:
+                    flush(last_page)
+                section = text[:120]
+
+            room = chunk_size - current_len
+            if current and len(text) + 1 > room and (block["kind"] != "paragraph" or room < chunk_size // 4):
+                # Tables and headings are not split to fill leftover space
+                flush(last_page)
+                room = chunk_size
+
+            if current_page is None:
+                current_page = page_number
+                current_section = section
+
+            if len(text) + 1 > room:
+                separator = "\n" if block["kind"] == "table" else " "
+                pieces = _split_long_text(text, room, chunk_size, chunk_overlap, separator)
+                for index, piece in enumerate(pieces):
+                    if index > 0:
+                        flush(page_number)
+                        current_page = page_number
+                        current_section = section
+                    if piece:
+                        current.append(piece)
+                        current_len += len(piece) + 1
+                last_page = page_number
+                continue
+
+            current.append(text)
+            current_len += len(text) + 1
+            last_page = page_number
+
+    if current:
+        flush(last_page)
+
+    return chunks
@@ -0,0 +1,111 @@
+"""Token-budgeted context assembly for RAG prompts.
+
+Retrieved chunks are packed into the prompt in relevance order until the
+token budget is used up. Chunks that are near-duplicates of one already
+packed (overlapping windows, the same rule in both the ภ.ง.ด.90 and
+ภ.ง.ด.91 guides) are dropped first, so the budget goes to distinct rules.
+"""
+import re
+from typing import Dict, Any, List, Set
+
+from app.core.config import settings
+from app.utils.tokens import count_tokens
+
+
+CONTEXT_SEPARATOR = "\n\n"
+SHINGLE_SIZE = 5
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """Return the set of character n-grams of text, ignoring whitespace.
+
+    Character shingles work the same for Thai (no word spaces) and English.
+    """
+    normalized = WHITESPACE_PATTERN.sub("", text.lower())
+    if len(normalized) <= size:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def similarity(a: Set[str], b: Set[str]) -> float:
+    """Return the Jaccard similarity of two shingle sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to the longest prefix that fits in max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def assemble_context(chunks: List[str], max_tokens: int = None,
+                     dedup_threshold: float = None) -> Dict[str, Any]:
+    """Pack chunks, most relevant first, into a token budget.
+
+    A chunk that does not fit is skipped so a shorter, less relevant one
+    can still use the remaining room. If even the most relevant chunk is
+    over budget it is truncated rather than leaving the prompt empty.
+
+    Args:
+        chunks: Chunk texts ordered by relevance.
+        max_tokens: Token budget for the context (default: settings.RAG_CONTEXT_TOKENS).
+        dedup_threshold: Shingle similarity at or above which a chunk counts as
+            a duplicate (default: settings.RAG_DEDUP_SIMILARITY).
+
+    Returns:
+        Dict with 'context' (joined text), 'chunks' (packed texts), 'tokens',
+        'duplicates' and 'over_budget' (number of chunks dropped for each reason).
+    """
+    if max_tokens is None:
+        max_tokens = settings.RAG_CONTEXT_TOKENS
+    if dedup_threshold is None:
+        dedup_threshold = settings.RAG_DEDUP_SIMILARITY
+
+    separator_tokens = count_tokens(CONTEXT_SEPARATOR)
+    packed: List[str] = []
+    packed_shingles: List[Set[str]] = []
+    used_tokens = 0
+    duplicates = 0
+    over_budget = 0
+
+    for chunk in chunks:
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+
+        chunk_shingles = shingles(chunk)
+        if any(similarity(chunk_shingles, seen) >= dedup_threshold for seen in packed_shingles):
+            duplicates += 1
+            continue
+
+        cost = count_tokens(chunk) + (separator_tokens if packed else 0)
+        if used_tokens + cost > max_tokens:
+            if packed:
+                over_budget += 1
+                continue
+            chunk = truncate_to_tokens(chunk, max_tokens)
+            cost = count_tokens(chunk)
+
+        packed.append(chunk)
+        packed_shingles.append(chunk_shingles)
+        used_tokens += cost
+
+    return {
+        "context": CONTEXT_SEPARATOR.join(packed),
+        "chunks": packed,
+        "tokens": used_tokens,
+        "duplicates": duplicates,
+        "over_budget": over_budget,
+    }
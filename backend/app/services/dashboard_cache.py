@@ -0,0 +1,155 @@
+"""Per-user cache of dashboard responses.
+
+The dashboard is reloaded on every navigation, but its data only changes
+when the user's transactions do. Responses are cached per (user, kind)
+as serialized JSON with a strong ETag (a hash of the body), so a hit
+costs no queries and a client that already has the body gets a 304.
+
+Every write path calls bump(user_id) after writing (insert_transaction,
+update_transaction, deleting a transaction, deduction recomputes). A
+response is only served while the user's version is the one it was
+built at, and a response built while a write was in flight is never
+stored. Tax rule changes (tax_rule_cache.version) invalidate everything.
+
+The cache holds DASHBOARD_CACHE_SIZE responses and evicts the least
+recently used. Each worker has its own cache, so entries also expire
+after DASHBOARD_CACHE_TTL seconds to bound how long a write made by
+another worker can go unseen.
+"""
+import hashlib
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.tax_rule_cache import tax_rule_cache
+
+
+class DashboardCache:
+    """LRU cache of per-user responses with version-based invalidation."""
+
+    def __init__(self, size: int = None, ttl: int = None):
+        self.size = settings.DASHBOARD_CACHE_SIZE if size is None else size
+        self.ttl = settings.DASHBOARD_CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._clock = itertools.count(1)
+        self._floor = 0  # version of users not in _versions
+        self._versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def version(self, user_id: str) -> int:
+        """Current version of a user's data; capture it before building a response."""
+        with self._lock:
+            return self._versions.get(user_id, self._floor)
+
+    def bump(self, user_id: Optional[str]) -> None:
+        """Mark a user's data as changed. Call after the write completes."""
+        if not user_id:
+            return
+        with self._lock:
+            self._versions[str(user_id)] = next(self._clock)
+            for key in [key for key in self._entries if key[0] == str(user_id)]:
+                del self._entries[key]
+            self.invalidations += 1
+            self._prune_versions()
+
+    def invalidate_all(self) -> None:
+        """Mark every user's data as changed, e.g. after a recompute of all users."""
+        with self._lock:
+            self._floor = next(self._clock)
+            self._versions.clear()
+            self._entries.clear()
+            self.invalidations += 1
+
+    def get(self, user_id: str, kind: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh entry ('body' bytes and 'etag'), or None."""
+        with self._lock:
+            key = (user_id, kind)
+            entry = self._entries.get(key)
+            if entry is None or entry["version"] != self._versions.get(user_id, self._floor) \
+                    or entry["rules_version"] != tax_rule_cache.version or time.time() >= entry["expires_at"]:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, user_id: str, kind: str, version: int, body: bytes) -> Dict[str, Any]:
+        """Store a response built at version; skipped if the user changed since."""
+        entry = {
+            "body": body,
+            "etag": '"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+            "version": version,
+            "rules_version": tax_rule_cache.version,
+            "expires_at": time.time() + self.ttl,
+        }
+        with self._lock:
+            if version != self._versions.get(user_id, self._floor) or self.size <= 0:
+                return entry
+            self._entries[(user_id, kind)] = entry
+            self._entries.move_to_end((user_id, kind))
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def _prune_versions(self) -> None:
+        """Forget the versions of uncached users once there are too many.
+
+        They fall back to the floor, which moves past every version handed
+        out so far, so no response started before the prune is stored.
+        Callers must hold _lock.
+        """
+        if len(self._versions) > 4 * max(self.size, 1):
+            self._floor = next(self._clock)
+            cached = {key[0] for key in self._entries}
+            self._versions = {user: version for user, version in self._versions.items() if user in cached}
+
+    def get_or_build(self, user_id: str, kind: str, build: Callable[[], bytes]) -> Dict[str, Any]:
+        """Return the cached entry, building and storing it on a miss."""
+        entry = self.get(user_id, kind)
+        if entry is None:
+            version = self.version(user_id)
+            entry = self.put(user_id, kind, version, build())
+        return entry
+
+    def record_not_modified(self) -> None:
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size, hit ratio and invalidation counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "tracked_users": len(self._versions),
+            }
+
+
+dashboard_cache = DashboardCache()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches etag."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in [candidate.removeprefix("W/") for candidate in candidates]
@@ -0,0 +1,339 @@
+"""Running totals of claimed deductions per user, category and tax year.
+
+Capping a new receipt needs what the user has already claimed in its
+category and group this year. Instead of summing their transactions on
+every receipt (and every dashboard load), the ledger keeps:
+
+- one entry per claimed transaction (verified or needs review) with the
+  amount it deducts, and
+- per (user, tax year, category) totals of those entries,
+
+in a local SQLite database, along with each user's annual income for
+the income-relative caps. insert_transaction, update_transaction and
+deleting a transaction update it as they write, so claimed() and
+headroom() are single primary-key lookups. A deduction_recompute run
+replaces the year's entries with what it computed.
+
+A (user, tax year) is built from the transactions table the first time
+it is needed, and rebuilt when it is needed again after
+DEDUCTION_LEDGER_TTL seconds. That rebuild is what reconciles the ledger
+with writes it did not see: other workers or hosts writing the same
+user, edits made while this process was down (the SQLite file outlives
+restarts) or directly in the database. Writes of one user within this
+process are serialized by user_lock() so two receipts saved at once
+cannot both use the same headroom. Incomes are loaded from the profile
+and kept for DEDUCTION_LEDGER_TTL the same way; a profile update through
+the API replaces the cached value at once.
+"""
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from app.core.config import settings
+from app.services import deduction_rules
+
+
+CLAIM_STATUSES = ("verified", "needs_review")
+LOCK_STRIPES = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ledger_years (
+    user_id TEXT NOT NULL,
+    tax_year INTEGER NOT NULL,
+    built_at REAL NOT NULL,
+    PRIMARY KEY (user_id, tax_year)
+);
+CREATE TABLE IF NOT EXISTS ledger_entries (
+    transaction_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    tax_year INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    amount REAL NOT NULL,
+    verified INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ledger_entries_user_year ON ledger_entries (user_id, tax_year);
+CREATE TABLE IF NOT EXISTS ledger_incomes (
+    user_id TEXT PRIMARY KEY,
+    income REAL,
+    loaded_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ledger_totals (
+    user_id TEXT NOT NULL,
+    tax_year INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    claimed REAL NOT NULL DEFAULT 0,
+    verified REAL NOT NULL DEFAULT 0,
+    transactions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, tax_year, category)
+);
+"""
+
+_lock = threading.RLock()
+_connection: Optional[sqlite3.Connection] = None
+_user_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+_stats = {"lookups": 0, "builds": 0, "writes": 0}
+
+
+def _db() -> sqlite3.Connection:
+    """Return the shared connection, creating the database on first use.
+
+    Callers must hold _lock.
+    """
+    global _connection
+    if _connection is None:
+        path = str(settings.DEDUCTION_LEDGER_DB)
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        _connection = sqlite3.connect(path, check_same_thread=False)
+        _connection.row_factory = sqlite3.Row
+        _connection.executescript(SCHEMA)
+    return _connection
+
+
+def user_lock(user_id: str) -> threading.Lock:
+    """Lock to hold while capping and saving one user's transaction."""
+    return _user_locks[zlib.crc32(str(user_id).encode("utf-8")) % LOCK_STRIPES]
+
+
+def _entry(transaction: Dict[str, Any], table: deduction_rules.RuleTable) -> Optional[tuple]:
+    """Ledger entry for a transaction, or None if it claims nothing."""
+    if transaction.get("status") not in CLAIM_STATUSES:
+        return None
+    rule = table.get_by_id(transaction.get("rule_id"))
+    transaction_date = deduction_rules.parse_date(transaction.get("transaction_date"))
+    if rule is None or transaction_date is None:
+        return None
+    return (
+        str(transaction["id"]),
+        str(transaction["user_id"]),
+        transaction_date.year,
+        rule.category,
+        float(transaction.get("deductible_amount") or 0),
+        1 if transaction.get("status") == "verified" else 0,
+    )
+
+
+def _apply(db: sqlite3.Connection, entry: tuple, sign: int) -> None:
+    """Add (sign=1) or subtract (sign=-1) an entry from the totals."""
+    _, user_id, tax_year, category, amount, verified = entry
+    db.execute(
+        """INSERT INTO ledger_totals (user_id, tax_year, category, claimed, verified, transactions)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT (user_id, tax_year, category) DO UPDATE SET
+               claimed = claimed + excluded.claimed,
+               verified = verified + excluded.verified,
+               transactions = transactions + excluded.transactions""",
+        (user_id, tax_year, category, sign * amount, sign * amount * verified, sign),
+    )
+
+
+def _remove(db: sqlite3.Connection, transaction_id: str) -> None:
+    row = db.execute(
+        "SELECT * FROM ledger_entries WHERE transaction_id = ?", (transaction_id,)
+    ).fetchone()
+    if row:
+        _apply(db, tuple(row), -1)
+        db.execute("DELETE FROM ledger_entries WHERE transaction_id = ?", (transaction_id,))
+
+
+def _is_built(db: sqlite3.Connection, user_id: str, tax_year: int) -> bool:
+    """Whether the year was built less than DEDUCTION_LEDGER_TTL seconds ago."""
+    return db.execute(
+        "SELECT 1 FROM ledger_years WHERE user_id = ? AND tax_year = ? AND built_at > ?",
+        (user_id, tax_year, time.time() - settings.DEDUCTION_LEDGER_TTL),
+    ).fetchone() is not None
+
+
+def replace_year(tax_year: int, transactions: Iterable[Dict[str, Any]],
+                 user_id: Optional[str] = None, user_ids: Iterable[str] = ()) -> None:
+    """Replace the entries of a tax year with the given transactions.
+
+    Args:
+        tax_year: Tax year being replaced.
+        transactions: Every claimed transaction of that year (of user_id
+            if given), with their current deductible_amount.
+        user_id: Only replace this user's entries; every user's if None.
+        user_ids: Users to mark as built even if they have no transactions.
+    """
+    table = deduction_rules.get_rule_table()
+    if table is None:
+        return
+    entries = [entry for entry in (_entry(t, table) for t in transactions) if entry]
+    users = {entry[1] for entry in entries} | set(user_ids) | ({user_id} if user_id else set())
+
+    with _lock:
+        db = _db()
+        scope, params = ("user_id = ? AND tax_year = ?", (user_id, tax_year)) if user_id else ("tax_year = ?", (tax_year,))
+        db.execute(f"DELETE FROM ledger_entries WHERE {scope}", params)
+        db.execute(f"DELETE FROM ledger_totals WHERE {scope}", params)
+        if not user_id:
+            db.execute("DELETE FROM ledger_years WHERE tax_year = ?", (tax_year,))
+        db.executemany("INSERT OR REPLACE INTO ledger_entries VALUES (?, ?, ?, ?, ?, ?)", entries)
+        for entry in entries:
+            _apply(db, entry, 1)
+        db.executemany(
+            "INSERT OR REPLACE INTO ledger_years (user_id, tax_year, built_at) VALUES (?, ?, ?)",
+            [(user, tax_year, time.time()) for user in users],
+        )
+        db.commit()
+        _stats["builds"] += 1
+
+
+def ensure_year(user_id: str, tax_year: int) -> bool:
+    """Build a user's tax year from the transactions table if needed.
+
+    A year is rebuilt once its build is older than DEDUCTION_LEDGER_TTL.
+
+    Returns:
+        Whether the ledger holds that year.
+    """
+    with _lock:
+        if _is_built(_db(), user_id, tax_year):
+            return True
+
+    # Imported here because deduction_recompute imports this module
+    from app.services.deduction_recompute import load_transactions
+    try:
+        transactions = load_transactions(tax_year, user_id)
+    except Exception as e:
+        print(f"Error building deduction ledger for {user_id} ({tax_year}): {e}")
+        return False
+    replace_year(tax_year, transactions, user_id=user_id)
+    with _lock:
+        return _is_built(_db(), user_id, tax_year)
+
+
+def income(user_id: str) -> Optional[float]:
+    """Annual income of a user, for income-relative caps; None if not set.
+
+    Loaded from the user's profile the first time and again after
+    DEDUCTION_LEDGER_TTL. A failed load is not cached.
+    """
+    with _lock:
+        row = _db().execute(
+            "SELECT income FROM ledger_incomes WHERE user_id = ? AND loaded_at > ?",
+            (user_id, time.time() - settings.DEDUCTION_LEDGER_TTL),
+        ).fetchone()
+        if row:
+            _stats["lookups"] += 1
+            return row["income"]
+
+    # Imported here because deduction_recompute imports this module
+    from app.services.deduction_recompute import load_income
+    try:
+        loaded = load_income(user_id)
+    except Exception as e:
+        print(f"Warning: Could not load annual income for {user_id}, skipping income caps: {e}")
+        return None
+    set_income(user_id, loaded)
+    return loaded
+
+
+def set_income(user_id: str, annual_income: Optional[float]) -> None:
+    """Cache a user's annual income, e.g. right after their profile changed."""
+    with _lock:
+        db = _db()
+        db.execute(
+            "INSERT OR REPLACE INTO ledger_incomes (user_id, income, loaded_at) VALUES (?, ?, ?)",
+            (user_id, float(annual_income) if annual_income is not None else None, time.time()),
+        )
+        db.commit()
+        _stats["writes"] += 1
+
+
+def record(transaction: Dict[str, Any]) -> None:
+    """Add, update or remove a saved transaction's entry.
+
+    Call with the row as written; transactions that no longer claim
+    anything (rejected, not deductible, no rule) are removed.
+    """
+    table = deduction_rules.get_rule_table()
+    if table is None or not transaction.get("id"):
+        return
+    entry = _entry(transaction, table)
+    with _lock:
+        db = _db()
+        _remove(db, str(transaction["id"]))
+        if entry:
+            db.execute("INSERT INTO ledger_entries VALUES (?, ?, ?, ?, ?, ?)", entry)
+            _apply(db, entry, 1)
+        db.commit()
+        _stats["writes"] += 1
+
+
+def remove(transaction_id: str) -> None:
+    """Remove a deleted transaction's entry."""
+    with _lock:
+        db = _db()
+        _remove(db, str(transaction_id))
+        db.commit()
+        _stats["writes"] += 1
+
+
+def totals(user_id: str, tax_year: int) -> Dict[str, Dict[str, Any]]:
+    """Return claimed, verified and transaction count by category."""
+    ensure_year(user_id, tax_year)
+    with _lock:
+        _stats["lookups"] += 1
+        rows = _db().execute(
+            "SELECT category, claimed, verified, transactions FROM ledger_totals "
+            "WHERE user_id = ? AND tax_year = ? AND transactions > 0",
+            (user_id, tax_year),
+        ).fetchall()
+    return {row["category"]: {key: row[key] for key in ("claimed", "verified", "transactions")} for row in rows}
+
+
+def claimed(user_id: str, tax_year: int, category: str) -> float:
+    """Amount already claimed in a category this tax year."""
+    ensure_year(user_id, tax_year)
+    with _lock:
+        _stats["lookups"] += 1
+        row = _db().execute(
+            "SELECT claimed FROM ledger_totals WHERE user_id = ? AND tax_year = ? AND category = ?",
+            (user_id, tax_year, category),
+        ).fetchone()
+    return max(0.0, row["claimed"]) if row else 0.0
+
+
+def group_claimed(user_id: str, tax_year: int, rule: deduction_rules.DeductionRule,
+                  table: deduction_rules.RuleTable) -> float:
+    """Amount already claimed in all categories of the rule's group."""
+    if not rule.group:
+        return 0.0
+    categories = [category for category, other in table.by_category.items() if other.group == rule.group]
+    ensure_year(user_id, tax_year)
+    with _lock:
+        _stats["lookups"] += 1
+        row = _db().execute(
+            f"SELECT SUM(claimed) AS claimed FROM ledger_totals WHERE user_id = ? AND tax_year = ? "
+            f"AND category IN ({', '.join('?' * len(categories))})",
+            (user_id, tax_year, *categories),
+        ).fetchone()
+    return max(0.0, row["claimed"] or 0.0)
+
+
+def headroom(user_id: str, tax_year: int, rule: deduction_rules.DeductionRule,
+             table: deduction_rules.RuleTable) -> Optional[float]:
+    """What is left of a category's limits this year; None if unlimited."""
+    limits = []
+    if rule.max_limit > 0:
+        limits.append(rule.max_limit - claimed(user_id, tax_year, rule.category))
+    if rule.group and rule.group_limit > 0:
+        limits.append(rule.group_limit - group_claimed(user_id, tax_year, rule, table))
+    return max(0.0, min(limits)) if limits else None
+
+
+def stats() -> Dict[str, Any]:
+    """Return ledger size and lookup/build/write counters."""
+    with _lock:
+        db = _db()
+        return {
+            "db": str(settings.DEDUCTION_LEDGER_DB),
+            "years": db.execute("SELECT COUNT(*) FROM ledger_years").fetchone()[0],
+            "entries": db.execute("SELECT COUNT(*) FROM ledger_entries").fetchone()[0],
+            "incomes": db.execute("SELECT COUNT(*) FROM ledger_incomes").fetchone()[0],
+            **_stats,
+        }
@@ -0,0 +1,324 @@
+"""Whole-year recomputation of deductible amounts.
+
+Category, group and income caps are cumulative over a tax year, so
+editing an income, deleting a transaction or changing a tax rule can
+change the deductible amount of every other transaction in that year.
+
+recompute() loads a user's (or every user's) claimed transactions for a
+tax year into NumPy columns and replays the year in date order: each
+transaction deducts what is left of its category limit (the tax_rules
+max_limit and the income-relative cap), then what is left of its group
+limit, as deduction_rules.evaluate would with the running totals. Both
+passes are grouped cumulative sums, so 100k transactions take well under
+a second (see benchmarks/deduction_recompute.py). Only rows whose amount
+changed are written back, in bulk through the set_deductible_amounts
+Postgres function (app/database/sql/deduction_write_back.sql), and the
+year's deduction ledger entries are replaced with the result.
+
+Transactions count towards the limits while they are verified or
+waiting for review; rejected and not deductible ones are left alone.
+"""
+import contextlib
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from postgrest.exceptions import APIError
+
+from app.core.config import settings
+from app.database.database import service_supabase, supabase
+from app.services import deduction_ledger, deduction_rules
+from app.services.dashboard_cache import dashboard_cache
+from app.utils.tracing import span
+
+
+CLAIM_STATUSES = deduction_ledger.CLAIM_STATUSES
+PAGE_SIZE = 1000  # rows per select (PostgREST's default max-rows)
+WRITE_BATCH = 500  # rows per set_deductible_amounts call
+RPC_RETRY_AFTER = 300  # seconds before a missing set_deductible_amounts function is tried again
+RPC_UNAVAILABLE = ("PGRST202", "42501")  # function not found; not granted to this key
+
+_rpc_missing_until = 0.0
+
+
+def _parse_dates(values: List[Any]) -> np.ndarray:
+    """Parse transaction dates to datetime64[D]; unreadable dates become NaT."""
+    try:
+        return np.array([str(value)[:10] for value in values], dtype="datetime64[D]")
+    except ValueError:
+        parsed = [deduction_rules.parse_date(value) for value in values]
+        return np.array([value if value else "NaT" for value in parsed], dtype="datetime64[D]")
+
+
+def to_columns(rows: List[Dict[str, Any]], table: deduction_rules.RuleTable,
+               incomes: Optional[Dict[str, float]] = None) -> Dict[str, np.ndarray]:
+    """Turn transaction rows into columns for compute_deductions.
+
+    Rows must be in date order (ties in creation order). Rows whose rule
+    is not in the table get no limits and a zero deduction.
+
+    Args:
+        rows: Transactions with id, user_id, rule_id, transaction_date and
+            total_amount.
+        table: Compiled rules, see deduction_rules.get_rule_table.
+        incomes: Annual income by user id, for income-relative caps.
+    """
+    incomes = incomes or {}
+    rules = list(table.by_id.values())
+    rule_index = {str(rule.rule_id): i for i, rule in enumerate(rules)}
+    categories = sorted({rule.category for rule in rules})
+    groups = sorted({rule.group for rule in rules if rule.group})
+    category_index = {name: i for i, name in enumerate(categories)}
+    group_index = {name: i for i, name in enumerate(groups)}
+
+    # Per-rule lookup arrays; the last entry stands for "no rule"
+    n_rules = len(rules)
+    max_limit = np.array([rule.max_limit or np.inf for rule in rules] + [0.0])
+    income_rate = np.array([rule.income_rate for rule in rules] + [0.0])
+    multiplier = np.array([rule.multiplier for rule in rules] + [0.0])
+    rule_category = np.array([category_index[rule.category] for rule in rules] + [-1])
+    rule_group = np.array([group_index[rule.group] if rule.group else -1 for rule in rules] + [-1])
+    group_limit = np.array([rule.group_limit or np.inf for rule in rules] + [np.inf])
+    windows = [rule.window or ((1, 1), (12, 31)) for rule in rules] + [((1, 1), (12, 31))]
+    window_from = np.array([start[0] * 100 + start[1] for start, _ in windows])
+    window_to = np.array([end[0] * 100 + end[1] for _, end in windows])
+
+    users = {}
+    user = np.array([users.setdefault(row.get("user_id"), len(users)) for row in rows], dtype=np.int64)
+    rule = np.array([rule_index.get(str(row.get("rule_id")), n_rules) for row in rows], dtype=np.int64)
+    user_income = np.array([
+        float(incomes[user_id]) if incomes.get(user_id) is not None else np.nan for user_id in users
+    ])
+    dates = _parse_dates([row.get("transaction_date") for row in rows])
+    month_start = dates.astype("datetime64[M]")
+    month_day = ((month_start.astype(np.int64) % 12 + 1) * 100
+                 + (dates - month_start).astype(np.int64) + 1)
+    in_window = ~np.isnat(dates) & (month_day >= window_from[rule]) & (month_day <= window_to[rule])
+
+    income = user_income[user]
+    income_cap = np.where((income_rate[rule] > 0) & ~np.isnan(income), income_rate[rule] * income, np.inf)
+
+    return {
+        "id": np.array([row.get("id") for row in rows], dtype=object),
+        "user": user,
+        "category": rule_category[rule],
+        "group": rule_group[rule],
+        "amount": np.array([float(row.get("total_amount") or 0) for row in rows]),
+        "deductible": np.array([float(row.get("deductible_amount") or 0) for row in rows]),
+        "multiplier": np.where(in_window, multiplier[rule], 0.0),
+        "category_limit": np.minimum(max_limit[rule], income_cap),
+        "group_limit": group_limit[rule],
+    }
+
+
+def _capped_increments(keys: np.ndarray, values: np.ndarray, limits: np.ndarray) -> np.ndarray:
+    """Give each row what is left of its key's limit, in row order.
+
+    Rows are taken in their current (date) order within each key; a row's
+    share is min(running total, limit) minus the same before that row.
+    """
+    if len(keys) == 0:
+        return values.copy()
+    order = np.argsort(keys, kind="stable")
+    k, v, limit = keys[order], values[order], limits[order]
+
+    starts = np.empty(len(k), dtype=bool)
+    starts[0] = True
+    starts[1:] = k[1:] != k[:-1]
+    running = np.cumsum(v)
+    first = np.maximum.accumulate(np.where(starts, np.arange(len(k)), 0))
+    running -= running[first] - v[first]
+
+    capped = np.minimum(running, limit)
+    before = np.empty_like(capped)
+    before[0] = 0.0
+    before[1:] = capped[:-1]
+    before[starts] = 0.0
+
+    result = np.empty_like(v)
+    result[order] = np.maximum(capped - before, 0.0)
+    return result
+
+
+def compute_deductions(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Return the deductible amount of every row under cumulative caps."""
+    wanted = np.maximum(columns["amount"], 0.0) * columns["multiplier"]
+    n_categories = int(columns["category"].max(initial=0)) + 2
+
+    # Pass 1: category limit (max_limit and income cap) per user and category
+    category_key = columns["user"] * n_categories + columns["category"] + 1
+    deductible = _capped_increments(category_key, wanted, columns["category_limit"])
+
+    # Pass 2: group limit per user and group, on what pass 1 allowed
+    grouped = columns["group"] >= 0
+    if grouped.any():
+        n_groups = int(columns["group"].max()) + 1
+        group_key = columns["user"][grouped] * n_groups + columns["group"][grouped]
+        deductible[grouped] = _capped_increments(group_key, deductible[grouped], columns["group_limit"][grouped])
+
+    return np.round(deductible, 2)
+
+
+def load_transactions(tax_year: int, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Load the claimed transactions of a tax year, in date order."""
+    rows: List[Dict[str, Any]] = []
+    while True:
+        query = supabase.table("transactions").select("*").in_(
+            "status", list(CLAIM_STATUSES)
+        ).gte("transaction_date", f"{tax_year}-01-01").lte("transaction_date", f"{tax_year}-12-31")
+        if user_id:
+            query = query.eq("user_id", user_id)
+        page = query.order("transaction_date").order("create_at").order("id").range(
+            len(rows), len(rows) + PAGE_SIZE - 1
+        ).execute().data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+
+
+def load_income(user_id: str) -> Optional[float]:
+    """Return annual_income from one user's profile; raises if it cannot be loaded."""
+    user = supabase.auth.admin.get_user_by_id(user_id).user
+    income = (user.user_metadata or {}).get("annual_income") if user else None
+    return float(income) if income is not None else None
+
+
+def load_incomes(user_ids: Iterable[str]) -> Dict[str, float]:
+    """Return annual_income from each user's profile (Supabase Auth metadata)."""
+    user_ids = set(user_ids)
+    incomes = {}
+    try:
+        if len(user_ids) == 1:
+            users = [supabase.auth.admin.get_user_by_id(next(iter(user_ids))).user]
+        else:
+            users, page = [], 1
+            while True:
+                batch = supabase.auth.admin.list_users(page=page, per_page=PAGE_SIZE)
+                users.extend(batch)
+                if len(batch) < PAGE_SIZE:
+                    break
+                page += 1
+    except Exception as e:
+        print(f"Warning: Could not load annual incomes, skipping income caps: {e}")
+        return incomes
+
+    for user in users:
+        income = (user.user_metadata or {}).get("annual_income") if user else None
+        if user and user.id in user_ids and income is not None:
+            incomes[user.id] = float(income)
+    return incomes
+
+
+def write_back(rows: List[Dict[str, Any]]) -> None:
+    """Save the deductible_amount of changed rows, in batches of WRITE_BATCH.
+
+    Only deductible_amount is written, and only where total_amount is
+    still the loaded one, so an edit made while the year was recomputed
+    is not reverted. set_deductible_amounts is only granted to
+    service_role; without it (or SUPABASE_SERVICE_ROLE_KEY) the rows are
+    updated one by one with the same condition.
+    """
+    global _rpc_missing_until
+    for start in range(0, len(rows), WRITE_BATCH):
+        batch = rows[start:start + WRITE_BATCH]
+        if time.time() >= _rpc_missing_until:
+            try:
+                service_supabase.rpc("set_deductible_amounts", {
+                    "p_ids": [row["id"] for row in batch],
+                    "p_amounts": [row["deductible_amount"] for row in batch],
+                    "p_total_amounts": [row["total_amount"] for row in batch],
+                }).execute()
+                continue
+            except APIError as e:
+                if e.code not in RPC_UNAVAILABLE:
+                    raise
+                _rpc_missing_until = time.time() + RPC_RETRY_AFTER
+                print("Warning: set_deductible_amounts function not available (apply app/database/sql/"
+                      "deduction_write_back.sql and set SUPABASE_SERVICE_ROLE_KEY); updating rows one by one")
+
+        for row in batch:
+            supabase.table("transactions").update(
+                {"deductible_amount": row["deductible_amount"]}
+            ).eq("id", row["id"]).eq("total_amount", row["total_amount"]).execute()
+
+
+def recompute(tax_year: Optional[int] = None, user_id: Optional[str] = None,
+              incomes: Optional[Dict[str, float]] = None, dry_run: bool = False) -> Dict[str, Any]:
+    """Recompute every deductible amount of a tax year and save the changes.
+
+    Args:
+        tax_year: Default: settings.DEFAULT_TAX_YEAR.
+        user_id: Only this user's transactions, holding the user's ledger
+            lock; every user's if None.
+        incomes: Annual income by user id; loaded from the users' profiles
+            if None.
+        dry_run: Compute the changes without writing them.
+
+    Returns:
+        Dict with success status and counts, plus 'changed' (transaction
+        id -> new deductible amount), or an error message
+    """
+    if tax_year is None:
+        tax_year = settings.DEFAULT_TAX_YEAR
+
+    # A user's recompute must not interleave with their inserts and updates
+    lock = deduction_ledger.user_lock(user_id) if user_id else contextlib.nullcontext()
+    with span("deductions.recompute", tax_year=tax_year, user_id=user_id) as s, lock:
+        try:
+            table = deduction_rules.get_rule_table()
+            if table is None:
+                return {"success": False, "error": "Tax rules could not be loaded"}
+
+            t0 = time.perf_counter()
+            rows = load_transactions(tax_year, user_id)
+            load_ms = (time.perf_counter() - t0) * 1000
+            if incomes is None and rows:
+                incomes = load_incomes({row["user_id"] for row in rows})
+
+            t0 = time.perf_counter()
+            columns = to_columns(rows, table, incomes)
+            deductible = compute_deductions(columns)
+            changed_index = np.flatnonzero(np.abs(deductible - columns["deductible"]) > 0.005)
+            compute_ms = (time.perf_counter() - t0) * 1000
+
+            changed_rows = [
+                {**rows[i], "deductible_amount": float(deductible[i])} for i in changed_index
+            ]
+            t0 = time.perf_counter()
+            if changed_rows and not dry_run:
+                write_back(changed_rows)
+            if not dry_run:
+                for i in changed_index:
+                    rows[i]["deductible_amount"] = float(deductible[i])
+                deduction_ledger.replace_year(tax_year, rows, user_id=user_id)
+                # Remaining limits come from the ledger, so the user's dashboard is stale too
+                for changed_user in {str(row["user_id"]) for row in changed_rows} | ({user_id} if user_id else set()):
+                    dashboard_cache.bump(changed_user)
+            write_ms = (time.perf_counter() - t0) * 1000
+
+            s.set(transactions=len(rows), changed=len(changed_rows))
+            print(f"Recomputed {len(rows)} transactions for {tax_year}"
+                  f"{f' (user {user_id})' if user_id else ''}: {len(changed_rows)} changed, "
+                  f"compute {compute_ms:.1f} ms")
+            return {
+                "success": True,
+                "tax_year": tax_year,
+                "transactions": len(rows),
+                "users": len(set(columns["user"].tolist())),
+                "changed": {str(row["id"]): row["deductible_amount"] for row in changed_rows},
+                "dry_run": dry_run,
+                "timings_ms": {
+                    "load": round(load_ms, 1),
+                    "compute": round(compute_ms, 1),
+                    "write": round(write_ms, 1),
+                },
+            }
+        except Exception as e:
+            print(f"Error recomputing deductions for {tax_year}: {e}")
+            return {"success": False, "error": f"Error recomputing deductions: {str(e)}"}
+
+
+def tax_year_of(transaction_date: Any) -> int:
+    """Tax year of a transaction date; DEFAULT_TAX_YEAR if unreadable."""
+    parsed = deduction_rules.parse_date(transaction_date)
+    return parsed.year if parsed else settings.DEFAULT_TAX_YEAR
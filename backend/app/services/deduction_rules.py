@@ -0,0 +1,265 @@
+"""Deterministic deduction rules compiled from the tax_rules table.
+
+The tax_rules table only stores a per-category max_limit. The other
+statutory limits (combined group caps, caps relative to income, the
+Education/Sports donation multiplier and the Easy E-Receipt period) used
+to exist only as prose in the Tax Expert prompt, so a model call was
+the only thing enforcing them.
+
+compile_rules() merges each active row with STATUTORY_RULES into a
+DeductionRule, and evaluate() applies one in plain Python: the Tax
+Expert only picks the category, and limits and date windows are checked
+locally in a few microseconds. A row may override the built-in values
+with optional columns (group_name, group_limit, income_rate, multiplier,
+valid_from, valid_to; dates as "MM-DD" or "YYYY-MM-DD").
+
+get_rule_table() keeps the table compiled from the tax rule cache and
+recompiles it whenever the cache version changes.
+"""
+import threading
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.tax_rule_cache import tax_rule_cache
+
+
+# Limits shared by several categories (THB)
+GROUP_LIMITS = {
+    "Life and Health Insurance": 100000.0,
+    "Retirement Savings": 500000.0,
+}
+
+# Category -> limits not stored in tax_rules
+STATUTORY_RULES = {
+    "Life Insurance": {"group": "Life and Health Insurance"},
+    "Health Insurance": {"group": "Life and Health Insurance"},
+    "Pension Insurance": {"group": "Retirement Savings"},
+    "Provident Fund": {"group": "Retirement Savings"},
+    "SSF": {"group": "Retirement Savings", "income_rate": 0.30},
+    "RMF": {"group": "Retirement Savings", "income_rate": 0.30},
+    "Thai ESG": {"income_rate": 0.30},
+    "Donation (General)": {"income_rate": 0.10},
+    "Donation (Education/Sports)": {"income_rate": 0.10, "multiplier": 2.0},
+    "Easy E-Receipt": {"window": ((1, 16), (2, 28))},
+}
+
+
+class DeductionRule:
+    """One compiled tax rule."""
+
+    __slots__ = ("rule_id", "category", "tax_year", "max_limit", "group", "group_limit",
+                 "income_rate", "multiplier", "window")
+
+    def __init__(self, rule_id: Any, category: str, tax_year: Optional[int], max_limit: float,
+                 group: Optional[str] = None, group_limit: float = 0.0, income_rate: float = 0.0,
+                 multiplier: float = 1.0, window: Optional[Tuple[Tuple[int, int], Tuple[int, int]]] = None):
+        self.rule_id = rule_id
+        self.category = category
+        self.tax_year = tax_year
+        self.max_limit = max_limit
+        self.group = group
+        self.group_limit = group_limit
+        self.income_rate = income_rate
+        self.multiplier = multiplier
+        self.window = window
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rule_id": self.rule_id,
+            "category": self.category,
+            "tax_year": self.tax_year,
+            "max_limit": self.max_limit,
+            "group": self.group,
+            "group_limit": self.group_limit,
+            "income_rate": self.income_rate,
+            "multiplier": self.multiplier,
+            "window": [f"{month:02d}-{day:02d}" for month, day in self.window] if self.window else None,
+        }
+
+
+def _month_day(value: Any) -> Optional[Tuple[int, int]]:
+    """Parse "MM-DD", "YYYY-MM-DD" or a date into (month, day)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, date):
+        return value.month, value.day
+    parts = str(value)[:10].split("-")
+    return int(parts[-2]), int(parts[-1])
+
+
+def parse_date(value: Any) -> Optional[date]:
+    """Parse a transaction date (date or "YYYY-MM-DD..."); None if unreadable."""
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def compile_rule(row: Dict[str, Any]) -> DeductionRule:
+    """Merge a tax_rules row with its statutory limits."""
+    category = row.get("category_name")
+    statutory = STATUTORY_RULES.get(category, {})
+
+    group = row.get("group_name") or statutory.get("group")
+    group_limit = row.get("group_limit")
+    if group_limit is None:
+        group_limit = GROUP_LIMITS.get(group, 0.0)
+
+    window = statutory.get("window")
+    valid_from, valid_to = _month_day(row.get("valid_from")), _month_day(row.get("valid_to"))
+    if valid_from or valid_to:
+        window = (valid_from or (1, 1), valid_to or (12, 31))
+
+    return DeductionRule(
+        rule_id=row.get("id"),
+        category=category,
+        tax_year=row.get("tax_year"),
+        max_limit=float(row.get("max_limit") or 0.0),
+        group=group,
+        group_limit=float(group_limit or 0.0),
+        income_rate=float(row.get("income_rate") or statutory.get("income_rate") or 0.0),
+        multiplier=float(row.get("multiplier") or statutory.get("multiplier") or 1.0),
+        window=window,
+    )
+
+
+class RuleTable:
+    """Compiled rules indexed by id and by (category, tax year)."""
+
+    def __init__(self, rows: List[Dict[str, Any]], version: int = 0):
+        self.version = version
+        self.by_id: Dict[str, DeductionRule] = {}
+        self.by_key: Dict[Tuple[str, Any], DeductionRule] = {}
+        self.by_category: Dict[str, DeductionRule] = {}
+        for row in rows:
+            if not row.get("is_active"):
+                continue
+            rule = compile_rule(row)
+            self.by_id[str(rule.rule_id)] = rule
+            self.by_key.setdefault((rule.category, rule.tax_year), rule)
+            self.by_category.setdefault(rule.category, rule)
+
+    def get(self, category_name: str, tax_year: Optional[int] = None) -> Optional[DeductionRule]:
+        """Return the rule for a category and tax year, else for any year."""
+        if tax_year is None:
+            tax_year = settings.DEFAULT_TAX_YEAR
+        return self.by_key.get((category_name, tax_year)) or self.by_category.get(category_name)
+
+    def get_by_id(self, rule_id: Any) -> Optional[DeductionRule]:
+        return self.by_id.get(str(rule_id)) if rule_id is not None else None
+
+
+def compile_rules(rows: List[Dict[str, Any]], version: int = 0) -> RuleTable:
+    """Compile tax_rules rows into a RuleTable."""
+    return RuleTable(rows, version)
+
+
+_table: Optional[RuleTable] = None
+_table_lock = threading.Lock()
+
+
+def get_rule_table() -> Optional[RuleTable]:
+    """Return the table compiled from the tax rule cache.
+
+    Recompiled when the cache version changes; None while the rules have
+    never been loaded.
+    """
+    global _table
+    if not tax_rule_cache.ensure_loaded():
+        return None
+    with _table_lock:
+        if _table is None or _table.version != tax_rule_cache.version:
+            version = tax_rule_cache.version
+            _table = compile_rules(tax_rule_cache.get_rules() or [], version)
+        return _table
+
+
+def compiled_rule(row: Dict[str, Any]) -> DeductionRule:
+    """Return the compiled form of a tax_rules row, from the table if possible."""
+    table = get_rule_table()
+    rule = table.get_by_id(row.get("id")) if table else None
+    return rule or compile_rule(row)
+
+
+def in_window(rule: DeductionRule, transaction_date: Any) -> Optional[bool]:
+    """Whether a date falls within the rule's period; None if it cannot be read."""
+    if not rule.window:
+        return True
+    parsed = parse_date(transaction_date)
+    if parsed is None:
+        return None
+    return rule.window[0] <= (parsed.month, parsed.day) <= rule.window[1]
+
+
+def evaluate(
+    rule: DeductionRule,
+    amount: float,
+    transaction_date: Any = None,
+    income: Optional[float] = None,
+    claimed: float = 0.0,
+    group_claimed: float = 0.0,
+) -> Dict[str, Any]:
+    """Apply a rule to one transaction.
+
+    Args:
+        rule: Compiled rule for the transaction's category.
+        amount: Amount paid.
+        transaction_date: Receipt date, checked against the rule's period.
+        income: Annual income; income-relative caps are skipped if None.
+        claimed: Deduction already claimed in this category this year.
+        group_claimed: Deduction already claimed in the rule's group this
+            year (including this category).
+
+    Returns:
+        Dict with 'amount', 'is_capped', 'max_limit', 'eligible',
+        'capped_by' (category, group, income or None) and 'reason'.
+    """
+    result = {
+        "amount": 0.0,
+        "is_capped": False,
+        "max_limit": rule.max_limit,
+        "eligible": True,
+        "capped_by": None,
+        "reason": None,
+    }
+
+    within = in_window(rule, transaction_date)
+    if not within:
+        (from_month, from_day), (to_month, to_day) = rule.window
+        period = f"{from_day:02d}/{from_month:02d}-{to_day:02d}/{to_month:02d}"
+        result["eligible"] = False
+        result["reason"] = (
+            f"Receipt date {transaction_date} is outside the {rule.category} period ({period})"
+            if within is False else
+            f"Receipt date {transaction_date!r} could not be read to check the {rule.category} period ({period})"
+        )
+        return result
+
+    deductible = max(0.0, float(amount)) * rule.multiplier
+    limits = []
+    if rule.max_limit > 0:
+        limits.append(("category", rule.max_limit - claimed))
+    if rule.group and rule.group_limit > 0:
+        limits.append(("group", rule.group_limit - group_claimed))
+    if rule.income_rate > 0 and income is not None:
+        limits.append(("income", rule.income_rate * income - claimed))
+
+    for name, headroom in limits:
+        headroom = max(0.0, headroom)
+        if headroom < deductible:
+            deductible = headroom
+            result["capped_by"] = name
+
+    result["amount"] = deductible
+    result["is_capped"] = result["capped_by"] is not None
+    if result["capped_by"] == "category" and claimed > 0:
+        result["reason"] = (f"Capped at the {max(0.0, rule.max_limit - claimed):,.2f} THB left of the "
+                            f"{rule.max_limit:,.2f} THB {rule.category} limit")
+    elif result["capped_by"] == "group":
+        result["reason"] = f"Capped by the {rule.group} limit of {rule.group_limit:,.2f} THB"
+    elif result["capped_by"] == "income":
+        result["reason"] = f"Capped at {rule.income_rate:.0%} of income"
+    return result
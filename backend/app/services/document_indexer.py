@@ -1,14 +1,11 @@
 """Document indexing service for building vector database."""
 import os
-import chromadb
 from pypdf import PdfReader
 
 from app.core.config import settings
-
-
-chroma_client = chromadb.PersistentClient(path=str(settings.EMBEDDINGS_DIR))
-collection_name = settings.CHROMA_COLLECTION_NAME
-collection = chroma_client.get_or_create_collection(name=collection_name)
+from app.services.chunker import chunk_document
+from app.services.index_snapshots import build_snapshot
+from app.services.vector_store import embed_texts
 
 
 def load_pdf_documents(directory_path=None):
@@ -34,12 +31,14 @@ def load_pdf_documents(directory_path=None):
         file_path = os.path.join(directory_path, file_name)
         try:
             reader = PdfReader(file_path)
-            text = "".join(page.extract_text() for page in reader.pages)
+            pages = [page.extract_text() or "" for page in reader.pages]
+            text = "".join(pages)
             
             if text.strip():
                 documents.append({
                     "id": file_name,
                     "text": text,
+                    "pages": pages,
                     "source": file_name
                 })
                 print(f"Loaded: {file_name} ({len(text)} characters)")
@@ -53,7 +52,10 @@ def load_pdf_documents(directory_path=None):
 
 
 def chunk_text(text, chunk_size=None, chunk_overlap=None):
-    """Split text into overlapping chunks."""
+    """Split text into overlapping chunks on raw character offsets.
+
+    Legacy chunker, kept for comparison. Use chunk_document instead.
+    """
     if chunk_size is None:
         chunk_size = settings.CHUNK_SIZE
     if chunk_overlap is None:
@@ -78,48 +80,68 @@ def chunk_text(text, chunk_size=None, chunk_overlap=None):
     return chunks
 
 
-def index_documents(documents, batch_size=100):
-    """Chunk documents and store them in ChromaDB with batch processing."""
+def build_chunks(documents, chunker=None):
+    """Chunk documents with the configured chunker.
+
+    Args:
+        documents: Documents from load_pdf_documents.
+        chunker: "structured" (page/paragraph/table aware) or "legacy"
+            (fixed character windows). Default: settings.CHUNKER.
+
+    Returns:
+        List of dicts with 'id', 'text' and 'metadata' keys.
+    """
+    if chunker is None:
+        chunker = settings.CHUNKER
+
+    all_chunks = []
+
+    for doc in documents:
+        if chunker == "legacy":
+            for i, chunk in enumerate(chunk_text(doc["text"])):
+                all_chunks.append({
+                    "id": f"{doc['id']}_chunk_{i}",
+                    "text": chunk,
+                    "metadata": {"source": doc["source"]}
+                })
+        else:
+            all_chunks.extend(chunk_document(doc))
+
+    return all_chunks
+
+
+def index_documents(documents, backend=None):
+    """Chunk and embed documents, then publish them as a new index snapshot.
+
+    The vector and lexical indexes are built into a staging directory and
+    only published once validated, so running workers never read a
+    half-written index.
+
+    Args:
+        documents: Documents from load_pdf_documents.
+        backend: Vector store backend to write (default: settings.VECTOR_BACKEND).
+
+    Returns:
+        The published snapshot version, or None if there was nothing to index.
+    """
     if not documents:
         print("No documents to index")
-        return
+        return None
     
     print(f"\nIndexing {len(documents)} documents...")
     
-    all_chunks = []
-    
-    for doc in documents:
-        chunks = chunk_text(doc["text"])
-        
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{doc['id']}_chunk_{i}"
-            all_chunks.append({
-                "id": chunk_id,
-                "text": chunk,
-                "source": doc["source"]
-            })
+    all_chunks = build_chunks(documents)
     
     print(f"Created {len(all_chunks)} chunks")
     
-    total_batches = (len(all_chunks) + batch_size - 1) // batch_size
+    # Embed once; both backends store the same vectors
+    embeddings = embed_texts([chunk["text"] for chunk in all_chunks])
     
-    for batch_idx in range(0, len(all_chunks), batch_size):
-        batch = all_chunks[batch_idx:batch_idx + batch_size]
-        
-        ids = [chunk["id"] for chunk in batch]
-        texts = [chunk["text"] for chunk in batch]
-        metadatas = [{"source": chunk["source"]} for chunk in batch]
-        
-        collection.upsert(
-            ids=ids,
-            documents=texts,
-            metadatas=metadatas
-        )
-        
-        current_batch = (batch_idx // batch_size) + 1
-        print(f"Processed batch {current_batch}/{total_batches}")
+    version = build_snapshot(all_chunks, embeddings, backend)
+    
+    print(f"\nSuccessfully indexed {len(all_chunks)} chunks (snapshot {version})")
     
-    print(f"\nSuccessfully indexed {len(all_chunks)} chunks")
+    return version
 
 
 def main():
@@ -0,0 +1,290 @@
+"""Versioned knowledge base snapshots with atomic publish and hot reload.
+
+document_indexer builds every index into a staging directory, validates
+it, renames it into place and then publishes it by atomically replacing
+the CURRENT pointer file. Running workers notice the new pointer on their
+next query and switch over; queries already running keep the snapshot
+they started with until they finish.
+
+Layout (inside settings.INDEX_SNAPSHOTS_DIR):
+    CURRENT                     name of the published snapshot
+    <version>/manifest.json     backend, chunk count, sources, build time
+    <version>/vectors/          vector store (Chroma or NumPy)
+    <version>/lexical/          BM25 lexical index
+    .<version>.staging/         snapshot being built (never read by workers)
+"""
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import chromadb
+
+from app.core.config import settings
+from app.services.lexical_index import build_lexical_index, load_lexical_index
+from app.services.vector_store import load_vector_store
+
+
+POINTER_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+LEGACY_VERSION = "legacy"
+
+
+# ---------------------------------------------------------------------------
+# Build side (document_indexer)
+# ---------------------------------------------------------------------------
+
+def make_version(chunks: List[Dict[str, Any]]) -> str:
+    """Return a sortable snapshot version: UTC timestamp + content hash."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk["id"].encode("utf-8"))
+        digest.update(chunk["text"].encode("utf-8"))
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    return f"{timestamp}-{digest.hexdigest()[:8]}"
+
+
+def validate_snapshot(path: Path, manifest: Dict[str, Any], chunks: List[Dict[str, Any]]) -> None:
+    """Reopen a built snapshot and check it answers queries.
+
+    Raises:
+        RuntimeError: If the snapshot is incomplete or cannot be queried.
+    """
+    store = load_vector_store(manifest["backend"], path / "vectors")
+    if store.count() != manifest["chunk_count"]:
+        raise RuntimeError(
+            f"Vector store has {store.count()} chunks, expected {manifest['chunk_count']}"
+        )
+
+    lexical = load_lexical_index(path / "lexical")
+    if lexical is None or lexical.n_chunks != manifest["chunk_count"]:
+        raise RuntimeError("Lexical index is missing or incomplete")
+
+    probe = chunks[0]["text"][:200]
+    if not store.query(probe, 1):
+        raise RuntimeError("Vector store returned no results for a probe query")
+
+
+def publish_snapshot(version: str) -> None:
+    """Atomically point CURRENT at a snapshot version."""
+    root = Path(settings.INDEX_SNAPSHOTS_DIR)
+    tmp_pointer = root / f".{POINTER_FILE}.{os.getpid()}.tmp"
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, root / POINTER_FILE)
+
+
+def read_current_version() -> Optional[str]:
+    """Return the published snapshot version, or None if there is none."""
+    try:
+        with open(Path(settings.INDEX_SNAPSHOTS_DIR) / POINTER_FILE, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def collect_garbage(keep: int = None) -> List[str]:
+    """Delete old snapshots and abandoned staging directories.
+
+    The published snapshot and the `keep` most recent ones are always kept,
+    so workers that have not reloaded yet can still finish on them.
+
+    Returns:
+        Names of the deleted directories.
+    """
+    if keep is None:
+        keep = settings.INDEX_SNAPSHOT_KEEP
+
+    root = Path(settings.INDEX_SNAPSHOTS_DIR)
+    current = read_current_version()
+    versions = sorted(
+        p.name for p in root.iterdir()
+        if p.is_dir() and not p.name.startswith(".") and (p / MANIFEST_FILE).exists()
+    )
+    retained = set(versions[-keep:]) | {current}
+
+    deleted = []
+    for path in root.iterdir():
+        if not path.is_dir() or path.name in retained:
+            continue
+        is_staging = path.name.startswith(".") and path.name.endswith(".staging")
+        if path.name in versions or is_staging:
+            shutil.rmtree(path, ignore_errors=True)
+            deleted.append(path.name)
+
+    if deleted:
+        print(f"Removed old index snapshots: {', '.join(deleted)}")
+    return deleted
+
+
+def build_snapshot(chunks: List[Dict[str, Any]], embeddings, backend: str = None) -> str:
+    """Build, validate and publish a new knowledge base snapshot.
+
+    Args:
+        chunks: Chunks from build_chunks.
+        embeddings: Normalized embeddings in the same order as chunks.
+        backend: Vector store backend (default: settings.VECTOR_BACKEND).
+
+    Returns:
+        The published snapshot version.
+    """
+    if backend is None:
+        backend = settings.VECTOR_BACKEND
+
+    root = Path(settings.INDEX_SNAPSHOTS_DIR)
+    root.mkdir(parents=True, exist_ok=True)
+
+    version = make_version(chunks)
+    staging = root / f".{version}.staging"
+    final = root / version
+
+    if (final / MANIFEST_FILE).exists():
+        print(f"Index snapshot {version} already exists, republishing it")
+        publish_snapshot(version)
+        return version
+
+    manifest = {
+        "version": version,
+        "backend": backend,
+        "chunk_count": len(chunks),
+        "sources": sorted({chunk["metadata"]["source"] for chunk in chunks}),
+        "chunker": settings.CHUNKER,
+        "embedding_model": settings.EMBEDDING_MODEL,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+    try:
+        load_vector_store(backend, staging / "vectors").write(chunks, embeddings)
+        build_lexical_index(chunks, staging / "lexical")
+        validate_snapshot(staging, manifest, chunks)
+
+        with open(staging / MANIFEST_FILE, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+        # Release Chroma's file handles before moving the directory
+        chromadb.api.client.SharedSystemClient.clear_system_cache()
+        os.rename(staging, final)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    publish_snapshot(version)
+    print(f"Published index snapshot {version}")
+
+    collect_garbage()
+    return version
+
+
+# ---------------------------------------------------------------------------
+# Query side (workers)
+# ---------------------------------------------------------------------------
+
+class IndexSnapshot:
+    """An opened, read-only knowledge base snapshot."""
+
+    def __init__(self, version: str, vector_store, lexical_index):
+        self.version = version
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.indexed_years: Optional[List[int]] = None
+        self.in_flight = 0
+
+
+def open_snapshot(version: Optional[str]) -> IndexSnapshot:
+    """Open a published snapshot, or the legacy unversioned indexes."""
+    if version is None:
+        lexical = load_lexical_index() if settings.HYBRID_SEARCH else None
+        return IndexSnapshot(LEGACY_VERSION, load_vector_store(), lexical)
+
+    path = Path(settings.INDEX_SNAPSHOTS_DIR) / version
+    with open(path / MANIFEST_FILE, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("embedding_model", "default") != settings.EMBEDDING_MODEL:
+        print(f"Warning: snapshot {version} was embedded with {manifest.get('embedding_model', 'default')}, "
+              f"but EMBEDDING_MODEL is {settings.EMBEDDING_MODEL}; re-run document_indexer")
+
+    lexical = load_lexical_index(path / "lexical") if settings.HYBRID_SEARCH else None
+    return IndexSnapshot(version, load_vector_store(manifest["backend"], path / "vectors"), lexical)
+
+
+_pinned_snapshot: contextvars.ContextVar = contextvars.ContextVar("pinned_snapshot", default=None)
+
+
+class SnapshotManager:
+    """Tracks the active snapshot and swaps it when CURRENT changes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Optional[IndexSnapshot] = None
+        self._last_check = 0.0
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if self._active is not None and now - self._last_check < settings.INDEX_RELOAD_INTERVAL:
+            return
+        self._last_check = now
+
+        version = read_current_version()
+        active_version = self._active.version if self._active else None
+        if self._active is not None and (version or LEGACY_VERSION) == active_version:
+            return
+
+        try:
+            snapshot = open_snapshot(version)
+        except Exception as e:
+            if self._active is None:
+                raise
+            print(f"Failed to load index snapshot {version}, keeping {active_version}: {e}")
+            return
+
+        if self._active is not None:
+            print(f"Switching index snapshot {active_version} -> {snapshot.version} "
+                  f"({self._active.in_flight} queries still on the old one)")
+        self._active = snapshot
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """Yield the snapshot to use for one request or query.
+
+        A snapshot pinned by an outer acquire() in the same context is
+        reused, so every query in a request sees the same index.
+        """
+        pinned = _pinned_snapshot.get()
+        if pinned is not None:
+            yield pinned
+            return
+
+        with self._lock:
+            self._maybe_reload()
+            snapshot = self._active
+            snapshot.in_flight += 1
+
+        token = _pinned_snapshot.set(snapshot)
+        try:
+            yield snapshot
+        finally:
+            _pinned_snapshot.reset(token)
+            with self._lock:
+                snapshot.in_flight -= 1
+
+    def current_version(self) -> Optional[str]:
+        """Return the version of the snapshot new queries will use; None if none can be opened."""
+        try:
+            with self.acquire() as snapshot:
+                return snapshot.version
+        except Exception as e:
+            print(f"Error opening index snapshot: {e}")
+            return None
+
+
+snapshot_manager = SnapshotManager()
@@ -0,0 +1,156 @@
+"""BM25 inverted index over the knowledge base, stored as NumPy arrays.
+
+Thai tax terms such as "เบี้ยประกันสุขภาพ" or "e-Donation" are exact
+keywords that the MiniLM embedding handles poorly. This index is built by
+document_indexer alongside the vector store and memory-mapped at startup.
+
+On-disk layout (inside settings.LEXICAL_INDEX_DIR):
+    vocab.json       term -> term id
+    chunks.json      chunk position -> {"id", "text", "metadata"}
+    offsets.npy      int64[n_terms + 1], posting list boundaries per term
+    postings.npy     int32[n_postings], chunk positions sorted by term
+    term_freqs.npy   uint16[n_postings], term frequency per posting
+    doc_lengths.npy  uint32[n_chunks], token count per chunk
+"""
+import json
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.metadata_filter import matches_where
+from app.utils.thai_text import tokenize
+
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+class LexicalIndex:
+    """Memory-mapped BM25 index."""
+
+    def __init__(self, index_dir: Path):
+        index_dir = Path(index_dir)
+        with open(index_dir / "vocab.json", encoding="utf-8") as f:
+            self.vocab: Dict[str, int] = json.load(f)
+        with open(index_dir / "chunks.json", encoding="utf-8") as f:
+            self.chunks: List[Dict[str, Any]] = json.load(f)
+
+        self.offsets = np.load(index_dir / "offsets.npy", mmap_mode="r")
+        self.postings = np.load(index_dir / "postings.npy", mmap_mode="r")
+        self.term_freqs = np.load(index_dir / "term_freqs.npy", mmap_mode="r")
+        self.doc_lengths = np.load(index_dir / "doc_lengths.npy", mmap_mode="r")
+
+        self.n_chunks = len(self.chunks)
+        avg_length = float(self.doc_lengths.mean()) if self.n_chunks else 0.0
+        self.length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / max(avg_length, 1.0))
+
+    def search(self, query: str, n_results: int, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Score chunks against the query with BM25.
+
+        Args:
+            query: Search text, tokenized the same way as the index.
+            n_results: Maximum number of hits to return.
+            where: Optional Chroma-style metadata filter.
+
+        Returns:
+            List of dicts with 'id', 'text', 'metadata' and 'score', best first.
+        """
+        if not self.n_chunks:
+            return []
+
+        scores = np.zeros(self.n_chunks, dtype=np.float32)
+
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            docs = self.postings[start:end]
+            tf = self.term_freqs[start:end].astype(np.float32)
+
+            df = end - start
+            idf = np.log(1 + (self.n_chunks - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + self.length_norm[docs])
+
+        hits = []
+        for position in np.argsort(-scores):
+            if scores[position] <= 0:
+                break
+            chunk = self.chunks[position]
+            if not matches_where(chunk["metadata"], where):
+                continue
+            hits.append({**chunk, "score": float(scores[position])})
+            if len(hits) >= n_results:
+                break
+
+        return hits
+
+
+def build_lexical_index(chunks: List[Dict[str, Any]], index_dir: Path = None) -> None:
+    """Tokenize chunks and write the BM25 arrays to index_dir.
+
+    Args:
+        chunks: Chunks with 'id', 'text' and 'metadata' keys, as produced by build_chunks.
+        index_dir: Output directory (default: settings.LEXICAL_INDEX_DIR).
+    """
+    if index_dir is None:
+        index_dir = settings.LEXICAL_INDEX_DIR
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+
+    vocab: Dict[str, int] = {}
+    postings_by_term: Dict[int, List[tuple]] = {}
+    doc_lengths = []
+
+    for position, chunk in enumerate(chunks):
+        tokens = tokenize(chunk["text"])
+        doc_lengths.append(len(tokens))
+        for term, count in Counter(tokens).items():
+            term_id = vocab.setdefault(term, len(vocab))
+            postings_by_term.setdefault(term_id, []).append((position, count))
+
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    postings = []
+    term_freqs = []
+    for term_id in range(len(vocab)):
+        entries = postings_by_term[term_id]
+        offsets[term_id + 1] = offsets[term_id] + len(entries)
+        postings.extend(position for position, _ in entries)
+        term_freqs.extend(min(count, np.iinfo(np.uint16).max) for _, count in entries)
+
+    np.save(index_dir / "offsets.npy", offsets)
+    np.save(index_dir / "postings.npy", np.asarray(postings, dtype=np.int32))
+    np.save(index_dir / "term_freqs.npy", np.asarray(term_freqs, dtype=np.uint16))
+    np.save(index_dir / "doc_lengths.npy", np.asarray(doc_lengths, dtype=np.uint32))
+
+    with open(index_dir / "vocab.json", "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(index_dir / "chunks.json", "w", encoding="utf-8") as f:
+        json.dump(
+            [{"id": chunk["id"], "text": chunk["text"], "metadata": chunk["metadata"]} for chunk in chunks],
+            f,
+            ensure_ascii=False,
+        )
+
+    print(f"Lexical index: {len(chunks)} chunks, {len(vocab)} terms, {len(postings)} postings")
+
+
+def load_lexical_index(index_dir: Path = None) -> Optional[LexicalIndex]:
+    """Load the lexical index, or return None if it has not been built."""
+    if index_dir is None:
+        index_dir = settings.LEXICAL_INDEX_DIR
+
+    if not os.path.exists(Path(index_dir) / "vocab.json"):
+        print(f"Lexical index not found at {index_dir}, using vector search only")
+        return None
+
+    try:
+        return LexicalIndex(index_dir)
+    except Exception as e:
+        print(f"Error loading lexical index: {e}")
+        return None
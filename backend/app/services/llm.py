@@ -0,0 +1,127 @@
+"""Shared Gemini client for text prompts.
+
+Every text generation call, plain or streamed, goes through this module,
+which logs the prompt size (local estimate and, when Gemini reports it,
+the billed and cached prompt tokens) and the call latency, and keeps
+running totals for get_usage_stats.
+
+Prompts with a static part (such as the tax classifier's base knowledge)
+put it first, joined to the per-request part with PREFIX_SEPARATOR, so
+Gemini's implicit prefix caching can reuse it; the cached tokens it
+reports are counted in the usage totals.
+
+Set GEMINI_BASE_URL to point the client at a local fake Gemini server
+(see benchmarks/fake_gemini.py).
+"""
+import threading
+import time
+from typing import Dict, Any, Iterator
+
+from google import genai
+from google.genai import types
+
+from app.core.config import settings
+from app.utils.tokens import count_tokens
+from app.utils.tracing import span, start_span
+
+
+PREFIX_SEPARATOR = "\n\n"
+
+genai_client = genai.Client(
+    api_key=settings.GEMINI_API_KEY,
+    http_options=types.HttpOptions(base_url=settings.GEMINI_BASE_URL) if settings.GEMINI_BASE_URL else None,
+)
+
+_usage_lock = threading.Lock()
+_usage: Dict[str, int] = {
+    "calls": 0,
+    "cached_calls": 0,
+    "prompt_tokens": 0,
+    "cached_tokens": 0,
+}
+
+
+def _record_usage(response, label: str, prompt: str, elapsed_ms: float, trace_span=None) -> None:
+    """Log one call's prompt size and add it to the usage totals (and its span)."""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None) or count_tokens(prompt)
+    cached_tokens = getattr(usage, "cached_content_token_count", None) or 0
+    if trace_span is not None:
+        trace_span.set(prompt_tokens=prompt_tokens, cached_tokens=cached_tokens,
+                       output_tokens=getattr(usage, "candidates_token_count", None))
+
+    with _usage_lock:
+        _usage["calls"] += 1
+        _usage["cached_calls"] += 1 if cached_tokens else 0
+        _usage["prompt_tokens"] += prompt_tokens
+        _usage["cached_tokens"] += cached_tokens
+
+    reported = getattr(usage, "prompt_token_count", None)
+    print(f"[{label}] prompt {len(prompt)} chars, ~{count_tokens(prompt)} tokens"
+          f"{f' ({reported} billed, {cached_tokens} cached)' if reported else ''}, {elapsed_ms:.0f} ms")
+
+
+def generate_text(prompt: str, label: str = "gemini"):
+    """Send a text prompt to Gemini and log its size.
+
+    Args:
+        prompt: Full prompt text.
+        label: Caller name used in the log line.
+
+    Returns:
+        The Gemini response. Exceptions from the API are not caught, so
+        callers keep their own retry and fallback handling.
+    """
+    start = time.perf_counter()
+    with span("gemini.generate", kind="client", model=settings.GEMINI_MODEL, label=label) as s:
+        response = genai_client.models.generate_content(
+            model=f"models/{settings.GEMINI_MODEL}",
+            contents=prompt,
+        )
+        _record_usage(response, label, prompt, (time.perf_counter() - start) * 1000, s)
+    return response
+
+
+def generate_text_stream(prompt: str, label: str = "gemini") -> Iterator[str]:
+    """Stream a text prompt's answer from Gemini, yielding text chunks.
+
+    The prompt size, time to first chunk and total time are logged once
+    the stream ends. API errors are raised to the consumer.
+    """
+    start = time.perf_counter()
+    first_chunk_ms = None
+    last_chunk = None
+    # Not made current: the consumer may resume this generator from other threads
+    stream_span = start_span("gemini.stream", kind="client", model=settings.GEMINI_MODEL, label=label)
+
+    try:
+        for chunk in genai_client.models.generate_content_stream(
+            model=f"models/{settings.GEMINI_MODEL}",
+            contents=prompt,
+        ):
+            last_chunk = chunk
+            if chunk.text:
+                if first_chunk_ms is None:
+                    first_chunk_ms = (time.perf_counter() - start) * 1000
+                    stream_span.set(first_chunk_ms=round(first_chunk_ms, 1))
+                yield chunk.text
+    except BaseException as e:
+        stream_span.end(error=e)
+        raise
+
+    _record_usage(last_chunk, label, prompt, (time.perf_counter() - start) * 1000, stream_span)
+    stream_span.end()
+    if first_chunk_ms is not None:
+        print(f"[{label}] first chunk after {first_chunk_ms:.0f} ms")
+
+
+def get_usage_stats() -> Dict[str, Any]:
+    """Return prompt token totals since startup, split into cached and uncached."""
+    with _usage_lock:
+        stats = dict(_usage)
+
+    stats["uncached_tokens"] = stats["prompt_tokens"] - stats["cached_tokens"]
+    stats["cached_ratio"] = (
+        round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else 0.0
+    )
+    return stats
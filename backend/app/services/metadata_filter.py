@@ -0,0 +1,44 @@
+"""In-process evaluation of Chroma-style where filters.
+
+Supports the subset of the Chroma filter language used by
+retrieval.build_where: ``$and``, ``$or``, ``$eq``, ``$ne``, ``$in``,
+``$nin``, ``$gt``, ``$gte``, ``$lt``, ``$lte`` and bare equality.
+"""
+from typing import Dict, Any, Optional
+
+
+OPERATORS = {
+    "$eq": lambda value, target: value == target,
+    "$ne": lambda value, target: value != target,
+    "$in": lambda value, target: value in target,
+    "$nin": lambda value, target: value not in target,
+    "$gt": lambda value, target: value is not None and value > target,
+    "$gte": lambda value, target: value is not None and value >= target,
+    "$lt": lambda value, target: value is not None and value < target,
+    "$lte": lambda value, target: value is not None and value <= target,
+}
+
+
+def matches_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Return True if a chunk's metadata satisfies a where filter."""
+    if not where:
+        return True
+
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, target in condition.items():
+                if operator not in OPERATORS:
+                    raise ValueError(f"Unsupported where operator: {operator}")
+                if not OPERATORS[operator](value, target):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+
+    return True
@@ -0,0 +1,159 @@
+"""Micro-batching of concurrent vector searches.
+
+Under load, every chat and classification request embeds its query on
+its own and runs its own nearest-neighbour search. The batcher gathers
+queries that arrive within RETRIEVAL_BATCH_WAIT_MS of each other (or until
+RETRIEVAL_BATCH_SIZE are waiting), embeds them in one model call, runs one
+multi-vector search per (vector store, filter) group and hands each caller
+its own hits.
+
+There is no background thread: the first caller to arrive leads the
+batch. If more queries arrive while a batch is running, the oldest of
+them leads the next one, so no caller is kept busy serving others.
+"""
+import json
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from app.core.config import settings
+from app.services.vector_store import embed_texts
+
+
+class _Request:
+    """One caller's query and, once the batch ran, its hits."""
+
+    def __init__(self, store, query: str, n_results: int, where: Optional[Dict[str, Any]]):
+        self.store = store
+        self.query = query
+        self.n_results = n_results
+        self.where = where
+        self.wake = threading.Event()
+        self.lead = False
+        self.finished = False
+        self.hits: List[Dict[str, Any]] = []
+        self.error: Optional[BaseException] = None
+
+
+class QueryBatcher:
+    """Batches concurrent vector store queries from many threads."""
+
+    def __init__(self, max_batch: int = None, max_wait_ms: float = None):
+        self.max_batch = max_batch or settings.RETRIEVAL_BATCH_SIZE
+        self.max_wait_ms = settings.RETRIEVAL_BATCH_WAIT_MS if max_wait_ms is None else max_wait_ms
+        self._cond = threading.Condition()
+        self._pending: List[_Request] = []
+        self._leading = False
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+
+    def query(self, store, query: str, n_results: int,
+              where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Search store for query as part of the next batch.
+
+        Returns the same hits as store.query(query, n_results, where).
+        """
+        request = _Request(store, query, n_results, where)
+
+        with self._cond:
+            self._pending.append(request)
+            if self._leading:
+                if len(self._pending) >= self.max_batch:
+                    self._cond.notify_all()
+            else:
+                self._leading = True
+                request.lead = True
+
+        while True:
+            if not request.lead:
+                request.wake.wait()
+                request.wake.clear()
+            if request.finished:
+                break
+            if request.lead:
+                self._lead()
+
+        if request.error is not None:
+            raise request.error
+        return request.hits
+
+    def _lead(self) -> None:
+        """Collect one batch, run it, and pass leadership on."""
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        with self._cond:
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+
+        self._run_batch(batch)
+
+        with self._cond:
+            self.batches += 1
+            self.queries += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+            successor = self._pending[0] if self._pending else None
+            if successor is None:
+                self._leading = False
+            else:
+                successor.lead = True
+
+        for request in batch:
+            request.lead = False
+            request.finished = True
+            request.wake.set()
+        if successor is not None:
+            successor.wake.set()
+
+    def _run_batch(self, batch: List[_Request]) -> None:
+        """Embed every query once and run one search per (store, filter) group."""
+        texts = list(dict.fromkeys(request.query for request in batch))
+        try:
+            vectors = embed_texts(texts)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+            return
+        row = {text: i for i, text in enumerate(texts)}
+
+        groups: Dict[tuple, List[_Request]] = {}
+        for request in batch:
+            key = (id(request.store), json.dumps(request.where, sort_keys=True, default=str))
+            groups.setdefault(key, []).append(request)
+
+        for requests in groups.values():
+            n_results = max(request.n_results for request in requests)
+            try:
+                results = requests[0].store.query_vectors(
+                    vectors[[row[request.query] for request in requests]],
+                    n_results,
+                    requests[0].where,
+                )
+            except Exception as e:
+                for request in requests:
+                    request.error = e
+                continue
+
+            for request, hits in zip(requests, results):
+                request.hits = hits[:request.n_results]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return batch counts and sizes since startup."""
+        with self._cond:
+            return {
+                "enabled": settings.RETRIEVAL_BATCHING,
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait_ms,
+                "batches": self.batches,
+                "queries": self.queries,
+                "avg_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+            }
+
+
+query_batcher = QueryBatcher()
@@ -1,35 +1,20 @@
 """RAG (Retrieval-Augmented Generation) service for querying documents."""
-import chromadb
-from google import genai
+from app.services import retrieval
+from app.services.context_builder import assemble_context
+from app.services.llm import generate_text
 
-from app.core.config import settings
 
+def query_documents(question, n_results=None, where=None):
+    """Query the vector database for relevant document chunks.
 
-genai_client = genai.Client(api_key=settings.GEMINI_API_KEY)
-
-chroma_client = chromadb.PersistentClient(path=str(settings.EMBEDDINGS_DIR))
-collection_name = settings.CHROMA_COLLECTION_NAME
-collection = chroma_client.get_or_create_collection(name=collection_name)
-
-
-def query_documents(question, n_results=None):
-    """Query the vector database for relevant document chunks."""
-    if n_results is None:
-        n_results = settings.RAG_N_RESULTS
-        
+    Args:
+        question: Search text.
+        n_results: Number of chunks to return (default: settings.RAG_N_RESULTS).
+        where: Optional metadata filter, see retrieval.build_where.
+    """
     try:
-        results = collection.query(
-            query_texts=[question],
-            n_results=n_results
-        )
-        
-        relevant_chunks = []
-        
-        if results.get("documents"):
-            for doc_list in results["documents"]:
-                relevant_chunks.extend(doc_list)
-        
-        return relevant_chunks
+        hits = retrieval.search(question, n_results=n_results, where=where)
+        return [hit["text"] for hit in hits]
     
     except Exception as e:
         print(f"Error querying documents: {e}")
@@ -41,7 +26,7 @@ def generate_response(question, relevant_chunks):
     if not relevant_chunks:
         return "I don't have enough information to answer this question."
     
-    context = "\n\n".join(relevant_chunks)
+    context = assemble_context(relevant_chunks)["context"]
     
     prompt = (
         "You are an assistant for Thailand Tax deduction. Use the following pieces of "
@@ -51,10 +36,7 @@ def generate_response(question, relevant_chunks):
     )
     
     try:
-        response = genai_client.models.generate_content(
-            model=f"models/{settings.GEMINI_MODEL}",
-            contents=prompt
-        )
+        response = generate_text(prompt, label="rag_service")
         
         return response.text
     
@@ -0,0 +1,191 @@
+"""Shared retrieval over the tax rule knowledge base.
+
+Wraps the configured vector store with metadata filters so callers can narrow a
+search to the tax year and deduction category a receipt belongs to, and
+fuses vector results with the BM25 lexical index (reciprocal rank fusion)
+so exact Thai tax terms rank well. Concurrent vector searches are
+micro-batched (see app.services.query_batcher). Indexes are read from the active
+snapshot (see app.services.index_snapshots), which is hot-reloaded when
+document_indexer publishes a new one.
+"""
+import contextlib
+import re
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from app.core.config import settings
+from app.services.index_snapshots import snapshot_manager
+from app.services.query_batcher import query_batcher
+from app.utils.tracing import span
+
+# Tax year tag for chunks whose year could not be determined
+UNDATED_YEAR = 0
+
+BE_YEAR_OFFSET = 543
+YEAR_PATTERN = re.compile(r"(?<!\d)(20[2-9]\d|25[6-9]\d)(?!\d)")
+
+
+def get_indexed_years() -> List[int]:
+    """Return the sorted tax years present in the knowledge base.
+
+    Cached per snapshot, so a newly published snapshot is rescanned.
+    """
+    try:
+        with snapshot_manager.acquire() as snapshot:
+            if snapshot.indexed_years is None:
+                metadatas = snapshot.vector_store.get_metadatas()
+                years = {m.get("tax_year") for m in metadatas if m and m.get("tax_year")}
+                snapshot.indexed_years = sorted(years)
+            return snapshot.indexed_years
+    except Exception as e:
+        print(f"Error reading indexed tax years: {e}")
+        return []
+
+
+@contextlib.contextmanager
+def pin_snapshot():
+    """Serve every search in the block from the same snapshot.
+
+    If no snapshot can be opened the block still runs, and each search
+    reports the error itself.
+    """
+    with contextlib.ExitStack() as stack:
+        try:
+            stack.enter_context(snapshot_manager.acquire())
+        except Exception as e:
+            print(f"Error opening index snapshot: {e}")
+        yield
+
+
+def resolve_tax_year(year: Optional[int]) -> Optional[int]:
+    """Map a requested tax year to the closest indexed year.
+
+    Rules carry over until the Revenue Department publishes new ones, so the
+    latest indexed year not after the requested one is used. Returns None
+    if the knowledge base has no year tags at all.
+    """
+    years = get_indexed_years()
+    if not years:
+        return None
+    if year is None:
+        return years[-1]
+
+    earlier = [y for y in years if y <= year]
+    return earlier[-1] if earlier else years[0]
+
+
+def tax_year_from_date(date_str: Optional[str]) -> int:
+    """Return the CE tax year of a YYYY-MM-DD date, or the default tax year."""
+    try:
+        year = datetime.strptime(str(date_str)[:10], "%Y-%m-%d").year
+    except (TypeError, ValueError):
+        return settings.DEFAULT_TAX_YEAR
+
+    # Receipts are sometimes dated in Buddhist Era
+    if year > 2400:
+        year -= BE_YEAR_OFFSET
+    return year
+
+
+def tax_year_from_text(text: str) -> Optional[int]:
+    """Return the CE year mentioned in free text (CE or BE), if any."""
+    match = YEAR_PATTERN.search(text or "")
+    if not match:
+        return None
+    year = int(match.group())
+    return year - BE_YEAR_OFFSET if year > 2400 else year
+
+
+def build_where(tax_year: Optional[int] = None, category: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Build a Chroma where filter for a tax year and category group.
+
+    Undated chunks and chunks tagged "General" always match, so general
+    rules are never filtered out.
+
+    Args:
+        tax_year: Requested tax year in CE, resolved to the closest indexed year.
+        category: Candidate category group (see app.services.tax_categories).
+
+    Returns:
+        Where filter dict, or None if no condition applies.
+    """
+    conditions = []
+
+    resolved_year = resolve_tax_year(tax_year)
+    if resolved_year is not None:
+        conditions.append({"tax_year": {"$in": [resolved_year, UNDATED_YEAR]}})
+
+    if category and category != "General":
+        conditions.append({"category": {"$in": [category, "General"]}})
+
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def vector_search(query: str, n_results: int, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Search the vector store by embedding similarity."""
+    with snapshot_manager.acquire() as snapshot, \
+            span("vector.search", backend=snapshot.vector_store.backend,
+                 batched=settings.RETRIEVAL_BATCHING) as s:
+        if settings.RETRIEVAL_BATCHING:
+            hits = query_batcher.query(snapshot.vector_store, query, n_results, where)
+        else:
+            hits = snapshot.vector_store.query(query, n_results, where)
+        s.set(chunks=len(hits))
+        return hits
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], k: int = None) -> List[Dict[str, Any]]:
+    """Fuse ranked hit lists by summing 1 / (k + rank) per chunk id.
+
+    Returns:
+        Unique hits ordered by fused score, each with an 'rrf_score' key.
+    """
+    if k is None:
+        k = settings.RRF_K
+
+    fused: Dict[str, Dict[str, Any]] = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["id"], {**hit, "rrf_score": 0.0})
+            entry["rrf_score"] += 1.0 / (k + rank)
+
+    return sorted(fused.values(), key=lambda hit: hit["rrf_score"], reverse=True)
+
+
+def search(query: str, n_results: int = None, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Search the knowledge base, optionally filtered by chunk metadata.
+
+    When the lexical index is available, vector and BM25 candidates are
+    fused with reciprocal rank fusion. Falls back to an unfiltered search
+    if the filter matches nothing, so an over-narrow filter never leaves the
+    caller without context.
+
+    Returns:
+        List of dicts with 'id', 'text' and 'metadata' keys, ordered by
+        relevance.
+    """
+    if n_results is None:
+        n_results = settings.RAG_N_RESULTS
+
+    with snapshot_manager.acquire() as snapshot, \
+            span("retrieval.search", snapshot=snapshot.version, n_results=n_results,
+                 filtered=where is not None, hybrid=snapshot.lexical_index is not None) as s:
+        if snapshot.lexical_index is not None:
+            candidates = max(n_results, settings.HYBRID_CANDIDATES)
+            vector_hits = vector_search(query, candidates, where)
+            with span("bm25.search"):
+                lexical_hits = snapshot.lexical_index.search(query, candidates, where)
+            hits = reciprocal_rank_fusion([vector_hits, lexical_hits])[:n_results]
+        else:
+            hits = vector_search(query, n_results, where)
+        s.set(chunks=len(hits))
+
+    if not hits and where is not None:
+        print(f"No results for filter {where}, retrying without filter")
+        return search(query, n_results=n_results)
+
+    return hits
@@ -0,0 +1,73 @@
+"""Deduction category groups and keyword detection.
+
+The knowledge base is tagged with coarse category groups rather than the
+13 fine-grained deduction categories, because the source documents discuss
+related deductions (e.g. life and health insurance) together.
+"""
+from typing import Optional
+
+
+GENERAL_CATEGORY = "General"
+
+# Category group -> keywords found in merchant names and rule documents
+CATEGORY_KEYWORDS = {
+    "Donation": ["มูลนิธิ", "บริจาค", "donation", "สภากาชาด", "foundation", "วัด", "temple", "charity", "e-donation"],
+    "Insurance": ["ประกัน", "insurance", "สุขภาพ", "ชีวิต", "premium", "บำนาญ", "pension"],
+    "Fund": ["กองทุน", "fund", "ssf", "rmf", "esg", "สำรองเลี้ยงชีพ", "provident"],
+    "Social Security": ["ประกันสังคม", "สปส", "sso", "social security", "เงินสมทบ"],
+    "Home Loan": ["ดอกเบี้ยเงินกู้", "ที่อยู่อาศัย", "home loan", "mortgage"],
+    "Easy E-Receipt": ["easy e-receipt", "e-receipt", "e-tax invoice", "ใบกำกับภาษีอิเล็กทรอนิกส์", "ใบรับอิเล็กทรอนิกส์"],
+}
+
+# Fine-grained deduction category -> category group
+CATEGORY_GROUPS = {
+    "Life Insurance": "Insurance",
+    "Health Insurance": "Insurance",
+    "Parent Health Insurance": "Insurance",
+    "Pension Insurance": "Insurance",
+    "Social Security": "Social Security",
+    "Provident Fund": "Fund",
+    "SSF": "Fund",
+    "RMF": "Fund",
+    "Thai ESG": "Fund",
+    "Home Loan Interest": "Home Loan",
+    "Donation (General)": "Donation",
+    "Donation (Education/Sports)": "Donation",
+    "Easy E-Receipt": "Easy E-Receipt",
+}
+
+# Social Security keywords overlap with Insurance ("ประกัน"), so check it first
+DETECTION_ORDER = ["Social Security", "Donation", "Insurance", "Fund", "Home Loan", "Easy E-Receipt"]
+
+
+def detect_category(text: str, default: Optional[str] = GENERAL_CATEGORY) -> Optional[str]:
+    """Return the first category group whose keywords appear in text."""
+    text_lower = (text or "").lower()
+    for category in DETECTION_ORDER:
+        if any(keyword in text_lower for keyword in CATEGORY_KEYWORDS[category]):
+            return category
+    return default
+
+
+def dominant_category(text: str) -> str:
+    """Return the category group mentioned most often in a block of text.
+
+    Used to tag knowledge base chunks, which often mention several
+    categories in passing.
+    """
+    text_lower = (text or "").lower()
+    best_category = GENERAL_CATEGORY
+    best_count = 0
+
+    for category in DETECTION_ORDER:
+        count = sum(text_lower.count(keyword) for keyword in CATEGORY_KEYWORDS[category])
+        if count > best_count:
+            best_category = category
+            best_count = count
+
+    return best_category
+
+
+def category_group(category_name: str) -> str:
+    """Map a fine-grained deduction category to its group."""
+    return CATEGORY_GROUPS.get(category_name, GENERAL_CATEGORY)
@@ -0,0 +1,160 @@
+"""Process-wide cache of the tax_rules table.
+
+The table is small and rarely changes, yet saving one receipt used to
+query it up to four times and every dashboard request reloaded it. The
+cache loads every rule in one query and indexes them by id and by
+(category_name, tax_year). It reloads after TAX_RULE_CACHE_TTL seconds
+or when invalidated (POST /tax-rules/cache/invalidate after editing
+rules).
+
+The version number changes whenever a reload returns different rules,
+so anything derived from the rules (such as cached dashboards) can tell
+when it is stale. Each worker has its own cache; other workers pick up
+an edit within the TTL.
+
+If Supabase cannot be reached, the last loaded rules are kept and the
+load is retried after RETRY_AFTER_ERROR seconds. Callers fall back to
+querying the table themselves only while nothing has been loaded yet.
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.core.config import settings
+from app.database.database import supabase
+
+
+RETRY_AFTER_ERROR = 30  # seconds before a failed load is retried
+
+
+class TaxRuleCache:
+    """In-memory tax rules with TTL- and version-based invalidation."""
+
+    def __init__(self, ttl: int = None):
+        self.ttl = settings.TAX_RULE_CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._expires_at = 0.0
+        self._fingerprint = None
+        self._rules: List[Dict[str, Any]] = []
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._by_key: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+        self._by_category: Dict[str, List[Dict[str, Any]]] = {}
+        self.version = 0
+        self.loads = 0
+        self.errors = 0
+        self.lookups = 0
+
+    def _load(self) -> None:
+        """Query every rule and rebuild the indexes. Callers must hold _lock."""
+        try:
+            response = supabase.table("tax_rules").select("*").order("category_name").execute()
+        except Exception as e:
+            self.errors += 1
+            self._expires_at = time.time() + RETRY_AFTER_ERROR
+            print(f"Error loading tax rules{' (keeping cached rules)' if self._loaded else ''}: {e}")
+            return
+
+        rules = response.data or []
+        by_key, by_category = {}, {}
+        for rule in rules:
+            if not rule.get("is_active"):
+                continue
+            by_key.setdefault((rule.get("category_name"), rule.get("tax_year")), rule)
+            by_category.setdefault(rule.get("category_name"), []).append(rule)
+
+        fingerprint = hashlib.sha256(
+            json.dumps(rules, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        if fingerprint != self._fingerprint:
+            self.version += 1
+            self._fingerprint = fingerprint
+
+        self._rules = rules
+        self._by_id = {str(rule["id"]): rule for rule in rules}
+        self._by_key = by_key
+        self._by_category = by_category
+        self._loaded = True
+        self._expires_at = time.time() + self.ttl
+        self.loads += 1
+        print(f"Tax rule cache loaded {len(rules)} rules (version {self.version})")
+
+    def ensure_loaded(self) -> bool:
+        """Reload the rules if they have expired.
+
+        Returns:
+            True if rules are available (possibly stale after a failed
+            reload), False if they have never been loaded.
+        """
+        with self._lock:
+            self.lookups += 1
+            if time.time() >= self._expires_at:
+                self._load()
+            return self._loaded
+
+    def refresh(self) -> bool:
+        """Reload the rules now. Returns whether rules are available."""
+        with self._lock:
+            self._load()
+            return self._loaded
+
+    def invalidate(self) -> Dict[str, Any]:
+        """Reload the rules now, e.g. after they were edited. Returns stats()."""
+        self.refresh()
+        return self.stats()
+
+    def get_rules(self, active_only: bool = True) -> Optional[List[Dict[str, Any]]]:
+        """Return all (or only active) rules, or None if they could not be loaded."""
+        if not self.ensure_loaded():
+            return None
+        with self._lock:
+            return [rule for rule in self._rules if rule.get("is_active") or not active_only]
+
+    def get_by_id(self, rule_id: Any) -> Optional[Dict[str, Any]]:
+        """Return a rule (active or not) by id; None if unknown or not loaded."""
+        if rule_id is None or not self.ensure_loaded():
+            return None
+        with self._lock:
+            return self._by_id.get(str(rule_id))
+
+    def get_by_category(self, category_name: str, tax_year: Optional[int] = None,
+                        fallback: bool = True) -> Optional[Dict[str, Any]]:
+        """Return the active rule for a category and tax year.
+
+        Args:
+            category_name: Rule category, as classified by the Tax Expert.
+            tax_year: Default: settings.DEFAULT_TAX_YEAR.
+            fallback: If no rule exists for that year, return the
+                category's rule for any year.
+        """
+        if tax_year is None:
+            tax_year = settings.DEFAULT_TAX_YEAR
+        if not self.ensure_loaded():
+            return None
+
+        with self._lock:
+            rule = self._by_key.get((category_name, tax_year))
+            if rule is None and fallback and self._by_category.get(category_name):
+                print(f"Warning: Using tax rule without year filter for {category_name}")
+                rule = self._by_category[category_name][0]
+        return rule
+
+    def stats(self) -> Dict[str, Any]:
+        """Return version, size, age and load counters."""
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "version": self.version,
+                "rules": len(self._rules),
+                "active_rules": sum(len(rules) for rules in self._by_category.values()),
+                "ttl": self.ttl,
+                "expires_in": round(max(0.0, self._expires_at - time.time()), 1) if self._loaded else None,
+                "lookups": self.lookups,
+                "loads": self.loads,
+                "errors": self.errors,
+            }
+
+
+tax_rule_cache = TaxRuleCache()
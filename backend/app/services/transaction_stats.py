@@ -0,0 +1,105 @@
+"""Per-user transaction totals aggregated by the database.
+
+The dashboard used to download every transaction of the user and add
+them up in Python. get_transaction_totals() instead calls the
+dashboard_summary Postgres function (app/database/sql/dashboard_summary.sql),
+which returns the totals, status counts and per-category deductions in
+one round trip.
+
+The function is granted to service_role only, so it is called with
+the service-role client. If it has not been installed or the backend
+has no SUPABASE_SERVICE_ROLE_KEY, the counts come from count=exact
+head requests (no rows are transferred) and only the verified
+transactions' rule_id and deductible_amount are downloaded. The function
+is tried again after RPC_RETRY_AFTER seconds.
+"""
+import time
+from typing import Any, Dict, Optional
+
+from postgrest.exceptions import APIError
+
+from app.database.database import service_supabase, supabase
+from app.services.tax_rule_cache import tax_rule_cache
+
+
+STATUSES = ("verified", "needs_review", "rejected", "not_deductible")
+RPC_RETRY_AFTER = 300  # seconds before a missing dashboard_summary function is tried again
+RPC_UNAVAILABLE = ("PGRST202", "42501")  # function not found; not granted to this key
+
+_rpc_missing_until = 0.0
+
+
+def count_transactions(user_id: str, status: Optional[str] = None) -> int:
+    """Count a user's transactions (optionally of one status) without fetching them."""
+    query = supabase.table("transactions").select("id", count="exact", head=True).eq("user_id", user_id)
+    if status:
+        query = query.eq("status", status)
+    return query.execute().count or 0
+
+
+def _totals_without_rpc(user_id: str, tax_year: Optional[int]) -> Dict[str, Any]:
+    """Totals from head counts and the verified rows' amounts."""
+    status_breakdown = {status: count_transactions(user_id, status) for status in STATUSES}
+    query = supabase.table("transactions").select(
+        "rule_id, deductible_amount"
+    ).eq("user_id", user_id).eq("status", "verified")
+    if tax_year:
+        query = query.gte("transaction_date", f"{tax_year}-01-01").lte("transaction_date", f"{tax_year}-12-31")
+    verified = query.execute().data or []
+
+    categories: Dict[str, Dict[str, Any]] = {}
+    for transaction in verified:
+        rule = tax_rule_cache.get_by_id(transaction.get("rule_id"))
+        if not rule:
+            continue
+        category = categories.setdefault(rule["category_name"], {"total_deductible": 0.0, "transactions": 0})
+        category["total_deductible"] += float(transaction.get("deductible_amount") or 0)
+        category["transactions"] += 1
+
+    return {
+        "total_deductible": sum(float(t.get("deductible_amount") or 0) for t in verified),
+        "total_transactions": count_transactions(user_id),
+        "status_breakdown": status_breakdown,
+        "categories": categories,
+        "source": "counts",
+    }
+
+
+def get_transaction_totals(user_id: str, tax_year: Optional[int] = None) -> Dict[str, Any]:
+    """Return a user's transaction totals.
+
+    Args:
+        user_id: UUID of the user
+        tax_year: Limit total_deductible and the per-category totals to this
+            year; all years if None (counts always cover every year)
+
+    Returns:
+        Dict with 'total_deductible' (verified only), 'total_transactions',
+        'status_breakdown' (count by status), 'categories' (category name ->
+        verified total_deductible and transactions) and 'source' ("rpc"
+        or "counts")
+    """
+    global _rpc_missing_until
+    if time.time() >= _rpc_missing_until:
+        try:
+            data = service_supabase.rpc(
+                "dashboard_summary", {"p_user_id": user_id, "p_tax_year": tax_year}
+            ).execute().data or {}
+            return {
+                "total_deductible": float(data.get("total_deductible") or 0),
+                "total_transactions": int(data.get("total_transactions") or 0),
+                "status_breakdown": {
+                    **{status: 0 for status in STATUSES},
+                    **(data.get("status_breakdown") or {}),
+                },
+                "categories": data.get("categories") or {},
+                "source": "rpc",
+            }
+        except APIError as e:
+            if e.code not in RPC_UNAVAILABLE:
+                raise
+            _rpc_missing_until = time.time() + RPC_RETRY_AFTER
+            print("Warning: dashboard_summary function not available (apply "
+                  "app/database/sql/dashboard_summary.sql and set SUPABASE_SERVICE_ROLE_KEY); using count queries")
+
+    return _totals_without_rpc(user_id, tax_year)
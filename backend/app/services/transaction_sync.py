@@ -0,0 +1,210 @@
+"""Delta sync of a user's transactions.
+
+Clients used to download the whole transaction list and the whole
+dashboard summary on every refresh. With app/database/sql/transaction_sync.sql
+applied, every transaction has an updated_at set by a trigger on insert
+and update, and deleted transactions leave a row in transaction_tombstones.
+
+sync() returns what changed since a client's cursor: rows updated or
+created since then, the ids of deleted rows and, if it changed, the
+summary (the totals of transaction_stats, compared by ETag). An
+unchanged refresh is a couple of index scans and a response of a few
+hundred bytes.
+
+Cursors are opaque to clients:
+- "<timestamp>" after a complete sync. The next sync starts
+  SYNC_CURSOR_OVERLAP seconds earlier, because a row can become visible
+  after rows with later timestamps (its transaction commits later);
+  rows sent twice are harmless as clients upsert by id.
+- "<timestamp>|<id>" while has_more is set, to fetch the next page.
+
+A full resync ('full': true, the client replaces its copy) is returned
+for a missing or unreadable cursor, for cursors older than the tombstone
+retention (SYNC_TOMBSTONE_DAYS) and while the migration is not applied.
+"""
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+from app.core.config import settings
+from app.database.database import supabase
+from app.services import transaction_stats
+from app.services.dashboard_cache import dashboard_cache
+
+
+# PostgREST/Postgres codes for a missing column or table
+SCHEMA_MISSING = ("42703", "42P01", "PGRST204", "PGRST205")
+SCHEMA_RETRY_AFTER = 300  # seconds before a missing migration is checked again
+PRUNE_INTERVAL = 3600  # seconds between tombstone clean-ups
+
+_schema_missing_until = 0.0
+_pruned_at = 0.0
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, Optional[str]]]:
+    """Split a cursor into (timestamp, id of the last row sent); None if unreadable."""
+    if not cursor:
+        return None
+    timestamp, _, last_id = cursor.partition("|")
+    try:
+        parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed, last_id or None
+
+
+def _load_changes(user_id: str, since: Optional[datetime], last_id: Optional[str]) -> List[Dict[str, Any]]:
+    """One page of rows changed after the cursor, in (updated_at, id) order."""
+    query = supabase.table("transactions").select("*").eq("user_id", user_id)
+    if since and last_id:
+        # Next page: strictly after the last row sent
+        timestamp = since.isoformat()
+        query = query.or_(f'updated_at.gt."{timestamp}",and(updated_at.eq."{timestamp}",id.gt.{last_id})')
+    elif since:
+        query = query.gte("updated_at", (since - timedelta(seconds=settings.SYNC_CURSOR_OVERLAP)).isoformat())
+    return query.order("updated_at").order("id").limit(settings.SYNC_PAGE_SIZE).execute().data or []
+
+
+def _load_tombstones(user_id: str, since: datetime) -> List[Dict[str, Any]]:
+    """Deletions since the cursor (with the same overlap as the rows)."""
+    return supabase.table("transaction_tombstones").select("transaction_id, deleted_at").eq(
+        "user_id", user_id
+    ).gte(
+        "deleted_at", (since - timedelta(seconds=settings.SYNC_CURSOR_OVERLAP)).isoformat()
+    ).order("deleted_at").limit(settings.SYNC_PAGE_SIZE + 1).execute().data or []
+
+
+def prune_tombstones() -> None:
+    """Delete tombstones past the retention, at most once per PRUNE_INTERVAL."""
+    global _pruned_at
+    if time.time() - _pruned_at < PRUNE_INTERVAL:
+        return
+    _pruned_at = time.time()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.SYNC_TOMBSTONE_DAYS)
+    try:
+        supabase.table("transaction_tombstones").delete().lt("deleted_at", cutoff.isoformat()).execute()
+    except Exception as e:
+        print(f"Warning: Failed to prune transaction tombstones: {e}")
+
+
+def get_summary(user_id: str) -> Dict[str, Any]:
+    """The user's totals for the current tax year, with their ETag.
+
+    Served from the dashboard cache, so it is only queried again after
+    one of the user's transactions changed.
+    """
+    tax_year = settings.DEFAULT_TAX_YEAR
+
+    def build() -> bytes:
+        totals = transaction_stats.get_transaction_totals(user_id, tax_year)
+        totals.pop("source", None)
+        return json.dumps(totals, separators=(",", ":")).encode("utf-8")
+
+    entry = dashboard_cache.get_or_build(user_id, f"sync-summary:{tax_year}", build)
+    return {"summary": json.loads(entry["body"]), "etag": entry["etag"]}
+
+
+def latest_cursor(timestamps: List[Optional[str]]) -> Optional[str]:
+    """The latest of some timestamps as a cursor; None if there are none."""
+    timestamps = [timestamp for timestamp in timestamps if parse_cursor(timestamp)]
+    return max(timestamps, key=lambda timestamp: parse_cursor(timestamp)[0]) if timestamps else None
+
+
+def sync(user_id: str, cursor: Optional[str] = None, summary_etag: Optional[str] = None) -> Dict[str, Any]:
+    """Return a user's transaction changes since a cursor.
+
+    Args:
+        user_id: UUID of the user
+        cursor: Cursor returned by the previous call; None for a full sync
+        summary_etag: ETag of the summary the client has
+
+    Returns:
+        Dict with success status, 'transactions' (changed rows), 'deleted'
+        (ids), 'full' (replace the local copy), 'has_more' (call again with
+        the new cursor), 'cursor', and 'summary' (None if summary_etag is
+        still current) with 'summary_etag', or an error message
+    """
+    global _schema_missing_until
+    try:
+        parsed = parse_cursor(cursor)
+        since, last_id = parsed if parsed else (None, None)
+        retention = datetime.now(timezone.utc) - timedelta(days=settings.SYNC_TOMBSTONE_DAYS)
+        if since and not last_id and since < retention:
+            # Deletions before the retention are forgotten
+            since = None
+        full = since is None
+
+        if time.time() < _schema_missing_until:
+            return _full_listing(user_id, summary_etag)
+        try:
+            rows = _load_changes(user_id, since, last_id)
+            tombstones = _load_tombstones(user_id, since) if since and not last_id else []
+        except APIError as e:
+            if e.code not in SCHEMA_MISSING:
+                raise
+            _schema_missing_until = time.time() + SCHEMA_RETRY_AFTER
+            print("Warning: transaction sync columns not found "
+                  "(apply app/database/sql/transaction_sync.sql); sending full listings")
+            return _full_listing(user_id, summary_etag)
+
+        if len(tombstones) > settings.SYNC_PAGE_SIZE:
+            # More deletions than a page: cheaper to start over
+            return sync(user_id, None, summary_etag)
+        prune_tombstones()
+
+        has_more = len(rows) == settings.SYNC_PAGE_SIZE
+        if has_more:
+            next_cursor = f"{rows[-1]['updated_at']}|{rows[-1]['id']}"
+        else:
+            next_cursor = latest_cursor(
+                [row.get("updated_at") for row in rows] + [t.get("deleted_at") for t in tombstones]
+            ) or (since.isoformat() if since else None)
+
+        result = {
+            "success": True,
+            "transactions": rows,
+            "count": len(rows),
+            "deleted": [str(t["transaction_id"]) for t in tombstones],
+            "full": full,
+            "has_more": has_more,
+            "cursor": next_cursor,
+            "summary": None,
+            "summary_etag": summary_etag,
+        }
+        if not has_more:
+            summary = get_summary(user_id)
+            result["summary_etag"] = summary["etag"]
+            if summary["etag"] != summary_etag:
+                result["summary"] = summary["summary"]
+        return result
+
+    except Exception as e:
+        print(f"Error syncing transactions for {user_id}: {e}")
+        return {
+            "success": False,
+            "error": f"Error syncing transactions: {str(e)}"
+        }
+
+
+def _full_listing(user_id: str, summary_etag: Optional[str]) -> Dict[str, Any]:
+    """Every transaction of the user, for when delta sync is unavailable."""
+    rows = supabase.table("transactions").select("*").eq("user_id", user_id).order(
+        "create_at", desc=True
+    ).execute().data or []
+    summary = get_summary(user_id)
+    return {
+        "success": True,
+        "transactions": rows,
+        "count": len(rows),
+        "deleted": [],
+        "full": True,
+        "has_more": False,
+        "cursor": None,
+        "summary": summary["summary"] if summary["etag"] != summary_etag else None,
+        "summary_etag": summary["etag"],
+    }
@@ -0,0 +1,247 @@
+"""Pluggable vector store backends for the tax rule knowledge base.
+
+Two backends share the same interface and the same embedding model
+(settings.EMBEDDING_MODEL), so an index built with one can be swapped for
+the other by changing settings.VECTOR_BACKEND:
+
+- "chroma": Chroma PersistentClient (SQLite + HNSW).
+- "numpy":  a float16 matrix of normalized embeddings in a memory-mapped
+            .npy file, searched exactly with one matrix-vector product.
+            Chunk text and metadata live in a side file. Read-only at
+            query time, so it needs no file locks and suits multi-worker
+            uvicorn.
+"""
+import json
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import chromadb
+import numpy as np
+from chromadb.utils import embedding_functions
+
+from app.core.config import settings
+from app.services.metadata_filter import matches_where
+from app.utils.tracing import span
+
+
+_embedding_functions: Dict[str, Any] = {}
+
+
+def get_embedding_function(model: str = None):
+    """Return the shared embedding function for a model (loaded on first use).
+
+    Args:
+        model: "default" for Chroma's ONNX MiniLM, or a sentence-transformers
+            model name (needs the sentence-transformers package).
+            Default: settings.EMBEDDING_MODEL.
+    """
+    if model is None:
+        model = settings.EMBEDDING_MODEL
+
+    if model not in _embedding_functions:
+        if model == "default":
+            _embedding_functions[model] = embedding_functions.DefaultEmbeddingFunction()
+        else:
+            _embedding_functions[model] = embedding_functions.SentenceTransformerEmbeddingFunction(
+                model_name=model
+            )
+    return _embedding_functions[model]
+
+
+def embed_texts(texts: List[str], batch_size: int = 64) -> np.ndarray:
+    """Embed texts with settings.EMBEDDING_MODEL and return L2-normalized float32 vectors."""
+    embed = get_embedding_function()
+    vectors = []
+    with span("embedding", model=settings.EMBEDDING_MODEL, texts=len(texts)):
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(embed(texts[start:start + batch_size]))
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if not len(matrix):
+        return matrix.reshape(0, 0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class ChromaVectorStore:
+    """Vector store backed by a Chroma persistent collection."""
+
+    backend = "chroma"
+
+    def __init__(self, path: Path = None, collection_name: str = None):
+        self.path = Path(path or settings.EMBEDDINGS_DIR)
+        self.client = chromadb.PersistentClient(path=str(self.path))
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name or settings.CHROMA_COLLECTION_NAME
+        )
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def get_metadatas(self) -> List[Dict[str, Any]]:
+        return self.collection.get(include=["metadatas"]).get("metadatas") or []
+
+    def write(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, batch_size: int = 100) -> None:
+        """Upsert chunks, replacing any stale chunks from the same sources."""
+        for source in {chunk["metadata"]["source"] for chunk in chunks}:
+            self.collection.delete(where={"source": source})
+
+        total_batches = (len(chunks) + batch_size - 1) // batch_size
+        for batch_idx in range(0, len(chunks), batch_size):
+            batch = chunks[batch_idx:batch_idx + batch_size]
+            self.collection.upsert(
+                ids=[chunk["id"] for chunk in batch],
+                documents=[chunk["text"] for chunk in batch],
+                metadatas=[chunk["metadata"] for chunk in batch],
+                embeddings=embeddings[batch_idx:batch_idx + batch_size].tolist(),
+            )
+            print(f"Processed batch {batch_idx // batch_size + 1}/{total_batches}")
+
+    def query(self, query: str, n_results: int, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Return the nearest chunks as dicts with 'id', 'text', 'metadata', 'distance'."""
+        return self.query_vectors(embed_texts([query]), n_results, where)[0]
+
+    def query_vectors(self, vectors: np.ndarray, n_results: int,
+                      where: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Search several query embeddings in one call; returns one hit list per vector."""
+        with span("chroma.query", kind="client", queries=len(vectors), n_results=n_results,
+                  filtered=where is not None) as s:
+            results = self.collection.query(
+                query_embeddings=vectors.tolist(),
+                n_results=n_results,
+                where=where
+            )
+            s.set(chunks=sum(len(ids) for ids in results.get("ids") or []))
+
+        all_hits = []
+        for i in range(len(vectors)):
+            hits = []
+            if results.get("documents"):
+                ids = results["ids"][i]
+                documents = results["documents"][i]
+                metadatas = results["metadatas"][i] if results.get("metadatas") else [None] * len(ids)
+                distances = results["distances"][i] if results.get("distances") else [None] * len(ids)
+
+                for hit_id, text, metadata, distance in zip(ids, documents, metadatas, distances):
+                    hits.append({
+                        "id": hit_id,
+                        "text": text,
+                        "metadata": metadata or {},
+                        "distance": distance,
+                    })
+            all_hits.append(hits)
+
+        return all_hits
+
+
+class NumpyVectorStore:
+    """Exact cosine search over a memory-mapped float16 embedding matrix.
+
+    Files inside path:
+        vectors.npy  float16[n_chunks, dim], L2-normalized embeddings
+        chunks.json  list of {"id", "text", "metadata"} in matrix row order
+    """
+
+    backend = "numpy"
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path or settings.VECTOR_INDEX_DIR)
+        self.vectors = np.empty((0, 0), dtype=np.float16)
+        self.chunks: List[Dict[str, Any]] = []
+
+        if (self.path / "vectors.npy").exists():
+            self.vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+            with open(self.path / "chunks.json", encoding="utf-8") as f:
+                self.chunks = json.load(f)
+        else:
+            print(f"NumPy vector index not found at {self.path}")
+
+    def count(self) -> int:
+        return len(self.chunks)
+
+    def get_metadatas(self) -> List[Dict[str, Any]]:
+        return [chunk["metadata"] for chunk in self.chunks]
+
+    def write(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray) -> None:
+        """Write the full index, replacing any previous contents."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        np.save(self.path / "vectors.npy", embeddings.astype(np.float16))
+        with open(self.path / "chunks.json", "w", encoding="utf-8") as f:
+            json.dump(
+                [{"id": c["id"], "text": c["text"], "metadata": c["metadata"]} for c in chunks],
+                f,
+                ensure_ascii=False,
+            )
+
+        self.vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+        self.chunks = chunks
+        print(f"Wrote {len(chunks)} vectors to {self.path}")
+
+    def query(self, query: str, n_results: int, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Return the nearest chunks as dicts with 'id', 'text', 'metadata', 'distance'."""
+        if not self.chunks:
+            return []
+        return self.query_vectors(embed_texts([query]), n_results, where)[0]
+
+    def query_vectors(self, vectors: np.ndarray, n_results: int,
+                      where: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Search several query embeddings with one matrix product; returns one hit list per vector."""
+        if not self.chunks:
+            return [[] for _ in range(len(vectors))]
+
+        with span("numpy.query", queries=len(vectors), n_results=n_results,
+                  filtered=where is not None, rows=len(self.chunks)) as s:
+            all_hits = self._search(vectors, n_results, where)
+            s.set(chunks=sum(len(hits) for hits in all_hits))
+        return all_hits
+
+    def _search(self, vectors: np.ndarray, n_results: int,
+                where: Optional[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        # (n_chunks, n_queries) scores in one pass over the memory-mapped matrix
+        scores = (self.vectors @ vectors.astype(np.float16).T).astype(np.float32)
+
+        if where:
+            mask = np.fromiter(
+                (matches_where(chunk["metadata"], where) for chunk in self.chunks),
+                dtype=bool,
+                count=len(self.chunks),
+            )
+            scores[~mask] = -np.inf
+
+        k = min(n_results, len(scores))
+        all_hits = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top])]
+
+            hits = []
+            for position in top:
+                if not np.isfinite(column[position]):
+                    break
+                chunk = self.chunks[position]
+                hits.append({
+                    "id": chunk["id"],
+                    "text": chunk["text"],
+                    "metadata": chunk["metadata"],
+                    "distance": float(1.0 - column[position]),
+                })
+            all_hits.append(hits)
+
+        return all_hits
+
+
+def load_vector_store(backend: str = None, path: Path = None):
+    """Open the configured vector store backend.
+
+    Args:
+        backend: "chroma" or "numpy" (default: settings.VECTOR_BACKEND).
+        path: Index directory (default: the backend's configured directory).
+    """
+    if backend is None:
+        backend = settings.VECTOR_BACKEND
+
+    if backend == "numpy":
+        return NumpyVectorStore(path)
+    if backend == "chroma":
+        return ChromaVectorStore(path)
+    raise ValueError(f"Unknown vector backend: {backend}")
@@ -1,17 +1,52 @@
-"""Workflow orchestration for the tax assistant multi-agent system."""
-from typing import TypedDict, Annotated
+"""Workflow orchestration for the tax assistant multi-agent system.
+
+The graph is compiled once per process (get_workflow) and shared by the
+CLI runner, the /workflow endpoints and the receipt endpoints.
+
+Runs are checkpointed to a local SQLite file (WORKFLOW_CHECKPOINT_DB) under
+a thread id. A receipt that stops at human input keeps its checkpoint, so
+resume_workflow can merge the user's fields into the extracted data and
+continue at the tax expert without re-running OCR. Checkpoints are kept
+small: only the final state of a run is written, the image bytes are
+dropped once inspected, message contents are capped at
+WORKFLOW_MESSAGE_MAX_CHARS and finished threads are deleted.
+"""
+import functools
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import TypedDict, Annotated, Dict, Any, Iterator, List, Optional, Tuple
+from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 
-from app.agents.inspector import extract_receipt_json
-from app.agents.tax_expert import ask_tax_expert, ask_tax_question
-from app.agents.accountant import save_receipt_from_inspector
+from app.core.config import settings
+from app.agents.inspector import extract_receipt_json, extract_receipt_from_bytes
+from app.agents.tax_expert import ask_tax_expert, ask_tax_question, prefetch_tax_context
+from app.agents.accountant import save_receipt_from_inspector, get_active_tax_rules
+from app.utils.tracing import span
+
+# Receipt fields a user may fill in or correct when resuming
+EDITABLE_FIELDS = ("date", "amount", "tax_id", "merchant_name")
+# Fields a receipt cannot be saved without; donations, temples and small
+# shops often have no merchant tax ID, so tax_id is optional
+REQUIRED_FIELDS = ("date", "amount")
+
+
+def merge_timings(left: Optional[dict], right: Optional[dict]) -> dict:
+    """Reducer for per-node timings, so parallel nodes can each report theirs."""
+    return {**(left or {}), **(right or {})}
 
 
 class AgentState(TypedDict):
     """State for the tax assistant workflow."""
     question: str
     image_path: str
+    image_bytes: bytes
+    receipt_image_url: str
     receipt_data: dict
     tax_analysis: dict
     tax_advice: str
@@ -20,16 +55,50 @@ class AgentState(TypedDict):
     status: str
     accountant_result: dict
     user_id: str
+    rag_prefetch: dict
+    tax_rules: list
+    timings: Annotated[dict, merge_timings]
     messages: Annotated[list, add_messages]
 
 
+def compact_message(content: Any) -> str:
+    """Cap a log message so checkpoints do not carry whole payloads twice.
+
+    The full receipt data, analysis and answer are kept in their own state
+    keys; messages are only a readable trace.
+    """
+    text = str(content)
+    limit = settings.WORKFLOW_MESSAGE_MAX_CHARS
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"... [{len(text) - limit} chars truncated]"
+
+
+def timed_node(name: str, node):
+    """Wrap a node in a span and record its wall time (ms) under state["timings"][name]."""
+    @functools.wraps(node)
+    def wrapper(state: AgentState):
+        start = time.perf_counter()
+        with span(f"node.{name}"):
+            update = dict(node(state))
+        update["timings"] = {name: round((time.perf_counter() - start) * 1000, 1)}
+        return update
+    return wrapper
+
+
 # ---------------------------------------------------------------------------
 # Entry-point router
 # ---------------------------------------------------------------------------
 
-def should_inspect_receipt(state: AgentState) -> str:
-    """Decide if we need to inspect a receipt image."""
-    if state.get("image_path"):
+def should_inspect_receipt(state: AgentState):
+    """Decide if we need to inspect a receipt image.
+
+    Receipts fan out: OCR runs alongside the retrieval and tax rule lookups
+    that do not need its output, and the graph joins before the tax expert.
+    """
+    if state.get("image_path") or state.get("image_bytes"):
+        if settings.WORKFLOW_PREFETCH:
+            return ["inspect", "prefetch_rag", "prefetch_rules"]
         return "inspect"
     return "tax_question"
 
@@ -38,30 +107,59 @@ def should_inspect_receipt(state: AgentState) -> str:
 # Node 1: Inspector (OCR only)
 # ---------------------------------------------------------------------------
 
-def inspect_receipt_node(state: AgentState) -> AgentState:
-    """Extract raw data from receipt image via Gemini Vision."""
-    print("Node 1: Inspector Agent - Analyzing receipt...")
+def inspect_receipt_node(state: AgentState) -> dict:
+    """Extract raw data from receipt image via Gemini Vision.
 
-    image_path = state["image_path"]
-    receipt_data = extract_receipt_json(image_path)
+    Returns only the keys it changes, since it runs in parallel with the
+    prefetch nodes.
+    """
+    print("Node 1: Inspector Agent - Analyzing receipt...")
 
-    state["receipt_data"] = receipt_data
-    state["messages"].append({
-        "role": "system",
-        "content": f"Receipt extracted: {receipt_data}"
-    })
+    if state.get("image_bytes"):
+        receipt_data = extract_receipt_from_bytes(state["image_bytes"])
+    else:
+        receipt_data = extract_receipt_json(state["image_path"])
 
     print(f"Extracted: date={receipt_data.get('date')}, "
           f"amount={receipt_data.get('amount')}, "
           f"tax_id={receipt_data.get('tax_id')}")
 
-    return state
+    return {
+        "receipt_data": receipt_data,
+        "image_bytes": None,  # not needed after OCR; keeps checkpoints small
+        "messages": [{
+            "role": "system",
+            "content": compact_message(f"Receipt extracted: {receipt_data}")
+        }],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Prefetch nodes (run alongside the Inspector)
+# ---------------------------------------------------------------------------
+
+def prefetch_rag_node(state: AgentState) -> dict:
+    """Run the merchant-independent Tax Expert queries while OCR runs."""
+    print("Prefetch: Tax Expert RAG queries...")
+    return {"rag_prefetch": prefetch_tax_context()}
+
+
+def prefetch_rules_node(state: AgentState) -> dict:
+    """Load the active tax rules (caps) for the Accountant while OCR runs."""
+    print("Prefetch: Tax rules...")
+    rules = get_active_tax_rules()
+    return {"tax_rules": rules if rules is not None else []}
 
 
 # ---------------------------------------------------------------------------
 # Node 2: Validator (conditional edge function)
 # ---------------------------------------------------------------------------
 
+def missing_fields(receipt_data: Dict[str, Any]) -> List[str]:
+    """Return the REQUIRED_FIELDS a receipt has no value for."""
+    return [field for field in REQUIRED_FIELDS if not receipt_data.get(field)]
+
+
 def validate_receipt_data(state: AgentState) -> str:
     """Check if receipt data is complete before proceeding."""
     receipt_data = state.get("receipt_data", {})
@@ -70,22 +168,11 @@ def validate_receipt_data(state: AgentState) -> str:
         print("Validation: Receipt has extraction error -> Human input needed")
         return "human_input"
 
-    date = receipt_data.get("date")
-    amount = receipt_data.get("amount")
-    tax_id = receipt_data.get("tax_id")
-
-    if date and amount and tax_id:
+    missing = missing_fields(receipt_data)
+    if not missing:
         print("Validation: Data complete -> Proceed to Tax Expert")
         return "tax_expert"
 
-    missing = []
-    if not date:
-        missing.append("date")
-    if not amount:
-        missing.append("amount")
-    if not tax_id:
-        missing.append("tax_id")
-
     print(f"Validation: Missing fields: {', '.join(missing)} -> Human input needed")
     return "human_input"
 
@@ -99,12 +186,12 @@ def tax_expert_node(state: AgentState) -> AgentState:
     print("Node 3: Tax Expert Agent - Classifying receipt...")
 
     receipt_data = state["receipt_data"]
-    tax_analysis = ask_tax_expert(receipt_data)
+    tax_analysis = ask_tax_expert(receipt_data, prefetched=state.get("rag_prefetch") or None)
 
     state["tax_analysis"] = tax_analysis
     state["messages"].append({
         "role": "system",
-        "content": f"Tax analysis: {tax_analysis}"
+        "content": compact_message(f"Tax analysis: {tax_analysis}")
     })
 
     print(f"Tax Expert result: is_deductible={tax_analysis.get('is_deductible')}, "
@@ -132,7 +219,9 @@ def accountant_node(state: AgentState) -> AgentState:
         user_id=user_id,
         receipt_data=receipt_data,
         category_name=final_category,
+        receipt_image_url=state.get("receipt_image_url"),
         tax_result=tax_analysis,
+        tax_rules=state.get("tax_rules") or None,
     )
 
     state["accountant_result"] = result
@@ -166,18 +255,14 @@ def human_input_node(state: AgentState) -> AgentState:
     print("Human-in-the-loop: Incomplete receipt data detected")
 
     receipt_data = state.get("receipt_data", {})
-    missing = []
-
-    if not receipt_data.get("date"):
-        missing.append("date")
-    if not receipt_data.get("amount"):
-        missing.append("amount")
-    if not receipt_data.get("tax_id"):
-        missing.append("tax_id")
+    missing = missing_fields(receipt_data)
 
     state["needs_human_input"] = True
     state["missing_fields"] = missing
     state["status"] = "awaiting_user_input"
+    # Prefetched data would be stale by the time the user answers
+    state["rag_prefetch"] = {}
+    state["tax_rules"] = []
     state["messages"].append({
         "role": "system",
         "content": f"Missing fields: {', '.join(missing)}. Awaiting user input."
@@ -203,7 +288,7 @@ def tax_question_node(state: AgentState) -> AgentState:
     state["status"] = "completed"
     state["messages"].append({
         "role": "assistant",
-        "content": answer,
+        "content": compact_message(answer),
     })
 
     return state
@@ -218,29 +303,30 @@ def build_workflow():
 
     Flow:
     START -> Router (has image?)
-          -> Inspector -> Validator (data complete?)
+          -> Inspector || RAG prefetch || tax rule prefetch
+             -> Validator (data complete?)
                        -> Tax Expert (RAG) -> Accountant (DB) -> END
                        -> Human Input (if incomplete) -> END
           -> Tax Q&A (if no image, free-text question) -> END
     """
     workflow = StateGraph(AgentState)
 
-    workflow.add_node("inspect", inspect_receipt_node)
-    workflow.add_node("tax_expert", tax_expert_node)
-    workflow.add_node("accountant", accountant_node)
-    workflow.add_node("human_input", human_input_node)
-    workflow.add_node("tax_question", tax_question_node)
+    workflow.add_node("inspect", timed_node("inspect", inspect_receipt_node))
+    workflow.add_node("prefetch_rag", timed_node("prefetch_rag", prefetch_rag_node))
+    workflow.add_node("prefetch_rules", timed_node("prefetch_rules", prefetch_rules_node))
+    workflow.add_node("tax_expert", timed_node("tax_expert", tax_expert_node))
+    workflow.add_node("accountant", timed_node("accountant", accountant_node))
+    workflow.add_node("human_input", timed_node("human_input", human_input_node))
+    workflow.add_node("tax_question", timed_node("tax_question", tax_question_node))
 
     # Entry point: decide receipt vs question
     workflow.set_conditional_entry_point(
         should_inspect_receipt,
-        {
-            "inspect": "inspect",
-            "tax_question": "tax_question",
-        }
+        ["inspect", "prefetch_rag", "prefetch_rules", "tax_question"]
     )
 
-    # After Inspector, validate completeness
+    # After Inspector, validate completeness. The prefetch nodes run in the
+    # same step, so the Tax Expert starts only once all three are done.
     workflow.add_conditional_edges(
         "inspect",
         validate_receipt_data,
@@ -258,22 +344,57 @@ def build_workflow():
     workflow.add_edge("human_input", END)
     workflow.add_edge("tax_question", END)
 
-    return workflow.compile()
+    return workflow.compile(checkpointer=get_checkpointer())
 
 
-# ---------------------------------------------------------------------------
-# Runner
-# ---------------------------------------------------------------------------
+_workflow = None
+_workflow_lock = threading.Lock()
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
 
-def run_tax_assistant(question: str, image_path: str = None, user_id: str = "demo-user-id"):
-    """Run the tax assistant workflow."""
-    print("=" * 60)
-    print("TicTaxFlow AI Assistant")
-    print("=" * 60)
 
-    initial_state = {
+def get_checkpointer() -> SqliteSaver:
+    """Return the shared SQLite checkpointer, opening the database on first use."""
+    global _checkpointer
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                path = str(settings.WORKFLOW_CHECKPOINT_DB)
+                if path != ":memory:":
+                    Path(path).parent.mkdir(parents=True, exist_ok=True)
+                _checkpointer = SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+                _checkpointer.setup()
+    return _checkpointer
+
+
+def get_workflow():
+    """Return the compiled workflow, compiling it on first use.
+
+    The compiled graph holds no per-run state (that lives in the
+    checkpointer, per thread id), so one instance serves every request.
+    """
+    global _workflow
+    if _workflow is None:
+        with _workflow_lock:
+            if _workflow is None:
+                _workflow = build_workflow()
+                print("Tax assistant workflow compiled")
+    return _workflow
+
+
+def build_initial_state(question: str = "", image_path: Optional[str] = None,
+                        image_bytes: Optional[bytes] = None, user_id: str = "demo-user-id",
+                        receipt_image_url: Optional[str] = None) -> Dict[str, Any]:
+    """Build the input state for one workflow run.
+
+    Pass image_path or image_bytes to process a receipt; with neither, the
+    question is answered by the Tax Q&A node.
+    """
+    return {
         "question": question,
         "image_path": image_path,
+        "image_bytes": image_bytes,
+        "receipt_image_url": receipt_image_url,
         "receipt_data": {},
         "tax_analysis": {},
         "tax_advice": "",
@@ -282,11 +403,251 @@ def run_tax_assistant(question: str, image_path: str = None, user_id: str = "dem
         "status": "",
         "accountant_result": {},
         "user_id": user_id,
+        "rag_prefetch": {},
+        "tax_rules": [],
+        "timings": {},
         "messages": [{"role": "user", "content": question}],
     }
 
-    app = build_workflow()
-    result = app.invoke(initial_state)
+
+def summarize_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the JSON-serializable outcome of a workflow run (no image or messages)."""
+    return {
+        "thread_id": result.get("thread_id"),
+        "trace_id": result.get("trace_id"),
+        "status": result.get("status", ""),
+        "receipt_data": result.get("receipt_data") or {},
+        "tax_analysis": result.get("tax_analysis") or {},
+        "tax_advice": result.get("tax_advice", ""),
+        "needs_human_input": result.get("needs_human_input", False),
+        "missing_fields": result.get("missing_fields") or [],
+        "accountant_result": result.get("accountant_result") or {},
+        "timings": result.get("timings") or {},
+        "total_ms": result.get("total_ms"),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Checkpointed runs
+# ---------------------------------------------------------------------------
+
+def _thread_config(thread_id: str, **config) -> Dict[str, Any]:
+    return {"configurable": {"thread_id": thread_id}, **config}
+
+
+def _finish_thread(thread_id: str, result: Any) -> None:
+    """Keep a thread's checkpoint only while it is waiting for the user."""
+    if not isinstance(result, dict) or result.get("status") != "awaiting_user_input":
+        get_checkpointer().delete_thread(thread_id)
+
+
+def discard_thread(thread_id: str) -> None:
+    """Delete a run's checkpoint, e.g. when its result is rejected and it will not be resumed."""
+    get_checkpointer().delete_thread(thread_id)
+
+
+def _with_run_info(result: Dict[str, Any], thread_id: str, start: float, run_span) -> Dict[str, Any]:
+    """Add the thread and trace ids and wall time to a final state and log node timings."""
+    total_ms = round((time.perf_counter() - start) * 1000, 1)
+    timings = result.get("timings") or {}
+    run_span.set(status=result.get("status"))
+    print(f"Workflow {thread_id}: {total_ms} ms total; "
+          + ", ".join(f"{name} {ms} ms" for name, ms in timings.items()))
+    return {**result, "thread_id": thread_id, "trace_id": run_span.trace_id, "total_ms": total_ms}
+
+
+def run_workflow(state: Dict[str, Any], thread_id: Optional[str] = None) -> Dict[str, Any]:
+    """Run the workflow on one input state.
+
+    Args:
+        state: Initial state from build_initial_state.
+        thread_id: Checkpoint thread id (default: a new random id).
+
+    Returns:
+        The final state, plus 'thread_id' to pass to resume_workflow if
+        the run stopped for human input.
+    """
+    thread_id = thread_id or uuid.uuid4().hex
+    start = time.perf_counter()
+    with span("workflow.run", thread_id=thread_id) as run_span:
+        try:
+            result = get_workflow().invoke(state, _thread_config(thread_id), durability="exit")
+        except Exception:
+            _finish_thread(thread_id, None)
+            raise
+
+        _finish_thread(thread_id, result)
+        return _with_run_info(result, thread_id, start, run_span)
+
+
+def stream_workflow(state: Dict[str, Any], thread_id: Optional[str] = None,
+                    cancelled: Optional[threading.Event] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Run the workflow on one input state, yielding each node's update as it finishes.
+
+    Consume the generator from a single thread: it holds the run's span
+    open between yields.
+
+    Args:
+        state: Initial state from build_initial_state.
+        thread_id: Checkpoint thread id (default: a new random id).
+        cancelled: Once set, no further nodes are started. Closing the
+            generator has the same effect.
+
+    Yields:
+        (node name, state update) pairs, then ("__end__", final state) as
+        returned by run_workflow. A cancelled run yields no final state and
+        its checkpoint is dropped.
+    """
+    thread_id = thread_id or uuid.uuid4().hex
+    app = get_workflow()
+    config = _thread_config(thread_id)
+    start = time.perf_counter()
+    result = None
+
+    with span("workflow.stream", thread_id=thread_id) as run_span:
+        try:
+            for chunk in app.stream(state, config, stream_mode="updates", durability="exit"):
+                for node, update in chunk.items():
+                    yield node, update or {}
+                if cancelled is not None and cancelled.is_set():
+                    print(f"Workflow {thread_id}: cancelled after {', '.join(chunk)}")
+                    run_span.set(cancelled=True)
+                    return
+            result = app.get_state(config).values
+        finally:
+            _finish_thread(thread_id, result)
+
+        yield "__end__", _with_run_info(result, thread_id, start, run_span)
+
+
+def run_workflow_batch(states: List[Dict[str, Any]], max_concurrency: Optional[int] = None) -> List[Any]:
+    """Run the workflow on several input states concurrently.
+
+    Uses the synchronous batch() (worker threads, up to max_concurrency)
+    because SqliteSaver has no async methods; async callers should run
+    it in the threadpool.
+
+    Returns:
+        One final state (with 'thread_id') or exception per input, in order.
+    """
+    thread_ids = [uuid.uuid4().hex for _ in states]
+    # One trace for the whole batch: its runs share the caller's context
+    with span("workflow.batch", runs=len(states)):
+        results = get_workflow().batch(
+            states,
+            [_thread_config(thread_id, max_concurrency=max_concurrency) for thread_id in thread_ids],
+            return_exceptions=True,
+            durability="exit",
+        )
+
+    outputs = []
+    for thread_id, result in zip(thread_ids, results):
+        _finish_thread(thread_id, result)
+        outputs.append(result if isinstance(result, Exception) else {**result, "thread_id": thread_id})
+    return outputs
+
+
+def get_pending_state(thread_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """Return the saved state of a user's run that is waiting for input, or None."""
+    values = get_workflow().get_state(_thread_config(thread_id)).values
+    if not values or values.get("status") != "awaiting_user_input" or values.get("user_id") != user_id:
+        return None
+    return values
+
+
+def resume_workflow(thread_id: str, user_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Continue a run that stopped for human input, without re-running OCR.
+
+    The user's fields are merged into the saved receipt_data as if the
+    inspector had extracted them, so the graph re-validates and continues
+    at the tax expert (or asks again if fields are still missing).
+
+    Args:
+        thread_id: thread_id returned by the run that needs input.
+        user_id: Must match the user the run belongs to.
+        fields: Values for any of EDITABLE_FIELDS; empty values are ignored.
+
+    Returns:
+        The final state (with 'thread_id'), or None if there is no pending
+        run for this thread and user.
+    """
+    values = get_pending_state(thread_id, user_id)
+    if values is None:
+        return None
+
+    # A failed extraction is superseded by what the user typed in
+    receipt_data = {key: value for key, value in values["receipt_data"].items() if key != "error"}
+    receipt_data.update({
+        key: value for key, value in fields.items()
+        if key in EDITABLE_FIELDS and value not in (None, "")
+    })
+
+    app = get_workflow()
+    config = _thread_config(thread_id)
+    start = time.perf_counter()
+    app.update_state(
+        config,
+        {"receipt_data": receipt_data, "needs_human_input": False, "missing_fields": [], "status": ""},
+        as_node="inspect",
+    )
+    print(f"Resuming workflow thread {thread_id} with fields: {', '.join(fields)}")
+
+    with span("workflow.resume", thread_id=thread_id) as run_span:
+        try:
+            result = app.invoke(None, config, durability="exit")
+        except Exception:
+            _finish_thread(thread_id, None)
+            raise
+
+        _finish_thread(thread_id, result)
+        return _with_run_info(result, thread_id, start, run_span)
+
+
+def checkpoint_size(thread_id: str) -> int:
+    """Return the serialized size in bytes of a thread's latest checkpoint (0 if none)."""
+    checkpointer = get_checkpointer()
+    saved = checkpointer.get_tuple(_thread_config(thread_id))
+    if saved is None:
+        return 0
+    return len(checkpointer.serde.dumps_typed(saved.checkpoint)[1])
+
+
+def prune_expired_threads() -> int:
+    """Delete pending threads idle for more than WORKFLOW_CHECKPOINT_TTL seconds.
+
+    Returns:
+        Number of threads deleted.
+    """
+    checkpointer = get_checkpointer()
+    latest: Dict[str, float] = {}
+    for saved in checkpointer.list(None):
+        thread_id = saved.config["configurable"]["thread_id"]
+        ts = datetime.fromisoformat(saved.checkpoint["ts"]).timestamp()
+        latest[thread_id] = max(latest.get(thread_id, 0.0), ts)
+
+    cutoff = time.time() - settings.WORKFLOW_CHECKPOINT_TTL
+    expired = [thread_id for thread_id, ts in latest.items() if ts < cutoff]
+    for thread_id in expired:
+        checkpointer.delete_thread(thread_id)
+
+    if expired:
+        print(f"Pruned {len(expired)} expired workflow threads")
+    return len(expired)
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def run_tax_assistant(question: str, image_path: str = None, user_id: str = "demo-user-id"):
+    """Run the tax assistant workflow."""
+    print("=" * 60)
+    print("TicTaxFlow AI Assistant")
+    print("=" * 60)
+
+    initial_state = build_initial_state(question, image_path=image_path, user_id=user_id)
+
+    result = run_workflow(initial_state)
 
     print("\n" + "=" * 60)
     print("Result:")
@@ -315,6 +676,7 @@ def run_tax_assistant(question: str, image_path: str = None, user_id: str = "dem
     if result.get("status") == "awaiting_user_input":
         print(f"\nStatus: Awaiting user input")
         print(f"Missing fields: {result.get('missing_fields', [])}")
+        print(f"Resume with thread_id: {result['thread_id']}")
     elif result.get("tax_advice"):
         print(f"\nTax Advice:\n{result['tax_advice']}")
 
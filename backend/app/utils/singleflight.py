@@ -0,0 +1,165 @@
+"""Single-flight coalescing of identical concurrent calls.
+
+When several requests make the same expensive call at once (a popular
+chat question, one company-wide invoice uploaded by many employees), only
+the first caller runs it; the others wait and share its result. Nothing
+is cached: once the call returns, the next identical call runs again.
+
+Sync callers block on a threading.Event. Async callers use the .aio
+variant of a decorated function, which runs the call in a worker thread
+and awaits it without blocking the event loop. Both kinds of caller
+coalesce with each other.
+"""
+import asyncio
+import copy
+import functools
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class _Call:
+    """One in-flight call and everyone waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def _join(self, key: str) -> Tuple[_Call, bool]:
+        """Return the call for key and whether this caller leads it."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.executed += 1
+            return call, True
+
+    def _run(self, key: str, call: _Call, fn: Callable, args, kwargs) -> None:
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+                call.done.set()
+                waiters = list(call.async_waiters)
+            for loop, future in waiters:
+                loop.call_soon_threadsafe(_resolve, future)
+
+    def do(self, key: str, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs), or wait for an identical call in flight."""
+        call, leader = self._join(key)
+        if leader:
+            self._run(key, call, fn, args, kwargs)
+            return _outcome(call, shared=False)
+
+        call.done.wait()
+        return _outcome(call, shared=True)
+
+    async def ado(self, key: str, fn: Callable, *args, **kwargs) -> Any:
+        """Async version of do(); fn runs in a worker thread."""
+        call, leader = self._join(key)
+        if leader:
+            await asyncio.to_thread(self._run, key, call, fn, args, kwargs)
+            return _outcome(call, shared=False)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            finished = call.done.is_set()
+            if not finished:
+                call.async_waiters.append((loop, future))
+        if not finished:
+            await future
+        return _outcome(call, shared=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters for this function."""
+        with self._lock:
+            total = self.executed + self.coalesced
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "in_flight": len(self._calls),
+                "coalesced_ratio": round(self.coalesced / total, 4) if total else 0.0,
+            }
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _outcome(call: _Call, shared: bool) -> Any:
+    """Return a call's result, copied for waiters so no caller can mutate another's."""
+    if call.error is not None:
+        raise call.error
+    return copy.deepcopy(call.result) if shared else call.result
+
+
+_registry: Dict[str, SingleFlight] = {}
+
+
+def hash_key(value: Any) -> str:
+    """Hash bytes, text or JSON-serializable data into a coalescing key."""
+    if isinstance(value, (bytes, bytearray)):
+        data = bytes(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+    else:
+        data = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def single_flight(name: str, key: Callable[..., Any]):
+    """Decorate a function so identical concurrent calls share one execution.
+
+    Args:
+        name: Name the counters are exported under.
+        key: Builds the coalescing key from the call's arguments; its
+            return value is hashed with hash_key.
+
+    The decorated function keeps its sync signature and gains an async
+    variant as `.aio(*args, **kwargs)`.
+    """
+    flight = _registry.setdefault(name, SingleFlight(name))
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return flight.do(hash_key(key(*args, **kwargs)), fn, *args, **kwargs)
+
+        async def aio(*args, **kwargs):
+            return await flight.ado(hash_key(key(*args, **kwargs)), fn, *args, **kwargs)
+
+        wrapper.aio = aio
+        wrapper.single_flight = flight
+        return wrapper
+
+    return decorator
+
+
+def get_single_flight_stats() -> Dict[str, Dict[str, Any]]:
+    """Return the counters of every single-flight function."""
+    return {name: flight.stats() for name, flight in _registry.items()}
@@ -0,0 +1,58 @@
+"""Thai-aware text helpers shared by the indexer and retrieval."""
+import re
+from typing import List
+
+from pythainlp.tokenize import word_tokenize
+
+
+THAI_CHAR_PATTERN = re.compile(r"[฀-๿]")
+WORD_PATTERN = re.compile(r"[\w฀-๿]")
+EDGE_PUNCTUATION_PATTERN = re.compile(r"^[^\w฀-๿]+|[^\w฀-๿]+$")
+
+
+def is_thai_char(char: str) -> bool:
+    """Return True if the character is in the Thai Unicode block."""
+    return bool(char) and bool(THAI_CHAR_PATTERN.match(char))
+
+
+def join_lines(lines: List[str]) -> str:
+    """Join wrapped PDF lines back into a paragraph.
+
+    Thai has no spaces between words, so a line break between two Thai
+    characters is a soft wrap and is joined without a space.
+    """
+    text = ""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if text and not (is_thai_char(text[-1]) and is_thai_char(line[0])):
+            text += " "
+        text += line
+    return text
+
+
+def segment_words(text: str) -> List[str]:
+    """Split text into word segments, keeping whitespace.
+
+    Joining the returned segments reproduces the original text, so callers
+    can cut on word boundaries without losing characters.
+    """
+    return word_tokenize(text, engine="newmm", keep_whitespace=True)
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokenize text into lowercase search terms (Thai and English).
+
+    Hyphenated terms such as "e-donation" are kept whole and also split
+    into their parts, so both spellings match.
+    """
+    tokens = []
+    for token in word_tokenize(text, engine="newmm", keep_whitespace=False):
+        token = EDGE_PUNCTUATION_PATTERN.sub("", token.strip().lower())
+        if not token or not WORD_PATTERN.search(token):
+            continue
+        tokens.append(token)
+        if "-" in token:
+            tokens.extend(part for part in token.split("-") if part)
+    return tokens
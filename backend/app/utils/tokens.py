@@ -0,0 +1,32 @@
+"""Local token estimation for prompt sizing."""
+import math
+import re
+
+
+THAI_RUN_PATTERN = re.compile(r"[฀-๿]+")
+LATIN_RUN_PATTERN = re.compile(r"[A-Za-z0-9]+")
+SYMBOL_PATTERN = re.compile(r"[^\sA-Za-z0-9฀-๿]")
+
+# Average characters per token for Gemini's SentencePiece vocabulary.
+# Thai text is tokenized much more finely than English.
+LATIN_CHARS_PER_TOKEN = 4.0
+THAI_CHARS_PER_TOKEN = 2.5
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the number of model tokens in a piece of text.
+
+    This is a fast local approximation (no API call) that is good enough
+    for budgeting prompts and comparing prompt sizes between settings.
+    """
+    if not text:
+        return 0
+
+    thai_chars = sum(len(run) for run in THAI_RUN_PATTERN.findall(text))
+    latin_runs = LATIN_RUN_PATTERN.findall(text)
+    symbols = len(SYMBOL_PATTERN.findall(text))
+
+    latin_tokens = sum(math.ceil(len(run) / LATIN_CHARS_PER_TOKEN) for run in latin_runs)
+    thai_tokens = math.ceil(thai_chars / THAI_CHARS_PER_TOKEN)
+
+    return latin_tokens + thai_tokens + symbols
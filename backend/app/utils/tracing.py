@@ -0,0 +1,323 @@
+"""Span tracing for workflow nodes and external calls.
+
+A span times one unit of work (a workflow node, a Gemini call, a vector
+search, a Supabase request) and carries attributes such as the model,
+token counts, chunk count or row count. Spans opened while another span
+is active become its children and share its trace id, so one receipt's
+OCR, retrieval, LLM and insert time can be read from a single trace.
+
+Finished spans are kept in a bounded in-memory buffer, which backs
+get_trace and the per-stage p50/p95/p99 in get_trace_summary. Set
+TRACE_FILE to also append every span to a file in the OTLP JSON format
+(one ExportTraceServiceRequest per line, as written by the OpenTelemetry
+collector's file exporter).
+
+The current span lives in a context variable: it follows LangGraph nodes
+into their worker threads, but work done by another thread on a caller's
+behalf (a batched vector search, a coalesced single-flight call) is
+recorded in the trace of the thread that ran it.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import httpx
+
+from app.core.config import settings
+
+
+LATENCY_WINDOW = 1000  # recent durations kept per span name for percentiles
+SERVICE_NAME = "tictaxflow-api"
+OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "attributes",
+                 "start_ns", "end_ns", "error")
+
+    def __init__(self, name: str, kind: str = "internal", parent: Optional["Span"] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes) -> None:
+        """Add attributes; None values are skipped."""
+        for key, value in attributes.items():
+            if value is not None:
+                self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        """Finish the span and hand it to the collector."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        collector.record(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "duration_ms": round(self.duration_ms, 2),
+            "attributes": dict(self.attributes),
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is disabled."""
+
+    trace_id = None
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(span: Span) -> Dict[str, Any]:
+    """Encode a finished span as an OTLP JSON ExportTraceServiceRequest."""
+    otlp_span = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": OTLP_KINDS.get(span.kind, 1),
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+    if span.parent_id:
+        otlp_span["parentSpanId"] = span.parent_id
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "app.utils.tracing"}, "spans": [otlp_span]}],
+        }]
+    }
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class SpanCollector:
+    """Keeps recent spans and per-name durations, and writes the OTLP file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans: deque = deque(maxlen=settings.TRACE_BUFFER_SPANS)
+        self._durations: Dict[str, deque] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, span: Span) -> None:
+        line = json.dumps(to_otlp(span), ensure_ascii=False) if settings.TRACE_FILE else None
+        with self._lock:
+            self._spans.append(span)
+            self._durations.setdefault(span.name, deque(maxlen=LATENCY_WINDOW)).append(span.duration_ms)
+            counts = self._counts.setdefault(span.name, {"count": 0, "errors": 0})
+            counts["count"] += 1
+            counts["errors"] += 1 if span.error else 0
+            if line is not None:
+                try:
+                    with open(settings.TRACE_FILE, "a", encoding="utf-8") as f:
+                        f.write(line + "\n")
+                except OSError as e:
+                    print(f"Error writing span to {settings.TRACE_FILE}: {e}")
+
+    def get_trace(self, trace_id: str) -> List[Dict[str, Any]]:
+        """Return the buffered spans of one trace, in start order."""
+        with self._lock:
+            spans = [span for span in self._spans if span.trace_id == trace_id]
+        return [span.to_dict() for span in sorted(spans, key=lambda span: span.start_ns)]
+
+    def recent_traces(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Return the most recent root spans (one per finished trace)."""
+        with self._lock:
+            roots = [span for span in self._spans if span.parent_id is None]
+        return [span.to_dict() for span in roots[-limit:][::-1]]
+
+    def summary(self) -> Dict[str, Any]:
+        """Return count, errors and p50/p95/p99/max duration per span name."""
+        with self._lock:
+            durations = {name: list(values) for name, values in self._durations.items()}
+            counts = {name: dict(values) for name, values in self._counts.items()}
+
+        stages = {}
+        for name in sorted(durations):
+            values = durations[name]
+            stages[name] = {
+                **counts[name],
+                "p50_ms": round(_percentile(values, 0.50), 2),
+                "p95_ms": round(_percentile(values, 0.95), 2),
+                "p99_ms": round(_percentile(values, 0.99), 2),
+                "max_ms": round(max(values), 2),
+            }
+        return {
+            "enabled": settings.TRACING_ENABLED,
+            "trace_file": settings.TRACE_FILE,
+            "window": LATENCY_WINDOW,
+            "stages": stages,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans.clear()
+            self._durations.clear()
+            self._counts.clear()
+
+
+collector = SpanCollector()
+
+
+def start_span(name: str, kind: str = "internal", **attributes):
+    """Start a child of the current span without making it current.
+
+    For work that outlives the caller's context, such as a streamed
+    response; the caller must call .end() on the returned span.
+    """
+    if not settings.TRACING_ENABLED:
+        return NOOP_SPAN
+    return Span(name, kind, _current.get(), attributes)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes) -> Iterator[Span]:
+    """Time the enclosed block as a span, child of the current span if any.
+
+    Usage:
+        with span("gemini.generate", kind="client", model=model) as s:
+            response = ...
+            s.set(prompt_tokens=...)
+
+    Exceptions are recorded on the span and re-raised.
+    """
+    if not settings.TRACING_ENABLED:
+        yield NOOP_SPAN
+        return
+
+    current = Span(name, kind, _current.get(), attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def traced(name: str, kind: str = "internal") -> Callable:
+    """Decorate a function so every call is recorded as a span."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_trace_id() -> Optional[str]:
+    """Return the trace id of the active span, or None outside any span."""
+    current = _current.get()
+    return current.trace_id if current else None
+
+
+def _content_range_rows(header: Optional[str]) -> Optional[int]:
+    """Row count from a PostgREST Content-Range header such as '0-24/*' or '*/0'."""
+    if not header:
+        return None
+    rows = header.split("/")[0]
+    if rows == "*":
+        total = header.split("/")[-1]
+        return 0 if total == "0" else None
+    start, _, end = rows.partition("-")
+    try:
+        return int(end) - int(start) + 1
+    except ValueError:
+        return None
+
+
+class TracingTransport(httpx.BaseTransport):
+    """httpx transport that records each Supabase REST request as a span."""
+
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None):
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        table = path.split("/rest/v1/", 1)[1] if "/rest/v1/" in path else None
+        with span("supabase.request", kind="client", method=request.method,
+                  table=table, path=None if table else path) as s:
+            response = self._transport.handle_request(request)
+            s.set(status_code=response.status_code,
+                  rows=_content_range_rows(response.headers.get("content-range")))
+            return response
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+def traced_http_client(timeout: float = 120) -> httpx.Client:
+    """Return an httpx client for Supabase whose requests are traced."""
+    return httpx.Client(transport=TracingTransport(), timeout=timeout)
+
+
+def get_trace_summary() -> Dict[str, Any]:
+    """Return per-stage latency percentiles of recent spans."""
+    return collector.summary()
+
+
+def get_trace(trace_id: str) -> List[Dict[str, Any]]:
+    """Return the buffered spans of one trace."""
+    return collector.get_trace(trace_id)
+
+
+def get_recent_traces(limit: int = 20) -> List[Dict[str, Any]]:
+    """Return the root spans of the most recent traces."""
+    return collector.recent_traces(limit)
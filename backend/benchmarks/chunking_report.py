@@ -0,0 +1,123 @@
+"""Compare the legacy and structured chunkers on the bundled tax corpus.
+
+Builds a throwaway Chroma collection per chunker and reports chunk count,
+on-disk index size and the prompt tokens `build_tax_expert_prompt` would
+send for a set of typical queries.
+
+Usage (from the backend directory):
+    python -m benchmarks.chunking_report [--n-results 3] [--output report.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+
+import chromadb
+
+from app.agents.tax_expert import build_tax_expert_prompt
+from app.services.document_indexer import load_pdf_documents, build_chunks
+from app.utils.tokens import count_tokens
+
+
+QUERIES = [
+    "หักลดหย่อน เบี้ยประกันสุขภาพ",
+    "ค่าลดหย่อนภาษี tax deduction categories",
+    "Easy E-Receipt ใบกำกับภาษีอิเล็กทรอนิกส์ e-Tax Invoice ซื้อสินค้า",
+    "เงินบริจาค donation หักลดหย่อน การศึกษา กีฬา e-Donation",
+    "กองทุน SSF RMF Thai ESG หักลดหย่อน",
+    "ประกันสังคม เงินสมทบ หักลดหย่อน social security",
+]
+
+SAMPLE_RECEIPT = {
+    "date": "2025-02-01",
+    "amount": 5000,
+    "merchant_name": "Bangkok Hospital",
+}
+
+
+def directory_size(path: str) -> int:
+    """Return the total size in bytes of all files under path."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def evaluate_chunker(documents, chunker: str, n_results: int) -> dict:
+    """Index the corpus with one chunker and measure size and prompt tokens."""
+    chunks = build_chunks(documents, chunker=chunker)
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        client = chromadb.PersistentClient(path=index_dir)
+        collection = client.create_collection(name="chunking_report")
+
+        for start in range(0, len(chunks), 100):
+            batch = chunks[start:start + 100]
+            collection.add(
+                ids=[chunk["id"] for chunk in batch],
+                documents=[chunk["text"] for chunk in batch],
+                metadatas=[chunk["metadata"] for chunk in batch],
+            )
+
+        prompt_tokens = []
+        context_tokens = []
+        for query in QUERIES:
+            results = collection.query(query_texts=[query], n_results=n_results)
+            retrieved = results["documents"][0] if results.get("documents") else []
+            context = "\n\n".join(retrieved)
+            prompt_tokens.append(count_tokens(build_tax_expert_prompt(SAMPLE_RECEIPT, context)))
+            context_tokens.append(count_tokens(context))
+
+        index_bytes = directory_size(index_dir)
+
+    chunk_lengths = [len(chunk["text"]) for chunk in chunks]
+
+    return {
+        "chunker": chunker,
+        "n_results": n_results,
+        "chunk_count": len(chunks),
+        "avg_chunk_chars": round(statistics.mean(chunk_lengths), 1) if chunk_lengths else 0,
+        "index_bytes": index_bytes,
+        "avg_context_tokens": round(statistics.mean(context_tokens), 1),
+        "avg_prompt_tokens": round(statistics.mean(prompt_tokens), 1),
+        "prompt_tokens_per_query": dict(zip(QUERIES, prompt_tokens)),
+    }
+
+
+def main():
+    """Run the chunker comparison and print a JSON report."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-results", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    documents = load_pdf_documents()
+    if not documents:
+        print("No documents loaded. Exiting.")
+        return
+
+    report = {
+        "documents": len(documents),
+        "results": [
+            evaluate_chunker(documents, chunker, args.n_results)
+            for chunker in ("legacy", "structured")
+        ],
+    }
+
+    for result in report["results"]:
+        print(f"{result['chunker']:>10}: {result['chunk_count']} chunks, "
+              f"{result['index_bytes'] / 1024:.0f} KiB index, "
+              f"{result['avg_prompt_tokens']:.0f} prompt tokens/query")
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
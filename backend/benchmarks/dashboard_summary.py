@@ -0,0 +1,164 @@
+"""Compare the dashboard summary queries before and after aggregate pushdown.
+
+Runs against a real Postgres through Supabase, e.g. the local stack from
+`supabase start` (SUPABASE_URL=http://localhost:54321 with the service
+role key) with app/database/sql/dashboard_summary.sql applied. Seeds
+--transactions rows for --user-id (an existing auth user), then times:
+
+- full: the old path, downloading every transaction (11 columns) plus
+  the verified rows again, and adding them up in Python
+- pushdown: the dashboard_summary function plus the 5 most recent rows
+- counts: the fallback used when the function is missing (count=exact
+  head requests and the verified amounts)
+
+and checks that all three return the same totals. Supabase caps a
+select at 1000 rows by default (max-rows), so above that the full scan
+also undercounts. The seeded rows are deleted afterwards.
+
+Usage (from the backend directory):
+    python -m benchmarks.dashboard_summary --user-id <uuid>
+        [--transactions 2000] [--runs 20] [--output report.json]
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+from app.database.database import supabase
+from app.services import transaction_stats
+from app.services.tax_rule_cache import tax_rule_cache
+from benchmarks.retrieval_eval import git_commit, percentile
+
+
+SEED_MERCHANT = "dashboard-benchmark"
+SEED_BATCH = 500
+SUMMARY_COLUMNS = ("id, merchant_name, transaction_date, total_amount, deductible_amount, status, "
+                   "create_at, receipt_image_url, rule_id, user_id, ai_reasoning")
+RECENT_COLUMNS = ("id, merchant_name, transaction_date, total_amount, deductible_amount, status, "
+                  "create_at, receipt_image_url, rule_id, ai_reasoning")
+
+
+def seed(user_id: str, transactions: int, rng: random.Random) -> None:
+    """Insert synthetic transactions for user_id."""
+    rules = tax_rule_cache.get_rules() or []
+    if not rules:
+        raise SystemExit("No active tax rules to attach transactions to")
+    rows = []
+    for i in range(transactions):
+        amount = round(rng.uniform(100, 50000), 2)
+        rows.append({
+            "user_id": user_id,
+            "rule_id": rng.choice(rules)["id"],
+            "merchant_name": SEED_MERCHANT,
+            "merchant_tax_id": f"{i:013d}",
+            "transaction_date": f"{rng.choice([2025, 2026])}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "total_amount": amount,
+            "deductible_amount": round(amount * rng.random(), 2),
+            "status": rng.choice(transaction_stats.STATUSES),
+            "ai_reasoning": "Synthetic transaction for benchmarks.dashboard_summary",
+        })
+    for start in range(0, len(rows), SEED_BATCH):
+        supabase.table("transactions").insert(rows[start:start + SEED_BATCH]).execute()
+
+
+def full_scan(user_id: str) -> Dict[str, Any]:
+    """The dashboard summary queries before aggregate pushdown."""
+    all_rows = supabase.table("transactions").select(SUMMARY_COLUMNS).eq(
+        "user_id", user_id
+    ).order("create_at", desc=True).execute().data or []
+    verified = supabase.table("transactions").select("rule_id, deductible_amount").eq(
+        "user_id", user_id
+    ).eq("status", "verified").execute().data or []
+
+    status_breakdown = {status: 0 for status in transaction_stats.STATUSES}
+    for row in all_rows:
+        if row.get("status") in status_breakdown:
+            status_breakdown[row["status"]] += 1
+    return {
+        "total_deductible": round(sum(float(row.get("deductible_amount") or 0) for row in verified), 2),
+        "total_transactions": len(all_rows),
+        "status_breakdown": status_breakdown,
+        "bytes": len(json.dumps(all_rows)) + len(json.dumps(verified)),
+    }
+
+
+def pushdown(user_id: str) -> Dict[str, Any]:
+    """get_transaction_totals plus the recent transactions, as the dashboard does now."""
+    totals = transaction_stats.get_transaction_totals(user_id)
+    recent = supabase.table("transactions").select(RECENT_COLUMNS).eq(
+        "user_id", user_id
+    ).order("create_at", desc=True).limit(5).execute().data or []
+    return {
+        "total_deductible": round(totals["total_deductible"], 2),
+        "total_transactions": totals["total_transactions"],
+        "status_breakdown": {status: totals["status_breakdown"][status] for status in transaction_stats.STATUSES},
+        "source": totals["source"],
+        "bytes": len(json.dumps(totals, default=str)) + len(json.dumps(recent)),
+    }
+
+
+def time_runs(fn: Callable[[str], Dict[str, Any]], user_id: str, runs: int) -> Dict[str, Any]:
+    """Run fn runs times and report latency percentiles and the last result."""
+    latencies: List[float] = []
+    result: Dict[str, Any] = {}
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn(user_id)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return {
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "result": result,
+    }
+
+
+def main():
+    """Seed transactions and compare the full-scan and pushed-down summaries."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user-id", required=True, help="Existing user to seed transactions for")
+    parser.add_argument("--transactions", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    seed(args.user_id, args.transactions, random.Random(args.seed))
+    try:
+        results = {"full": time_runs(full_scan, args.user_id, args.runs)}
+
+        transaction_stats._rpc_missing_until = 0.0
+        results["pushdown"] = time_runs(pushdown, args.user_id, args.runs)
+        if results["pushdown"]["result"]["source"] != "rpc":
+            print("Warning: dashboard_summary is not installed or not granted to this key "
+                  "(see SUPABASE_SERVICE_ROLE_KEY); 'pushdown' measured the count fallback")
+
+        transaction_stats._rpc_missing_until = float("inf")
+        results["counts"] = time_runs(pushdown, args.user_id, args.runs)
+    finally:
+        supabase.table("transactions").delete().eq("user_id", args.user_id).eq(
+            "merchant_name", SEED_MERCHANT
+        ).execute()
+        transaction_stats._rpc_missing_until = 0.0
+
+    expected = {key: results["full"]["result"][key]
+                for key in ("total_deductible", "total_transactions", "status_breakdown")}
+    for mode, result in results.items():
+        matches = (abs(result["result"]["total_deductible"] - expected["total_deductible"]) < 0.01
+                   and all(result["result"][key] == expected[key]
+                           for key in ("total_transactions", "status_breakdown")))
+        print(f"{mode:>8}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+              f"{result['result']['bytes']:,} bytes, totals {'match' if matches else 'DIFFER'}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "transactions": args.transactions,
+                "runs": args.runs,
+                "results": results,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Time the vectorized whole-year deduction recompute.
+
+Generates synthetic transactions for one tax year (no database needed),
+recomputes every deductible amount with deduction_recompute and checks
+the result against replaying the year transaction by transaction with
+deduction_rules.evaluate.
+
+Usage (from the backend directory):
+    python -m benchmarks.deduction_recompute [--transactions 100000]
+        [--users 2000] [--check 5000] [--seed 0]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from app.services import deduction_recompute, deduction_rules
+from benchmarks.deduction_rules import SAMPLE_RULES
+
+
+def generate(transactions: int, users: int, rng: random.Random):
+    """Return (rows in date order, incomes) for synthetic users."""
+    rows = []
+    for i in range(transactions):
+        rule_id = rng.randrange(len(SAMPLE_RULES))
+        rows.append({
+            "id": f"t{i}",
+            "user_id": f"u{rng.randrange(users)}",
+            "rule_id": str(rule_id),
+            "transaction_date": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "total_amount": round(rng.uniform(100, 60000), 2),
+            "deductible_amount": 0,
+        })
+    rows.sort(key=lambda row: row["transaction_date"])
+    incomes = {f"u{u}": rng.choice([None, rng.uniform(200000, 3000000)]) for u in range(users)}
+    return rows, incomes
+
+
+def replay(rows, table, incomes):
+    """Reference result: evaluate each transaction with running totals."""
+    claimed, group_claimed, result = {}, {}, []
+    for row in rows:
+        rule = table.get_by_id(row["rule_id"])
+        category_key = (row["user_id"], rule.category)
+        group_key = (row["user_id"], rule.group)
+        evaluated = deduction_rules.evaluate(
+            rule, row["total_amount"], row["transaction_date"],
+            income=incomes.get(row["user_id"]),
+            claimed=claimed.get(category_key, 0.0),
+            group_claimed=group_claimed.get(group_key, 0.0) if rule.group else 0.0,
+        )
+        claimed[category_key] = claimed.get(category_key, 0.0) + evaluated["amount"]
+        if rule.group:
+            group_claimed[group_key] = group_claimed.get(group_key, 0.0) + evaluated["amount"]
+        result.append(evaluated["amount"])
+    return np.array(result)
+
+
+def main():
+    """Recompute synthetic transactions and compare with a per-row replay."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--check", type=int, default=5000,
+                        help="Transactions replayed one by one for the correctness check")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    table = deduction_rules.compile_rules([
+        {"id": str(i), "category_name": category, "max_limit": max_limit,
+         "tax_year": 2026, "is_active": True}
+        for i, (category, max_limit) in enumerate(SAMPLE_RULES)
+    ])
+    rows, incomes = generate(args.transactions, args.users, rng)
+
+    t0 = time.perf_counter()
+    columns = deduction_recompute.to_columns(rows, table, incomes)
+    columns_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    deductible = deduction_recompute.compute_deductions(columns)
+    compute_ms = (time.perf_counter() - t0) * 1000
+
+    print(f"{len(rows)} transactions, {args.users} users")
+    print(f"  columns: {columns_ms:.1f} ms")
+    print(f"  compute: {compute_ms:.1f} ms")
+    print(f"  total:   {columns_ms + compute_ms:.1f} ms")
+
+    checked = rows[:args.check]
+    t0 = time.perf_counter()
+    expected = replay(checked, table, incomes)
+    replay_ms = (time.perf_counter() - t0) * 1000
+    mismatches = int(np.sum(np.abs(deductible[:len(checked)] - np.round(expected, 2)) > 0.01))
+    print(f"Replay of the first {len(checked)} transactions: {replay_ms:.1f} ms, {mismatches} mismatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Time deduction rule evaluation.
+
+Compiles a set of tax_rules rows like the seeded table (no database
+needed) and evaluates random transactions against them, reporting the
+compile time and the per-call latency of deduction_rules.evaluate.
+
+Usage (from the backend directory):
+    python -m benchmarks.deduction_rules [--calls 100000] [--seed 0]
+"""
+import argparse
+import random
+import time
+
+from app.services import deduction_rules
+from benchmarks.retrieval_eval import percentile
+
+
+# (category, max_limit) as in the tax_rules table
+SAMPLE_RULES = [
+    ("Life Insurance", 100000), ("Health Insurance", 25000), ("Parent Health Insurance", 15000),
+    ("Pension Insurance", 200000), ("Social Security", 9000), ("Provident Fund", 10000),
+    ("SSF", 200000), ("RMF", 500000), ("Thai ESG", 300000), ("Home Loan Interest", 100000),
+    ("Donation (General)", 0), ("Donation (Education/Sports)", 0), ("Easy E-Receipt", 50000),
+]
+
+
+def main():
+    """Compile the sample rules and time evaluate() on random transactions."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000, help="Transactions to evaluate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = [
+        {"id": str(i), "category_name": category, "max_limit": max_limit,
+         "tax_year": 2026, "is_active": True}
+        for i, (category, max_limit) in enumerate(SAMPLE_RULES)
+    ]
+    t0 = time.perf_counter()
+    table = deduction_rules.compile_rules(rows)
+    compile_ms = (time.perf_counter() - t0) * 1000
+
+    rng = random.Random(args.seed)
+    cases = [
+        (rng.choice(SAMPLE_RULES)[0], rng.uniform(100, 150000),
+         f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+         rng.choice([None, rng.uniform(200000, 3000000)]),
+         rng.uniform(0, 100000))
+        for _ in range(args.calls)
+    ]
+
+    latencies = []
+    for category, amount, transaction_date, income, claimed in cases:
+        t0 = time.perf_counter()
+        deduction_rules.evaluate(table.get(category, 2026), amount, transaction_date,
+                                 income=income, claimed=claimed, group_claimed=claimed)
+        latencies.append((time.perf_counter() - t0) * 1e6)
+
+    print(f"Compiled {len(rows)} rules in {compile_ms:.3f} ms")
+    print(f"evaluate: {len(latencies)} calls, mean {sum(latencies) / len(latencies):.2f} us, "
+          f"p50 {percentile(latencies, 0.50):.2f} us, p99 {percentile(latencies, 0.99):.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Local fake of the Gemini REST API for offline testing and benchmarks.
+
+Implements just enough of generateContent, streamGenerateContent and
+cachedContents for the backend's text calls: it answers every prompt with
+a fixed reply after a configurable delay (streamed replies arrive in
+chunks), and reports usage metadata (prompt and cached token counts,
+estimated with app.utils.tokens) the way Gemini does. Cached contents
+below --min-cache-tokens are rejected, like the real API.
+
+Usage (from the backend directory):
+    python -m benchmarks.fake_gemini [--port 8765] [--latency-ms 300] [--chunk-ms 40]
+    GEMINI_BASE_URL=http://127.0.0.1:8765 uvicorn main:app
+"""
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.utils.tokens import count_tokens
+
+
+DEFAULT_REPLY = '{"is_deductible": true, "category": "Health Insurance", "reasoning": "Fake Gemini reply."}'
+TTL_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)s$")
+
+
+def contents_text(contents) -> str:
+    """Concatenate the text parts of a Gemini contents list."""
+    texts = []
+    for content in contents or []:
+        for part in content.get("parts", []):
+            texts.append(part.get("text", ""))
+    return "\n".join(texts)
+
+
+class FakeGemini:
+    """In-memory state shared by all request handlers."""
+
+    def __init__(self, reply: str, latency_ms: float, min_cache_tokens: int,
+                 chunk_ms: float = 40, stream_chunks: int = 8):
+        self.reply = reply
+        self.latency_ms = latency_ms
+        self.chunk_ms = chunk_ms
+        self.stream_chunks = stream_chunks
+        self.min_cache_tokens = min_cache_tokens
+        self.caches = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.stats = {"generate_calls": 0, "cached_calls": 0, "caches_created": 0}
+
+    def create_cache(self, body: dict):
+        tokens = count_tokens(contents_text(body.get("contents")))
+        if tokens < self.min_cache_tokens:
+            return 400, {"error": {
+                "code": 400,
+                "message": f"Cached content is too small. total_token_count={tokens}, "
+                           f"min_total_token_count={self.min_cache_tokens}",
+                "status": "INVALID_ARGUMENT",
+            }}
+
+        ttl = float(TTL_PATTERN.match(body.get("ttl", "3600s")).group(1))
+        expire_time = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        with self.lock:
+            name = f"cachedContents/fake-{next(self.ids)}"
+            self.caches[name] = {"tokens": tokens, "expires_at": time.time() + ttl}
+            self.stats["caches_created"] += 1
+
+        return 200, {
+            "name": name,
+            "model": body.get("model"),
+            "displayName": body.get("displayName", ""),
+            "expireTime": expire_time.isoformat().replace("+00:00", "Z"),
+            "usageMetadata": {"totalTokenCount": tokens},
+        }
+
+    def generate(self, body: dict, stream: bool = False):
+        """Answer a generateContent call.
+
+        Returns (status, payload), or (status, list of chunk payloads) when
+        stream is True.
+        """
+        cached_tokens = 0
+        cache_name = body.get("cachedContent")
+        if cache_name:
+            with self.lock:
+                cache = self.caches.get(cache_name)
+            if cache is None or cache["expires_at"] < time.time():
+                return 404, {"error": {
+                    "code": 404,
+                    "message": f"CachedContent not found (or expired): {cache_name}",
+                    "status": "NOT_FOUND",
+                }}
+            cached_tokens = cache["tokens"]
+
+        prompt_tokens = count_tokens(contents_text(body.get("contents"))) + cached_tokens
+        if not stream:
+            time.sleep(self.latency_ms / 1000)
+
+        with self.lock:
+            self.stats["generate_calls"] += 1
+            self.stats["cached_calls"] += 1 if cached_tokens else 0
+
+        usage = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": count_tokens(self.reply),
+            "totalTokenCount": prompt_tokens + count_tokens(self.reply),
+        }
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+
+        if not stream:
+            return 200, self._response(self.reply, usage, finished=True)
+
+        size = max(len(self.reply) // self.stream_chunks, 1)
+        pieces = [self.reply[i:i + size] for i in range(0, len(self.reply), size)]
+        return 200, [
+            self._response(piece, usage, finished=i == len(pieces) - 1)
+            for i, piece in enumerate(pieces)
+        ]
+
+    @staticmethod
+    def _response(text: str, usage: dict, finished: bool) -> dict:
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        if finished:
+            candidate["finishReason"] = "STOP"
+        return {"candidates": [candidate], "usageMetadata": usage, "modelVersion": "fake-gemini"}
+
+
+def make_handler(fake: FakeGemini):
+    """Build a request handler class bound to one FakeGemini."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, status: int, payload) -> None:
+            if status != 200:
+                self._send(status, payload)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            time.sleep(fake.latency_ms / 1000)
+            for i, chunk in enumerate(payload):
+                if i:
+                    time.sleep(fake.chunk_ms / 1000)
+                self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode("utf-8"))
+                self.wfile.flush()
+            self.close_connection = True
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            path = self.path.split("?")[0]
+
+            if path.endswith(":generateContent"):
+                self._send(*fake.generate(body))
+            elif path.endswith(":streamGenerateContent"):
+                self._stream(*fake.generate(body, stream=True))
+            elif path.endswith("/cachedContents"):
+                self._send(*fake.create_cache(body))
+            else:
+                self._send(404, {"error": {"code": 404, "message": f"Unknown path {path}"}})
+
+        def do_DELETE(self):
+            name = self.path.split("?")[0].split("/v1beta/", 1)[-1]
+            with fake.lock:
+                fake.caches.pop(name, None)
+            self._send(200, {})
+
+        def do_GET(self):
+            if self.path.startswith("/stats"):
+                with fake.lock:
+                    self._send(200, dict(fake.stats))
+            else:
+                self._send(404, {"error": {"code": 404, "message": "Not found"}})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    """Serve the fake Gemini API until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300,
+                        help="Delay per generateContent call, or before the first streamed chunk")
+    parser.add_argument("--chunk-ms", type=float, default=40, help="Delay between streamed chunks")
+    parser.add_argument("--min-cache-tokens", type=int, default=1024,
+                        help="Smallest cacheable content (Gemini 2.5 Flash: 1024)")
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="Text returned for every prompt")
+    args = parser.parse_args()
+
+    fake = FakeGemini(args.reply, args.latency_ms, args.min_cache_tokens, args.chunk_ms)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"Fake Gemini listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
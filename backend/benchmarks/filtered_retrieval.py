@@ -0,0 +1,126 @@
+"""Benchmark metadata-filtered retrieval against unfiltered retrieval.
+
+Runs the same receipt-style queries with and without tax year / category
+filters and reports query latency and the resulting context size. Also
+checks that filtering keeps the documents a receipt's year is covered by
+(e.g. the Easy E-Receipt 2.0 Q&A for 2025) and exits with status 1 if not.
+
+Usage (from the backend directory):
+    python -m benchmarks.filtered_retrieval [--repeat 20] [--output report.json]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app.services import retrieval
+from app.services.tax_categories import detect_category
+from app.utils.tokens import count_tokens
+
+
+RECEIPTS = [
+    {"date": "2025-02-01", "merchant_name": "Central Department Store"},
+    {"date": "2025-06-12", "merchant_name": "Muang Thai Life Insurance"},
+    {"date": "2025-09-30", "merchant_name": "มูลนิธิรามาธิบดี"},
+    {"date": "2025-12-20", "merchant_name": "KAsset SSF Fund"},
+    {"date": "2025-03-05", "merchant_name": "สำนักงานประกันสังคม"},
+]
+
+# Filtered queries that must return a document: (receipt, query, source prefix)
+COVERAGE_CHECKS = [
+    ({"date": "2025-02-01", "merchant_name": "Easy E-Receipt"},
+     "หักลดหย่อน Easy E-Receipt ใบกำกับภาษีอิเล็กทรอนิกส์", "Q_A_Easy_E-Receipt"),
+]
+
+
+def receipt_where(receipt: dict) -> dict:
+    """The metadata filter the workflow applies for a receipt."""
+    return retrieval.build_where(
+        tax_year=retrieval.tax_year_from_date(receipt["date"]),
+        category=detect_category(receipt["merchant_name"], default=None),
+    )
+
+
+def check_coverage(n_results: int) -> list:
+    """Run COVERAGE_CHECKS and return the ones whose document was filtered out."""
+    failures = []
+    for receipt, query, source in COVERAGE_CHECKS:
+        where = receipt_where(receipt)
+        hits = retrieval.search(query, n_results=n_results, where=where)
+        sources = [hit["metadata"].get("source", "") for hit in hits]
+        if not any(hit_source.startswith(source) for hit_source in sources):
+            failures.append({"receipt": receipt, "where": where, "expected": source, "sources": sources})
+    return failures
+
+
+def run_case(receipt: dict, filtered: bool, repeat: int, n_results: int) -> dict:
+    """Time one receipt query and measure its context size."""
+    query = f"หักลดหย่อน {receipt['merchant_name']}"
+    where = receipt_where(receipt) if filtered else None
+
+    latencies = []
+    hits = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        hits = retrieval.search(query, n_results=n_results, where=where)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    context = "\n\n".join(hit["text"] for hit in hits)
+    return {
+        "latency_ms": latencies,
+        "context_tokens": count_tokens(context),
+        "sources": sorted({hit["metadata"].get("source", "") for hit in hits}),
+        "tax_years": sorted({hit["metadata"].get("tax_year", 0) for hit in hits}),
+    }
+
+
+def summarize(cases: list) -> dict:
+    """Aggregate latency and context size across cases."""
+    latencies = sorted(ms for case in cases for ms in case["latency_ms"])
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        "avg_context_tokens": round(statistics.mean(case["context_tokens"] for case in cases), 1),
+    }
+
+
+def main():
+    """Run the filtered vs. unfiltered retrieval benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--n-results", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    print(f"Indexed tax years: {retrieval.get_indexed_years()}")
+
+    report = {}
+    for mode in ("unfiltered", "filtered"):
+        cases = [run_case(r, mode == "filtered", args.repeat, args.n_results) for r in RECEIPTS]
+        report[mode] = {
+            "summary": summarize(cases),
+            "cases": [
+                {"receipt": r, "context_tokens": c["context_tokens"],
+                 "sources": c["sources"], "tax_years": c["tax_years"]}
+                for r, c in zip(RECEIPTS, cases)
+            ],
+        }
+        summary = report[mode]["summary"]
+        print(f"{mode:>10}: p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms, "
+              f"{summary['avg_context_tokens']} context tokens")
+
+    report["coverage_failures"] = check_coverage(args.n_results)
+    for failure in report["coverage_failures"]:
+        print(f"FAIL: {failure['expected']} not returned for {failure['receipt']['date']} "
+              f"with filter {failure['where']} (got {failure['sources']})")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if report["coverage_failures"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
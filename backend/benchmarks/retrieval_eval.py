@@ -0,0 +1,283 @@
+"""Evaluate retrieval quality and latency on the labeled tax corpus queries.
+
+Every combination of chunker, chunk size/overlap, embedding model, vector
+backend and retrieval mode is indexed into a throwaway snapshot and scored
+against retrieval_queries.json, where each Thai or English query lists the
+PDF pages that answer it. Reports recall@k and MRR (page level, plus
+source level since legacy chunks carry no page numbers), p50/p95 query
+latency, index build time and the prompt tokens the retrieved context
+costs. The JSON report is stable across runs, so it can be diffed between
+commits.
+
+Usage (from the backend directory):
+    python -m benchmarks.retrieval_eval [--chunkers legacy,structured]
+        [--chunk-sizes 1000] [--chunk-overlaps 200] [--embeddings default]
+        [--backends chroma,numpy] [--modes hybrid,vector] [--k 1,3,5]
+        [--n-results 3] [--repeat 5] [--output report.json]
+"""
+import argparse
+import itertools
+import json
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.agents.tax_expert import build_tax_expert_prompt
+from app.core.config import settings
+from app.services import retrieval
+from app.services.document_indexer import load_pdf_documents, build_chunks
+from app.services.index_snapshots import build_snapshot, snapshot_manager
+from app.services.vector_store import embed_texts
+from app.utils.tokens import count_tokens
+
+
+QUERIES_FILE = Path(__file__).resolve().parent / "retrieval_queries.json"
+
+SAMPLE_RECEIPT = {
+    "date": "2025-02-01",
+    "amount": 5000,
+    "merchant_name": "Bangkok Hospital",
+}
+
+
+def load_queries(path: Path = QUERIES_FILE) -> List[Dict[str, Any]]:
+    """Load the labeled queries: [{"query", "lang", "expected": [{"source", "pages"}]}]."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_relevant(hit: Dict[str, Any], expected: List[Dict[str, Any]], by_page: bool) -> bool:
+    """Return True if a hit comes from an expected source (and page, if by_page)."""
+    metadata = hit.get("metadata") or {}
+    for target in expected:
+        if metadata.get("source") != target["source"]:
+            continue
+        if not by_page:
+            return True
+        page = metadata.get("page")
+        if page is None:
+            continue
+        page_end = metadata.get("page_end", page)
+        if any(page <= p <= page_end for p in target["pages"]):
+            return True
+    return False
+
+
+def first_relevant_rank(hits: List[Dict[str, Any]], expected: List[Dict[str, Any]], by_page: bool) -> Optional[int]:
+    """Return the 1-based rank of the first relevant hit, or None."""
+    for rank, hit in enumerate(hits, start=1):
+        if is_relevant(hit, expected, by_page):
+            return rank
+    return None
+
+
+def score_ranks(ranks: List[Optional[int]], ks: List[int]) -> Dict[str, float]:
+    """Compute recall@k and MRR from first-relevant ranks."""
+    scores = {
+        f"recall@{k}": round(statistics.mean(rank is not None and rank <= k for rank in ranks), 4)
+        for k in ks
+    }
+    scores["mrr"] = round(statistics.mean(1.0 / rank if rank else 0.0 for rank in ranks), 4)
+    return scores
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of values."""
+    ordered = sorted(values)
+    return ordered[max(int(len(ordered) * fraction) - 1, 0)]
+
+
+def build_index(documents, chunker: str, chunk_size: int, chunk_overlap: int,
+                embedding: str, backend: str, work_dir: Path, embedding_cache: dict) -> Dict[str, Any]:
+    """Chunk, embed and publish one configuration as a snapshot under work_dir.
+
+    Embeddings are cached per chunking/embedding configuration, so backends
+    built from the same chunks are only charged for their own index build.
+    """
+    settings.CHUNKER = chunker
+    settings.CHUNK_SIZE = chunk_size
+    settings.CHUNK_OVERLAP = chunk_overlap
+    settings.EMBEDDING_MODEL = embedding
+
+    cache_key = (chunker, chunk_size, chunk_overlap, embedding)
+    if cache_key not in embedding_cache:
+        start = time.perf_counter()
+        chunks = build_chunks(documents, chunker=chunker)
+        chunk_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        embeddings = embed_texts([chunk["text"] for chunk in chunks])
+        embed_s = time.perf_counter() - start
+        embedding_cache[cache_key] = (chunks, embeddings, chunk_s, embed_s)
+
+    chunks, embeddings, chunk_s, embed_s = embedding_cache[cache_key]
+
+    settings.INDEX_SNAPSHOTS_DIR = work_dir / "-".join(str(part) for part in (*cache_key, backend))
+    start = time.perf_counter()
+    build_snapshot(chunks, embeddings, backend)
+    index_s = time.perf_counter() - start
+
+    return {
+        "chunk_count": len(chunks),
+        "chunk_s": round(chunk_s, 3),
+        "embed_s": round(embed_s, 3),
+        "index_s": round(index_s, 3),
+        "build_s": round(chunk_s + embed_s + index_s, 3),
+    }
+
+
+def evaluate_mode(queries: List[Dict[str, Any]], mode: str, ks: List[int],
+                  n_results: int, repeat: int, has_pages: bool) -> Dict[str, Any]:
+    """Run every labeled query against the published snapshot and score it."""
+    search = retrieval.search if mode == "hybrid" else retrieval.vector_search
+    depth = max(max(ks), n_results)
+
+    page_ranks, source_ranks, latencies = [], [], []
+    context_tokens, prompt_tokens = [], []
+    per_query = []
+
+    # Pin the snapshot for the whole run, as the request middleware does
+    with snapshot_manager.acquire():
+        for item in queries:
+            hits = search(item["query"], depth)  # warm up
+            for _ in range(repeat):
+                start = time.perf_counter()
+                hits = search(item["query"], depth)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            page_rank = first_relevant_rank(hits, item["expected"], by_page=True) if has_pages else None
+            source_rank = first_relevant_rank(hits, item["expected"], by_page=False)
+            page_ranks.append(page_rank)
+            source_ranks.append(source_rank)
+
+            context = "\n\n".join(hit["text"] for hit in hits[:n_results])
+            context_tokens.append(count_tokens(context))
+            prompt_tokens.append(count_tokens(build_tax_expert_prompt(SAMPLE_RECEIPT, context)))
+
+            per_query.append({
+                "query": item["query"],
+                "lang": item.get("lang"),
+                "page_rank": page_rank,
+                "source_rank": source_rank,
+            })
+
+    return {
+        "page": score_ranks(page_ranks, ks) if has_pages else None,
+        "source": score_ranks(source_ranks, ks),
+        "by_lang": {
+            lang: score_ranks(
+                [rank for rank, q in zip(page_ranks if has_pages else source_ranks, queries)
+                 if q.get("lang") == lang],
+                ks,
+            )
+            for lang in sorted({q.get("lang") for q in queries if q.get("lang")})
+        },
+        "latency": {
+            "p50_ms": round(statistics.median(latencies), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+        },
+        "tokens": {
+            "avg_context_tokens": round(statistics.mean(context_tokens), 1),
+            "avg_prompt_tokens": round(statistics.mean(prompt_tokens), 1),
+        },
+        "per_query": per_query,
+    }
+
+
+def git_commit() -> Optional[str]:
+    """Return the current git commit, if the backend is in a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def csv_list(value: str, cast=str) -> list:
+    """Split a comma-separated CLI option."""
+    return [cast(part.strip()) for part in value.split(",") if part.strip()]
+
+
+def main():
+    """Evaluate every requested configuration and write a JSON report."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunkers", default="legacy,structured")
+    parser.add_argument("--chunk-sizes", default=str(settings.CHUNK_SIZE))
+    parser.add_argument("--chunk-overlaps", default=str(settings.CHUNK_OVERLAP))
+    parser.add_argument("--embeddings", default=settings.EMBEDDING_MODEL)
+    parser.add_argument("--backends", default="chroma,numpy")
+    parser.add_argument("--modes", default="hybrid,vector", help="hybrid (BM25 + vector) and/or vector")
+    parser.add_argument("--k", default="1,3,5", help="Cutoffs for recall@k")
+    parser.add_argument("--n-results", type=int, default=settings.RAG_N_RESULTS,
+                        help="Chunks put into the prompt when counting tokens")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query")
+    parser.add_argument("--queries", type=Path, default=QUERIES_FILE)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    documents = load_pdf_documents()
+    if not documents:
+        print("No documents loaded. Exiting.")
+        return
+
+    ks = sorted(csv_list(args.k, int))
+    modes = csv_list(args.modes)
+    settings.HYBRID_SEARCH = True
+    settings.INDEX_RELOAD_INTERVAL = 0
+
+    results = []
+    embedding_cache = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for embedding, chunker, chunk_size, chunk_overlap, backend in itertools.product(
+            csv_list(args.embeddings),
+            csv_list(args.chunkers),
+            csv_list(args.chunk_sizes, int),
+            csv_list(args.chunk_overlaps, int),
+            csv_list(args.backends),
+        ):
+            build = build_index(documents, chunker, chunk_size, chunk_overlap,
+                                embedding, backend, Path(work_dir), embedding_cache)
+            for mode in modes:
+                config = {
+                    "chunker": chunker,
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": chunk_overlap,
+                    "embedding": embedding,
+                    "backend": backend,
+                    "mode": mode,
+                    "n_results": args.n_results,
+                }
+                evaluation = evaluate_mode(queries, mode, ks, args.n_results, args.repeat,
+                                           has_pages=chunker != "legacy")
+                results.append({"config": config, "build": build, **evaluation})
+
+                scores = evaluation["page"] or evaluation["source"]
+                print(f"{chunker}/{chunk_size}/{chunk_overlap} {embedding} {backend} {mode}: "
+                      f"recall@{ks[-1]} {scores[f'recall@{ks[-1]}']:.2f}, MRR {scores['mrr']:.2f}, "
+                      f"p95 {evaluation['latency']['p95_ms']:.1f} ms, "
+                      f"{evaluation['tokens']['avg_prompt_tokens']:.0f} prompt tokens")
+
+    report = {
+        "commit": git_commit(),
+        "documents": sorted(doc["source"] for doc in documents),
+        "queries": len(queries),
+        "k": ks,
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Load test retrieval with and without query micro-batching.
+
+Indexes the bundled corpus into a throwaway snapshot, then has N
+concurrent users (threads, like FastAPI's worker thread pool) each run a
+series of labeled queries through retrieval.search, first with every
+query embedded and searched on its own and then with the query batcher
+enabled. Reports throughput, latency percentiles and the batch sizes
+reached.
+
+Usage (from the backend directory):
+    python -m benchmarks.retrieval_load [--users 50] [--requests 20]
+        [--backend chroma] [--wait-ms 5] [--batch-size 32] [--output report.json]
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from app.core.config import settings
+from app.services import query_batcher as batching
+from app.services import retrieval
+from app.services.document_indexer import load_pdf_documents, build_chunks
+from app.services.index_snapshots import build_snapshot
+from app.services.vector_store import embed_texts
+from benchmarks.retrieval_eval import git_commit, load_queries, percentile
+
+
+def run_load(queries: List[str], users: int, requests: int) -> Dict[str, Any]:
+    """Run users x requests searches concurrently and time each one."""
+    latencies: List[float] = []
+    errors = []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(users + 1)
+
+    def user(offset: int) -> None:
+        start_gate.wait()
+        for i in range(requests):
+            query = queries[(offset + i) % len(queries)]
+            t0 = time.perf_counter()
+            try:
+                retrieval.search(query)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - t0) * 1000)
+
+    threads = [threading.Thread(target=user, args=(offset,)) for offset in range(users)]
+    for thread in threads:
+        thread.start()
+    start_gate.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "queries": len(latencies),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_qps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+    }
+
+
+def main():
+    """Index the corpus and compare unbatched and batched retrieval under load."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50, help="Concurrent users")
+    parser.add_argument("--requests", type=int, default=20, help="Searches per user")
+    parser.add_argument("--backend", default=settings.VECTOR_BACKEND)
+    parser.add_argument("--wait-ms", type=float, default=settings.RETRIEVAL_BATCH_WAIT_MS)
+    parser.add_argument("--batch-size", type=int, default=settings.RETRIEVAL_BATCH_SIZE)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    queries = [query["query"] for query in load_queries()]
+    documents = load_pdf_documents()
+    if not documents:
+        print("No documents loaded. Exiting.")
+        return
+
+    settings.INDEX_RELOAD_INTERVAL = 0
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        chunks = build_chunks(documents)
+        embeddings = embed_texts([chunk["text"] for chunk in chunks])
+        settings.INDEX_SNAPSHOTS_DIR = Path(work_dir)
+        build_snapshot(chunks, embeddings, args.backend)
+
+        for mode in ("unbatched", "batched"):
+            settings.RETRIEVAL_BATCHING = mode == "batched"
+            batcher = batching.QueryBatcher(args.batch_size, args.wait_ms)
+            retrieval.query_batcher = batcher
+
+            retrieval.search(queries[0])  # warm up the model and snapshot
+            results[mode] = run_load(queries, args.users, args.requests)
+            if mode == "batched":
+                results[mode]["batching"] = batcher.stats()
+
+            print(f"{mode:>9}: {results[mode]['throughput_qps']} queries/s, "
+                  f"p50 {results[mode]['p50_ms']} ms, p95 {results[mode]['p95_ms']} ms, "
+                  f"p99 {results[mode]['p99_ms']} ms")
+
+    speedup = results["batched"]["throughput_qps"] / max(results["unbatched"]["throughput_qps"], 1e-9)
+    print(f"Throughput gain with batching: {speedup:.2f}x "
+          f"(avg batch {results['batched']['batching']['avg_batch_size']})")
+
+    report = {
+        "commit": git_commit(),
+        "backend": args.backend,
+        "users": args.users,
+        "requests_per_user": args.requests,
+        "chunks": len(chunks),
+        "results": results,
+        "speedup": round(speedup, 2),
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
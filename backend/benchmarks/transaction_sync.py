@@ -0,0 +1,126 @@
+"""Compare full transaction listings with delta sync.
+
+Runs against a real Postgres through Supabase (see
+benchmarks/dashboard_summary.py) with app/database/sql/transaction_sync.sql
+applied. Seeds --transactions rows for --user-id, takes a full sync, then
+for each of --runs refreshes:
+
+- full: the transaction list and dashboard summary as clients fetched them
+  before, i.e. get_user_transactions plus get_transaction_totals
+- delta: transaction_sync.sync from the previous cursor
+
+after updating --changes rows and deleting one. Reports latency and
+response bytes, and checks that applying the deltas gives the same rows.
+The seeded rows are deleted afterwards.
+
+Usage (from the backend directory):
+    python -m benchmarks.transaction_sync --user-id <uuid>
+        [--transactions 2000] [--changes 3] [--runs 10] [--output report.json]
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+from app.agents.accountant import get_user_transactions
+from app.database.database import supabase
+from app.services import transaction_stats, transaction_sync
+from app.services.dashboard_cache import dashboard_cache
+from benchmarks.dashboard_summary import SEED_MERCHANT, seed
+from benchmarks.retrieval_eval import git_commit, percentile
+
+
+def size(response: Dict[str, Any]) -> int:
+    """Bytes of a response serialized as JSON."""
+    return len(json.dumps(response, default=str))
+
+
+def report(latencies: List[float], sizes: List[int]) -> Dict[str, Any]:
+    """Latency percentiles and median size of a set of refreshes."""
+    return {
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p50_bytes": int(percentile(sizes, 0.50)),
+    }
+
+
+def main():
+    """Seed transactions and compare full refreshes with delta syncs."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user-id", required=True, help="Existing user to seed transactions for")
+    parser.add_argument("--transactions", type=int, default=2000)
+    parser.add_argument("--changes", type=int, default=3, help="Rows updated before each refresh")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    seed(args.user_id, args.transactions, rng)
+    try:
+        local: Dict[str, Dict[str, Any]] = {}
+        cursor, summary_etag = None, None
+        while True:
+            result = transaction_sync.sync(args.user_id, cursor, summary_etag)
+            if not result.get("success"):
+                raise SystemExit(result.get("error"))
+            local.update({str(row["id"]): row for row in result["transactions"]})
+            cursor, summary_etag = result["cursor"], result["summary_etag"]
+            if not result["has_more"]:
+                break
+        if result["full"] and cursor is None:
+            raise SystemExit("Delta sync is not available; apply app/database/sql/transaction_sync.sql")
+
+        full_latencies, full_sizes, delta_latencies, delta_sizes = [], [], [], []
+        for _ in range(args.runs):
+            ids = list(local)
+            for transaction_id in rng.sample(ids, min(args.changes, len(ids))):
+                supabase.table("transactions").update(
+                    {"total_amount": round(rng.uniform(100, 50000), 2)}
+                ).eq("id", transaction_id).execute()
+            supabase.table("transactions").delete().eq("id", rng.choice(ids)).execute()
+            dashboard_cache.bump(args.user_id)  # as the API's write paths do
+
+            t0 = time.perf_counter()
+            full = get_user_transactions(args.user_id)
+            totals = transaction_stats.get_transaction_totals(args.user_id)
+            full_latencies.append((time.perf_counter() - t0) * 1000)
+            full_sizes.append(size(full) + size(totals))
+
+            t0 = time.perf_counter()
+            delta = transaction_sync.sync(args.user_id, cursor, summary_etag)
+            delta_latencies.append((time.perf_counter() - t0) * 1000)
+            delta_sizes.append(size(delta))
+            local.update({str(row["id"]): row for row in delta["transactions"]})
+            for transaction_id in delta["deleted"]:
+                local.pop(transaction_id, None)
+            cursor, summary_etag = delta["cursor"], delta["summary_etag"]
+
+        expected = {str(row["id"]): row for row in full["transactions"]}
+        matches = local == expected
+        results = {"full": report(full_latencies, full_sizes), "delta": report(delta_latencies, delta_sizes)}
+        for mode, result in results.items():
+            print(f"{mode:>5}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+                  f"{result['p50_bytes']:,} bytes per refresh")
+        print(f"Local copy after {args.runs} delta syncs: {'matches' if matches else 'DIFFERS from'} the full listing "
+              f"({len(local)} vs {len(expected)} rows; full listings are capped by max-rows)")
+    finally:
+        supabase.table("transactions").delete().eq("user_id", args.user_id).eq(
+            "merchant_name", SEED_MERCHANT
+        ).execute()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "transactions": args.transactions,
+                "changes": args.changes,
+                "runs": args.runs,
+                "results": results,
+                "matches": matches,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
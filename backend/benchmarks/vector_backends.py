@@ -0,0 +1,108 @@
+"""Compare the Chroma and NumPy vector store backends.
+
+Builds both indexes from the bundled corpus (embedding it once), then runs
+each backend in a fresh subprocess to measure cold start (import + open +
+first query), warm query latency and peak RSS.
+
+Usage (from the backend directory):
+    python -m benchmarks.vector_backends [--repeat 200] [--output report.json]
+"""
+import argparse
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+QUERIES = [
+    "เบี้ยประกันสุขภาพ หักลดหย่อน",
+    "Easy E-Receipt 2.0 limit",
+    "เงินบริจาค e-Donation 2 เท่า",
+    "กองทุน SSF RMF Thai ESG",
+    "ดอกเบี้ยเงินกู้ยืมเพื่อซื้อที่อยู่อาศัย",
+]
+
+
+def run_child(backend: str, path: str, repeat: int) -> None:
+    """Measure one backend in this (fresh) process and print JSON."""
+    start = time.perf_counter()
+    from app.services.vector_store import load_vector_store, embed_texts
+
+    store = load_vector_store(backend, Path(path))
+    embed_texts(["warm up"])  # load the ONNX model outside the timed query
+    store.query(QUERIES[0], 3)
+    cold_start_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for i in range(repeat):
+        query = QUERIES[i % len(QUERIES)]
+        t0 = time.perf_counter()
+        store.query(query, 3, {"tax_year": {"$in": [2025, 0]}})
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    latencies.sort()
+    print(json.dumps({
+        "backend": backend,
+        "chunks": store.count(),
+        "cold_start_ms": round(cold_start_ms, 1),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def build_indexes(work_dir: Path) -> dict:
+    """Build Chroma and NumPy indexes of the corpus under work_dir."""
+    from app.services.document_indexer import load_pdf_documents, build_chunks
+    from app.services.vector_store import embed_texts, load_vector_store
+
+    chunks = build_chunks(load_pdf_documents())
+    embeddings = embed_texts([chunk["text"] for chunk in chunks])
+
+    paths = {}
+    for backend in ("chroma", "numpy"):
+        path = work_dir / backend
+        load_vector_store(backend, path).write(chunks, embeddings)
+        paths[backend] = str(path)
+    return paths
+
+
+def main():
+    """Build both indexes and benchmark each backend in a subprocess."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--child", nargs=2, metavar=("BACKEND", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths = build_indexes(Path(work_dir))
+
+        results = []
+        for backend, path in paths.items():
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.vector_backends",
+                 "--repeat", str(args.repeat), "--child", backend, path],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    for result in results:
+        print(f"{result['backend']:>7}: cold start {result['cold_start_ms']} ms, "
+              f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, RSS {result['max_rss_mb']} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Measure the per-request cost of compiling the LangGraph workflow.
+
+Before the compiled graph was cached, every run_tax_assistant call (and
+every receipt request, once they go through the graph) paid for
+StateGraph(...).compile(). This times a fresh build_workflow() against
+the cached get_workflow() lookup that replaced it.
+
+Usage (from the backend directory):
+    python -m benchmarks.workflow_compile [--repeat 50] [--output report.json]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app.services import workflow
+from benchmarks.retrieval_eval import git_commit, percentile
+
+
+def time_calls(fn, repeat: int) -> dict:
+    """Call fn repeat times and return latency statistics in ms."""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "mean_ms": round(statistics.mean(latencies), 4),
+        "p50_ms": round(percentile(latencies, 0.50), 4),
+        "p95_ms": round(percentile(latencies, 0.95), 4),
+    }
+
+
+def main():
+    """Compare compiling the workflow per request with reusing the cached graph."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    workflow.get_workflow()  # import-time and first-compile costs are not per request
+
+    results = {
+        "compile_per_request": time_calls(workflow.build_workflow, args.repeat),
+        "cached": time_calls(workflow.get_workflow, args.repeat),
+    }
+    saved = results["compile_per_request"]["mean_ms"] - results["cached"]["mean_ms"]
+
+    for mode, stats in results.items():
+        print(f"{mode:>19}: mean {stats['mean_ms']:.3f} ms, p50 {stats['p50_ms']:.3f} ms, "
+              f"p95 {stats['p95_ms']:.3f} ms")
+    print(f"Overhead removed per request: {saved:.2f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "repeat": args.repeat,
+                "results": results,
+                "saved_ms_per_request": round(saved, 3),
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
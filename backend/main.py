@@ -3,6 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 from app.api.v1.router import api_router
+from app.services.tax_rule_cache import tax_rule_cache
+from app.services.workflow import get_workflow, prune_expired_threads
 
 app = FastAPI(
     title="TicTaxFlow API",
@@ -19,6 +21,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def compile_workflow():
+    """Compile the tax assistant graph once, before the first request."""
+    get_workflow()
+    prune_expired_threads()
+
+
+@app.on_event("startup")
+def load_tax_rules():
+    """Load the tax rule cache, so the first receipt does not wait for it."""
+    tax_rule_cache.refresh()
+
+
 # Mount static files for receipts
 receipts_dir = Path(__file__).parent / "data" / "receipts"
 receipts_dir.mkdir(parents=True, exist_ok=True)
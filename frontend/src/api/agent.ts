@@ -2,16 +2,18 @@ import { apiClient } from './client';
 
 interface ChatRequest {
   message: string;
+  session_id?: string;
 }
 
 interface ChatResponse {
   response: string;
   timestamp: string;
+  session_id?: string;
 }
 
 export const agentApi = {
-  sendMessage: async (message: string): Promise<ChatResponse> => {
-    const requestData: ChatRequest = { message };
+  sendMessage: async (message: string, sessionId?: string): Promise<ChatResponse> => {
+    const requestData: ChatRequest = { message, session_id: sessionId };
     return apiClient.post<ChatResponse>('/agent/chat', requestData, {
       requiresAuth: true,
     });
@@ -4,17 +4,20 @@ import type {
   DashboardSummaryResponse,
 } from '../types/dashboard';
 
+// Deductible totals and limits cover one tax year; the backend defaults to the current one
+const taxYearQuery = (taxYear?: number) => (taxYear ? `?tax_year=${taxYear}` : '');
+
 export const dashboardApi = {
-  getStats: async (userId: string): Promise<DashboardStatsResponse> => {
+  getStats: async (userId: string, taxYear?: number): Promise<DashboardStatsResponse> => {
     return apiClient.get<DashboardStatsResponse>(
-      `/dashboard/stats/${userId}`,
+      `/dashboard/stats/${userId}${taxYearQuery(taxYear)}`,
       { requiresAuth: true }
     );
   },
 
-  getSummary: async (userId: string): Promise<DashboardSummaryResponse> => {
+  getSummary: async (userId: string, taxYear?: number): Promise<DashboardSummaryResponse> => {
     return apiClient.get<DashboardSummaryResponse>(
-      `/dashboard/summary/${userId}`,
+      `/dashboard/summary/${userId}${taxYearQuery(taxYear)}`,
       { requiresAuth: true }
     );
   },
@@ -1,4 +1,10 @@
-import { UploadReceiptRequest, UploadReceiptResponse } from '../types/receipt';
+import {
+  ReceiptStageEvent,
+  ResumeReceiptRequest,
+  ResumeReceiptResponse,
+  UploadReceiptRequest,
+  UploadReceiptResponse,
+} from '../types/receipt';
 
 const API_BASE_URL = 'http://localhost:8000/api/v1';
 
@@ -26,4 +32,76 @@ export const receiptApi = {
 
     return response.json();
   },
+
+  // Same upload as uploadReceipt, but reports each stage (stored, normalized,
+  // extracted, classified, saved) as it finishes. Aborting the signal closes
+  // the connection, which stops the stages that have not started yet.
+  uploadReceiptStream: async (
+    request: UploadReceiptRequest,
+    onStage: (event: ReceiptStageEvent) => void,
+    signal?: AbortSignal,
+  ): Promise<void> => {
+    const formData = new FormData();
+    formData.append('file', request.file);
+    formData.append('user_id', request.user_id);
+    if (request.category_name) {
+      formData.append('category_name', request.category_name);
+    }
+
+    const response = await fetch(`${API_BASE_URL}/receipts/upload/stream`, {
+      method: 'POST',
+      body: formData,
+      signal,
+    });
+
+    if (!response.ok || !response.body) {
+      const errorData = await response.json().catch(() => ({ detail: 'Upload failed' }));
+      throw new Error(errorData.detail || `Upload failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      // Events are separated by a blank line: "event: <stage>\ndata: <json>"
+      let boundary = buffer.indexOf('\n\n');
+      while (boundary !== -1) {
+        const block = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        boundary = buffer.indexOf('\n\n');
+
+        const stage = block.match(/^event: (.*)$/m)?.[1];
+        const data = block.match(/^data: (.*)$/m)?.[1];
+        if (!stage || !data) continue;
+
+        const event = { stage, data: JSON.parse(data) } as ReceiptStageEvent;
+        if (event.stage === 'error') {
+          throw new Error(String(event.data.detail || 'Processing failed'));
+        }
+        onStage(event);
+      }
+    }
+  },
+
+  // Continues a receipt that stopped at needs_input with the fields the
+  // user filled in; the receipt is not read again.
+  resumeReceipt: async (request: ResumeReceiptRequest): Promise<ResumeReceiptResponse> => {
+    const response = await fetch(`${API_BASE_URL}/workflow/resume`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(request),
+    });
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({ detail: 'Saving receipt failed' }));
+      throw new Error(errorData.detail || `Saving receipt failed with status ${response.status}`);
+    }
+
+    return response.json();
+  },
 };
@@ -9,9 +9,10 @@ export const transactionsApi = {
         });
     },
 
-    // Get transaction summary stats for a user
-    getSummary: async (userId: string): Promise<any> => {
-        return apiClient.get(`/transactions/summary/${userId}`, {
+    // Get transaction summary stats for a user (deductible total of one tax year, default: current)
+    getSummary: async (userId: string, taxYear?: number): Promise<any> => {
+        const query = taxYear ? `?tax_year=${taxYear}` : '';
+        return apiClient.get(`/transactions/summary/${userId}${query}`, {
             requiresAuth: true,
         });
     },
@@ -1,22 +1,62 @@
-import React, { useState, useRef, DragEvent, ChangeEvent } from 'react';
-import { UploadCloud, FileUp, CheckCircle2, XCircle, Loader2 } from 'lucide-react';
+import React, { useState, useRef, useEffect, DragEvent, ChangeEvent, FormEvent } from 'react';
+import { UploadCloud, FileUp, CheckCircle2, XCircle, Loader2, AlertCircle } from 'lucide-react';
 import { receiptApi } from '../../api';
 import { storage } from '../../lib/storage';
+import { ReceiptField, ReceiptStageEvent } from '../../types/receipt';
 
 interface UploadStatus {
-  status: 'idle' | 'uploading' | 'success' | 'error';
+  status: 'idle' | 'uploading' | 'needs_input' | 'success' | 'error';
   message?: string;
   fileName?: string;
 }
 
+// A receipt the workflow could not save until the user fills in some fields
+interface PendingInput {
+  threadId: string;
+  missingFields: ReceiptField[];
+  values: Record<ReceiptField, string>;
+}
+
+const fieldLabels: Record<ReceiptField, string> = {
+  date: 'Date',
+  amount: 'Amount (THB)',
+  tax_id: 'Tax ID',
+  merchant_name: 'Merchant',
+};
+
+const fieldInputTypes: Record<ReceiptField, string> = {
+  date: 'date',
+  amount: 'number',
+  tax_id: 'text',
+  merchant_name: 'text',
+};
+
 interface UploadZoneProps {
   onUploadSuccess?: () => void;
 }
 
+const describeStage = ({ stage, data }: ReceiptStageEvent): string | null => {
+    switch (stage) {
+        case 'stored': return 'Receipt uploaded. Checking image...';
+        case 'normalized': return 'Reading receipt...';
+        case 'extracted': {
+            const fields = data.fields as Record<string, unknown>;
+            return `Found ${fields.merchant_name ?? 'receipt'}, ${fields.amount ?? '?'} THB. Classifying...`;
+        }
+        case 'classified': return `Category: ${data.category ?? 'None'}. Saving...`;
+        default: return null;
+    }
+};
+
 const UploadZone: React.FC<UploadZoneProps> = ({ onUploadSuccess }) => {
     const [uploadStatus, setUploadStatus] = useState<UploadStatus>({ status: 'idle' });
     const [isDragging, setIsDragging] = useState(false);
+    const [pendingInput, setPendingInput] = useState<PendingInput | null>(null);
     const fileInputRef = useRef<HTMLInputElement>(null);
+    const abortRef = useRef<AbortController | null>(null);
+
+    // Leaving the page closes the stream, which stops the remaining stages
+    useEffect(() => () => abortRef.current?.abort(), []);
 
     const allowedTypes = ['image/jpeg', 'image/jpg', 'image/png', 'application/pdf'];
     const maxSizeMB = 10;
@@ -61,51 +101,150 @@ const UploadZone: React.FC<UploadZoneProps> = ({ onUploadSuccess }) => {
             fileName: file.name 
         });
 
+        abortRef.current?.abort();
+        const controller = new AbortController();
+        abortRef.current = controller;
+
+        setPendingInput(null);
+
         try {
-            const response = await receiptApi.uploadReceipt({
-                file,
-                user_id: userId
-            });
+            const pending: { input?: PendingInput } = {};
 
-            setUploadStatus({ 
-                status: 'success', 
-                message: 'Receipt processed successfully!',
-                fileName: file.name 
-            });
+            await receiptApi.uploadReceiptStream(
+                { file, user_id: userId },
+                (event) => {
+                    if (event.stage === 'needs_input') {
+                        const extracted = (event.data.extracted_data ?? {}) as Record<string, unknown>;
+                        const values = {} as Record<ReceiptField, string>;
+                        (Object.keys(fieldLabels) as ReceiptField[]).forEach((field) => {
+                            values[field] = extracted[field] == null ? '' : String(extracted[field]);
+                        });
+                        pending.input = {
+                            threadId: String(event.data.thread_id),
+                            missingFields: event.data.missing_fields as ReceiptField[],
+                            values,
+                        };
+                        return;
+                    }
+                    const message = describeStage(event);
+                    if (message) {
+                        setUploadStatus({ status: 'uploading', message, fileName: file.name });
+                    }
+                },
+                controller.signal
+            );
 
-            // Wait for database to commit before refreshing dashboard
-            setTimeout(() => {
-                if (onUploadSuccess) {
-                    onUploadSuccess();
-                }
-            }, 500);
+            if (pending.input) {
+                setPendingInput(pending.input);
+                setUploadStatus({
+                    status: 'needs_input',
+                    message: 'Some details could not be read from the receipt.',
+                    fileName: file.name
+                });
+                return;
+            }
 
-            setTimeout(() => {
-                setUploadStatus({ status: 'idle' });
-            }, 3000);
+            finishUpload(file.name);
 
         } catch (error) {
-            let errorMessage = 'Upload failed. Please try again.';
-            
-            if (error instanceof Error) {
-                errorMessage = error.message;
-                
-                // Provide helpful messages for specific errors
-                if (errorMessage.includes('AI service configuration')) {
-                    errorMessage = 'AI service is not configured. Please contact administrator.';
-                } else if (errorMessage.includes('API key')) {
-                    errorMessage = 'AI service error. Please contact administrator.';
-                }
+            if (controller.signal.aborted) {
+                return;
             }
+            showError(error, 'Upload failed. Please try again.', file.name);
+        }
+    };
+
+    const finishUpload = (fileName?: string) => {
+        setUploadStatus({ 
+            status: 'success', 
+            message: 'Receipt processed successfully!',
+            fileName 
+        });
+
+        // Wait for database to commit before refreshing dashboard
+        setTimeout(() => {
+            if (onUploadSuccess) {
+                onUploadSuccess();
+            }
+        }, 500);
+
+        setTimeout(() => {
+            setUploadStatus({ status: 'idle' });
+        }, 3000);
+    };
+
+    const showError = (error: unknown, fallback: string, fileName?: string) => {
+        let errorMessage = fallback;
+        
+        if (error instanceof Error) {
+            errorMessage = error.message;
             
-            setUploadStatus({ 
-                status: 'error', 
-                message: errorMessage,
-                fileName: file.name 
+            // Provide helpful messages for specific errors
+            if (errorMessage.includes('AI service configuration')) {
+                errorMessage = 'AI service is not configured. Please contact administrator.';
+            } else if (errorMessage.includes('API key')) {
+                errorMessage = 'AI service error. Please contact administrator.';
+            }
+        }
+        
+        setUploadStatus({ 
+            status: 'error', 
+            message: errorMessage,
+            fileName 
+        });
+    };
+
+    const handlePendingInputChange = (field: ReceiptField, value: string) => {
+        setPendingInput((current) => current && { ...current, values: { ...current.values, [field]: value } });
+    };
+
+    const handleResumeSubmit = async (e: FormEvent<HTMLFormElement>) => {
+        e.preventDefault();
+        const userId = storage.getUserId();
+        if (!pendingInput || !userId) {
+            return;
+        }
+
+        const fileName = uploadStatus.fileName;
+        const { date, amount, tax_id, merchant_name } = pendingInput.values;
+        setUploadStatus({ status: 'uploading', message: 'Saving receipt...', fileName });
+
+        try {
+            const { data } = await receiptApi.resumeReceipt({
+                thread_id: pendingInput.threadId,
+                user_id: userId,
+                date: date || undefined,
+                amount: amount ? Number(amount) : undefined,
+                tax_id: tax_id || undefined,
+                merchant_name: merchant_name || undefined,
             });
+
+            if (data.status === 'awaiting_user_input') {
+                setPendingInput({ ...pendingInput, missingFields: data.missing_fields });
+                setUploadStatus({
+                    status: 'needs_input',
+                    message: 'Some details are still missing.',
+                    fileName
+                });
+                return;
+            }
+
+            setPendingInput(null);
+            if (data.accountant_result.success === false) {
+                throw new Error(data.accountant_result.error || 'Saving receipt failed.');
+            }
+            finishUpload(fileName);
+
+        } catch (error) {
+            showError(error, 'Saving receipt failed. Please try again.', fileName);
         }
     };
 
+    const handleResumeCancel = () => {
+        setPendingInput(null);
+        setUploadStatus({ status: 'idle' });
+    };
+
     const handleDragOver = (e: DragEvent<HTMLDivElement>) => {
         e.preventDefault();
         setIsDragging(true);
@@ -134,7 +273,7 @@ const UploadZone: React.FC<UploadZoneProps> = ({ onUploadSuccess }) => {
     };
 
     const handleClick = () => {
-        if (uploadStatus.status !== 'uploading') {
+        if (uploadStatus.status !== 'uploading' && uploadStatus.status !== 'needs_input') {
             fileInputRef.current?.click();
         }
     };
@@ -142,6 +281,7 @@ const UploadZone: React.FC<UploadZoneProps> = ({ onUploadSuccess }) => {
     const getStatusColor = () => {
         switch (uploadStatus.status) {
             case 'uploading': return 'border-blue-500 bg-blue-50/50';
+            case 'needs_input': return 'border-amber-500 bg-amber-50/50';
             case 'success': return 'border-green-500 bg-green-50/50';
             case 'error': return 'border-red-500 bg-red-50/50';
             default: return isDragging ? 'border-blue-500 bg-blue-50/50' : 'border-slate-300 bg-slate-50';
@@ -157,7 +297,7 @@ const UploadZone: React.FC<UploadZoneProps> = ({ onUploadSuccess }) => {
                             <Loader2 size={32} className="text-blue-500 animate-spin" />
                         </div>
                         <p className="mb-2 text-sm font-medium text-slate-700">
-                            Processing receipt...
+                            {uploadStatus.message || 'Processing receipt...'}
                         </p>
                         <p className="text-xs text-slate-500">
                             {uploadStatus.fileName}
@@ -165,6 +305,51 @@ const UploadZone: React.FC<UploadZoneProps> = ({ onUploadSuccess }) => {
                     </div>
                 );
             
+            case 'needs_input':
+                return pendingInput && (
+                    <form
+                        onSubmit={handleResumeSubmit}
+                        onClick={(e) => e.stopPropagation()}
+                        className="flex flex-col items-center justify-center w-full max-w-md px-4 py-4 text-center"
+                    >
+                        <p className="mb-3 text-sm font-medium text-amber-700 flex items-center gap-1">
+                            <AlertCircle size={16} />
+                            {uploadStatus.message}
+                        </p>
+                        <div className="grid grid-cols-2 gap-2 w-full mb-3">
+                            {pendingInput.missingFields.map((field) => (
+                                <label key={field} className="text-left text-xs text-slate-600">
+                                    {fieldLabels[field] ?? field}
+                                    <input
+                                        type={fieldInputTypes[field] ?? 'text'}
+                                        value={pendingInput.values[field] ?? ''}
+                                        onChange={(e) => handlePendingInputChange(field, e.target.value)}
+                                        required
+                                        min={field === 'amount' ? '0' : undefined}
+                                        step={field === 'amount' ? '0.01' : undefined}
+                                        className="mt-1 block w-full px-2 py-1 border border-slate-200 rounded-lg text-sm text-slate-900 focus:outline-none focus:ring-2 focus:ring-blue-500 bg-white"
+                                    />
+                                </label>
+                            ))}
+                        </div>
+                        <div className="flex gap-3">
+                            <button
+                                type="submit"
+                                className="px-3 py-1 text-xs font-medium text-white bg-blue-600 rounded-lg hover:bg-blue-700"
+                            >
+                                Save receipt
+                            </button>
+                            <button
+                                type="button"
+                                onClick={handleResumeCancel}
+                                className="text-xs text-slate-600 hover:underline"
+                            >
+                                Cancel
+                            </button>
+                        </div>
+                    </form>
+                );
+
             case 'success':
                 return (
                     <div className="flex flex-col items-center justify-center pt-5 pb-6 text-center">
@@ -228,7 +413,7 @@ const UploadZone: React.FC<UploadZoneProps> = ({ onUploadSuccess }) => {
                 onDrop={handleDrop}
             >
                 <div className={`
-          flex flex-col items-center justify-center w-full h-48 
+          flex flex-col items-center justify-center w-full ${uploadStatus.status === 'needs_input' ? 'min-h-48' : 'h-48'} 
           rounded-xl border-2 border-dashed
           transition-all duration-200 ease-in-out
           group-hover:border-blue-500
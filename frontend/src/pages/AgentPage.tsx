@@ -24,6 +24,8 @@ const AgentPage: React.FC = () => {
     const [inputValue, setInputValue] = useState('');
     const [isTyping, setIsTyping] = useState(false);
     const messagesEndRef = useRef<HTMLDivElement>(null);
+    // Server-side chat session, so follow-up questions keep their context
+    const sessionIdRef = useRef<string | undefined>(undefined);
 
     // Auto-scroll to bottom when messages change
     useEffect(() => {
@@ -47,7 +49,8 @@ const AgentPage: React.FC = () => {
         setIsTyping(true);
 
         try {
-            const response = await agentApi.sendMessage(userQuestion);
+            const response = await agentApi.sendMessage(userQuestion, sessionIdRef.current);
+            sessionIdRef.current = response.session_id;
             
             const newAgentMessage: Message = {
                 id: (Date.now() + 1).toString(),
@@ -59,6 +62,8 @@ const AgentPage: React.FC = () => {
             setMessages(prev => [...prev, newAgentMessage]);
         } catch (error) {
             console.error('Failed to send message:', error);
+            // The session may have expired; start a new one on the next message
+            sessionIdRef.current = undefined;
             
             const errorMessage: Message = {
                 id: (Date.now() + 1).toString(),
@@ -1,4 +1,5 @@
 export interface DashboardStats {
+  tax_year: number;
   total_deductible: number;
   total_documents: number;
   verified_count: number;
@@ -33,6 +34,7 @@ export interface CategoryBreakdown {
 }
 
 export interface DashboardSummary {
+  tax_year: number;
   total_deductible_amount: number;
   total_transactions: number;
   status_breakdown: StatusBreakdown;
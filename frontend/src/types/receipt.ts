@@ -39,3 +39,45 @@ export interface UploadReceiptRequest {
   user_id: string;
   category_name?: string;
 }
+
+export type ReceiptStage =
+  | 'stored'
+  | 'normalized'
+  | 'extracted'
+  | 'classified'
+  | 'saved'
+  | 'needs_input'
+  | 'done'
+  | 'error';
+
+export interface ReceiptStageEvent {
+  stage: ReceiptStage;
+  data: Record<string, unknown>;
+}
+
+// Fields the workflow needs before it can save a receipt
+export type ReceiptField = 'date' | 'amount' | 'tax_id' | 'merchant_name';
+
+export interface ResumeReceiptRequest {
+  thread_id: string;
+  user_id: string;
+  date?: string;
+  amount?: number;
+  tax_id?: string;
+  merchant_name?: string;
+}
+
+export interface ResumeReceiptResponse {
+  success: boolean;
+  data: {
+    thread_id: string;
+    status: string;
+    receipt_data: Record<string, unknown>;
+    missing_fields: ReceiptField[];
+    accountant_result: {
+      success?: boolean;
+      error?: string;
+      data?: TransactionData;
+    };
+  };
+}